@@ -4,6 +4,8 @@ import os.path
 from troposphere import Template, Tags, Ref, GetAtt, Parameter, ImportValue, Output, Export
 from troposphere.ec2 import SecurityGroup, SecurityGroupRule, Instance
 
+from Shared import template_writer
+
 template = Template()
 template.add_version('2010-09-09')
 
@@ -11,41 +13,29 @@ template.add_description("BastionHost Instance")
 
 
 class BastionHost:
-    def __init__(self, stage, key_name, security_group_name, instance_name, instance_type, 
-                 instance_ami, bastion_vpc_name, bastion_vpc_subnets):
-        self.stage = stage
-        self.key_name = key_name
-        self.security_group_name = security_group_name
-        self.instance_name = instance_name
-        self.instance_type = instance_type
-        self.instance_ami = instance_ami
-        self.bastion_vpc_subnets = bastion_vpc_subnets
-        self.bastion_vpc_name = bastion_vpc_name
+    def __init__(self, host, bastion_vpc, template_format="yaml", output_dir="modules"):
+        # host and bastion_vpc are a Shared.environment.Host and Vpc
+        self.stage = bastion_vpc.stage
+        self.host = host
+        self.bastion_vpc = bastion_vpc
+        self.template_path = os.path.join(output_dir, template_writer.template_file_name("template_bastion_host",
+                                                                                         template_format))
 
     def create_bastion_host(self):
 
         template = Template()
         template.add_version('2010-09-09')
 
-        # Wordpress preparation: format vpc name and dump public subnets in a separate list
-
-        vpc_name_formatted = ''.join(
-            e for e in self.bastion_vpc_name if e.isalnum()).capitalize()
-        
-        filter_public_subnets = filter(lambda x : x["type"] == "public", self.bastion_vpc_subnets)
-
-        public_subnets = []
-        for subnet in filter_public_subnets:
-            subnet_name_formatted = ''.join(e for e in subnet["name"] if e.isalnum()).capitalize()
+        # Public subnets of the bastion VPC, imported from its stack
 
-            public_subnets.append(ImportValue("{}{}{}SubnetId".format(self.stage, vpc_name_formatted, subnet_name_formatted)))
+        public_subnets = [ImportValue(export_name) for export_name in self.bastion_vpc.public_subnet_exports]
 
         bastion_host_security_group = template.add_resource(
             SecurityGroup(
                 "{}BastionHostSecurityGroup".format(self.stage),
-                GroupName=self.security_group_name,
+                GroupName=self.host.security_group_name,
                 GroupDescription="Enables external ssh access to the bastion host",
-                VpcId=ImportValue("{}{}VpcId".format(self.stage,vpc_name_formatted)),
+                VpcId=ImportValue(self.bastion_vpc.vpc_id_export),
                 SecurityGroupIngress=[
                     SecurityGroupRule(
                         IpProtocol="tcp",
@@ -61,12 +51,12 @@ class BastionHost:
             Instance(
                 "{}BastionHost".format(self.stage),
                 Tags=Tags(
-                    Name=self.instance_name
+                    Name=self.host.instance_name
                 ),
                 SecurityGroupIds=[Ref(bastion_host_security_group)],
-                InstanceType=self.instance_type,
-                ImageId=self.instance_ami,
-                KeyName=self.key_name,
+                InstanceType=self.host.instance_type,
+                ImageId=self.host.instance_ami,
+                KeyName=self.host.key_name,
                 SubnetId=next(iter(public_subnets))
             )
         )
@@ -82,5 +72,7 @@ class BastionHost:
             ]
         )
 
-        f = open("modules/template_bastion_host.yaml", 'w')
-        print(template.to_yaml(), file=f)
+        template_writer.write_template(template.to_dict(), self.template_path)
+
+        return self.template_path
+
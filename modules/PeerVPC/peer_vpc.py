@@ -2,9 +2,13 @@
 # import sys
 # import os.path
 
+import os.path
+
 from troposphere import Template, Tags, Ref, ImportValue
 from troposphere.ec2 import VPCPeeringConnection, Route
 
+from Shared import template_writer
+
 # sys.path.append(
 #     os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
 
@@ -12,30 +16,29 @@ from troposphere.ec2 import VPCPeeringConnection, Route
 # cf_helper.profile = "default"
 
 class PeerVPC:
-    def __init__(self,stage,source_vpc_name, source_cidr_block, target_vpc_name, target_cidr_block):
+    def __init__(self, source_vpc, target_vpc, template_format="yaml", output_dir="modules"):
 
-        self.stage = stage
-        self.source_vpc_name = source_vpc_name
-        self.target_vpc_name = target_vpc_name
-        self.source_cidr_block = source_cidr_block
-        self.target_cidr_block = target_cidr_block
+        # source_vpc and target_vpc are Shared.environment.Vpc of the same stage
+        self.stage = source_vpc.stage
+        self.source_vpc = source_vpc
+        self.target_vpc = target_vpc
+        self.template_path = os.path.join(output_dir, template_writer.template_file_name("template_peer_vpcs",
+                                                                                         template_format))
 
     def create_peering(self):
 
         template = Template()
         template.add_version('2010-09-09')
 
-        source_vpc_name_formatted = ''.join(
-            e for e in self.source_vpc_name if e.isalnum()).capitalize()
+        source_vpc_name_formatted = self.source_vpc.formatted_name
 
-        target_vpc_name_formatted = ''.join(
-            e for e in self.target_vpc_name if e.isalnum()).capitalize()
+        target_vpc_name_formatted = self.target_vpc.formatted_name
 
         vpc_peering_connection = template.add_resource(
             VPCPeeringConnection(
                 '{}{}{}VpcPeering'.format(self.stage,source_vpc_name_formatted,target_vpc_name_formatted),
-                VpcId=ImportValue("{}{}VpcId".format(self.stage,source_vpc_name_formatted)),
-                PeerVpcId=ImportValue("{}{}VpcId".format(self.stage,target_vpc_name_formatted)),
+                VpcId=ImportValue(self.source_vpc.vpc_id_export),
+                PeerVpcId=ImportValue(self.target_vpc.vpc_id_export),
                 Tags=Tags(
                     Name="{}_{}_{}_peering".format(self.stage,source_vpc_name_formatted,target_vpc_name_formatted)
                 )
@@ -46,8 +49,8 @@ class PeerVPC:
             Route(
                 '{}{}PublicRoutePeeringRule'.format(self.stage,source_vpc_name_formatted),                
                 VpcPeeringConnectionId=Ref(vpc_peering_connection),
-                DestinationCidrBlock=self.target_cidr_block,
-                RouteTableId=ImportValue("{}{}PublicRouteTableId".format(self.stage,source_vpc_name_formatted))
+                DestinationCidrBlock=self.target_vpc.cidr_block,
+                RouteTableId=ImportValue(self.source_vpc.public_route_table_export)
             )
         )
 
@@ -55,8 +58,8 @@ class PeerVPC:
             Route(
                 '{}{}PrivateRoutePeeringRule'.format(self.stage,source_vpc_name_formatted),
                 VpcPeeringConnectionId=Ref(vpc_peering_connection),
-                DestinationCidrBlock=self.target_cidr_block,
-                RouteTableId=ImportValue("{}{}PrivateRouteTableId".format(self.stage,source_vpc_name_formatted))
+                DestinationCidrBlock=self.target_vpc.cidr_block,
+                RouteTableId=ImportValue(self.source_vpc.private_route_table_export)
             )
         )
 
@@ -64,8 +67,8 @@ class PeerVPC:
             Route(
                 '{}{}PublicRoutePeeringRule'.format(self.stage,target_vpc_name_formatted),
                 VpcPeeringConnectionId=Ref(vpc_peering_connection),
-                DestinationCidrBlock=self.source_cidr_block,
-                RouteTableId=ImportValue("{}{}PublicRouteTableId".format(self.stage,target_vpc_name_formatted))
+                DestinationCidrBlock=self.source_vpc.cidr_block,
+                RouteTableId=ImportValue(self.target_vpc.public_route_table_export)
             )
         )
 
@@ -73,10 +76,11 @@ class PeerVPC:
             Route(
                 '{}{}PrivateRoutePeeringRule'.format(self.stage,target_vpc_name_formatted),
                 VpcPeeringConnectionId=Ref(vpc_peering_connection),
-                DestinationCidrBlock=self.source_cidr_block,
-                RouteTableId=ImportValue("{}{}PrivateRouteTableId".format(self.stage,target_vpc_name_formatted))
+                DestinationCidrBlock=self.source_vpc.cidr_block,
+                RouteTableId=ImportValue(self.target_vpc.private_route_table_export)
             )
         )
 
-        f = open("modules/template_peer_vpcs.yaml", 'w')
-        print(template.to_yaml(), file=f)
\ No newline at end of file
+        template_writer.write_template(template.to_dict(), self.template_path)
+
+        return self.template_path
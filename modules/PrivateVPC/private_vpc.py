@@ -1,30 +1,35 @@
-from troposphere import Template, Tags, Ref, GetAtt, Output, Export, Sub, Parameter
+import os.path
+
+from troposphere import Tags, Ref, GetAtt, Output, Export, Sub, Parameter, Select, GetAZs
 from troposphere.ec2 import Route, VPCGatewayAttachment, SubnetRouteTableAssociation, \
     VPC, Subnet, RouteTable, EIP, Instance, InternetGateway,  \
     SecurityGroup, NatGateway, VPCEndpoint
 
+from Shared import stack_splitter, template_writer
+
 class PrivateVPC:
-    def __init__(self, stage, vpc_name, vpc_cidr_block, vpc_endpoint_s3, subnets):
+    def __init__(self, vpc, stack_limits=None, template_format="yaml", output_dir="modules"):
 
-        self.stage = stage
-        self.vpc_name = vpc_name
-        self.vpc_cidr_block = vpc_cidr_block
-        self.vpc_endpoint_s3 = vpc_endpoint_s3
-        self.subnets = subnets
+        # vpc is a Shared.environment.Vpc
+        self.stage = vpc.stage
+        self.vpc = vpc
+        self.stack_limits = stack_limits
         self.output_list = []
 
+        self.template_path = os.path.join(output_dir, template_writer.template_file_name(
+            "template_vpc_{}".format(vpc.formatted_name), template_format))
+
     def create_vpc(self):
 
-        template = Template()
+        template = stack_splitter.Template()
         template.add_version('2010-09-09')
 
-        vpc_name_formatted = ''.join(
-            e for e in self.vpc_name if e.isalnum()).capitalize()
+        vpc_name_formatted = self.vpc.formatted_name
 
         private_vpc = template.add_resource(
             VPC(
                 '{}{}'.format(self.stage, vpc_name_formatted),
-                CidrBlock=self.vpc_cidr_block,
+                CidrBlock=self.vpc.cidr_block,
                 EnableDnsHostnames="true",
                 Tags=Tags(
                     Name="{}_{}".format(self.stage,vpc_name_formatted)
@@ -79,17 +84,19 @@ class PrivateVPC:
             )
         )
 
-        for sub in self.subnets:
+        for sub in self.vpc.subnets:
 
-            subnet_name = sub["name"]
-            subnet_type = sub["type"]
-            subnet_cidr_block = sub["cidr_block"]
-            subnet_availability_zone = sub["availability_zone"]
-            subnet_map_ip_on_launch = sub["map_ip_on_launch"]
-            subnet_nat_gateway = sub["nat_gateway"]
+            subnet_name = sub.name
+            subnet_type = sub.type
+            subnet_cidr_block = sub.cidr_block
+            subnet_availability_zone = sub.availability_zone
+            if isinstance(subnet_availability_zone, int):
+                # Carved subnets take the zone at their position in the region of the stack
+                subnet_availability_zone = Select(subnet_availability_zone, GetAZs(""))
+            subnet_map_ip_on_launch = sub.map_ip_on_launch
+            subnet_nat_gateway = sub.nat_gateway
 
-            subnet_name_formatted = ''.join(
-                e for e in subnet_name if e.isalnum()).capitalize()
+            subnet_name_formatted = sub.formatted_name
 
             subnet = template.add_resource(
                 Subnet(
@@ -109,7 +116,7 @@ class PrivateVPC:
                     '{}{}{}SubnetId'.format(self.stage, vpc_name_formatted,subnet_name_formatted),
                     Description="ID of the Subnet",
                     Value=Ref(subnet),
-                    Export=Export('{}{}{}SubnetId'.format(self.stage, vpc_name_formatted,subnet_name_formatted))
+                    Export=Export(self.vpc.subnet_exports[subnet_name])
                 )
             )
 
@@ -151,12 +158,12 @@ class PrivateVPC:
                     )
                 )
         
-        if self.vpc_endpoint_s3 == True:
+        if self.vpc.endpoint_s3:
             template.add_resource(
                 VPCEndpoint(
                     '{}{}VPCEndpointS3'.format(self.stage, vpc_name_formatted),
                     VpcId=Ref(private_vpc),
-                    ServiceName="com.amazonaws.us-east-1.s3",
+                    ServiceName="com.amazonaws.{}.s3".format(self.vpc.region),
                     RouteTableIds=[Ref(public_route_table), Ref(private_route_table)]
                 )
             )
@@ -168,7 +175,7 @@ class PrivateVPC:
                 "{}{}VpcId".format(self.stage, vpc_name_formatted),
                 Description="ID of {} VPC".format(vpc_name_formatted),
                 Value=Ref(private_vpc),
-                Export=Export("{}{}VpcId".format(self.stage, vpc_name_formatted))
+                Export=Export(self.vpc.vpc_id_export)
             )
         )
 
@@ -177,7 +184,7 @@ class PrivateVPC:
                 "{}{}PublicRouteTableId".format(self.stage,vpc_name_formatted),
                 Description="ID of {} VPC".format(vpc_name_formatted),
                 Value=Ref(public_route_table),
-                Export=Export("{}{}PublicRouteTableId".format(self.stage,vpc_name_formatted))
+                Export=Export(self.vpc.public_route_table_export)
             )
         )
 
@@ -186,11 +193,11 @@ class PrivateVPC:
                 "{}{}PrivateRouteTableId".format(self.stage,vpc_name_formatted),
                 Description="ID of {} VPC".format(vpc_name_formatted),
                 Value=Ref(private_route_table),
-                Export=Export("{}{}PrivateRouteTableId".format(self.stage,vpc_name_formatted))
+                Export=Export(self.vpc.private_route_table_export)
             )
         )
 
         template.add_output(self.output_list)
 
-        f = open("modules/template_vpc_{}.yaml".format(vpc_name_formatted), 'w')
-        print(template.to_yaml(), file=f)
\ No newline at end of file
+        # One Subnet, route association and Output per subnet: large VPCs are split into several stacks
+        return stack_splitter.write_template(template, self.template_path, self.stage, self.stack_limits)
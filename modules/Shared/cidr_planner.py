@@ -0,0 +1,186 @@
+import bisect
+import ipaddress
+import string
+
+# Subnets of a VPC are carved out of its CIDR block instead of being typed by hand: one subnet per tier
+# (public, private) and availability zone, all of the same size. Tiers come first, so a /22 VPC with two tiers over
+# two zones gives public a/b the first two /24 blocks and private a/b the next two. Zone letters are not contiguous
+# in every account (e.g. no ap-northeast-1b in new accounts), so carved subnets only keep the position of their zone,
+# resolved by the template in the region of the stack (Fn::Select over Fn::GetAZs).
+#
+# Hand written blocks are checked before any template is generated: subnets must sit inside their VPC without
+# overlapping each other, and peered VPCs cannot overlap. Stages sharing a cidr_pool get VPC blocks that do not
+# overlap across the whole fleet, a VPC block given as a size only (e.g: "/22") is allocated from the pool.
+
+# Sizes of VPC and subnet blocks AWS accepts
+MIN_VPC_PREFIX = 16
+MAX_SUBNET_PREFIX = 28
+
+SUBNET_TIERS = ["public", "private"]
+
+
+def carve_subnets(vpc_cidr_block, availability_zones, tiers=None):
+
+    tiers = tiers or SUBNET_TIERS
+    for tier in tiers:
+        if tier not in SUBNET_TIERS:
+            raise ValueError("Unknown subnet tier {}, expected one of {}".format(tier, ", ".join(SUBNET_TIERS)))
+    if not 1 <= availability_zones <= len(string.ascii_lowercase):
+        raise ValueError("Cannot spread subnets over {} availability zones".format(availability_zones))
+
+    network = parse_block(vpc_cidr_block, "VPC")
+    subnet_count = len(tiers) * availability_zones
+    new_prefix = network.prefixlen + (subnet_count - 1).bit_length()
+    if new_prefix > MAX_SUBNET_PREFIX:
+        raise ValueError("{} is too small for {} subnets, they would be /{} (AWS allows up to /{})".format(
+            vpc_cidr_block, subnet_count, new_prefix, MAX_SUBNET_PREFIX))
+
+    blocks = network.subnets(new_prefix=new_prefix)
+    subnets = []
+    for tier in tiers:
+        for index in range(availability_zones):
+            letter = string.ascii_lowercase[index]
+            subnets.append({
+                "name": "{}_subnet_{}".format(tier, letter),
+                "type": tier,
+                "cidr_block": str(next(blocks)),
+                "availability_zone": index,
+                "map_ip_on_launch": "true" if tier == "public" else "false",
+                "nat_gateway": "false"
+            })
+
+    return subnets
+
+
+def vpc_subnets(vpc):
+
+    # Hand written subnets win, otherwise they are carved from the VPC block
+    if vpc.get("subnets"):
+        return vpc["subnets"]
+
+    return carve_subnets(vpc["vpc_cidr_block"], vpc["availability_zones"], vpc.get("subnet_tiers"))
+
+
+def parse_block(cidr_block, owner):
+
+    try:
+        network = ipaddress.ip_network(cidr_block)
+    except ValueError as error:
+        raise ValueError("{}: {}".format(owner, error))
+    if not MIN_VPC_PREFIX <= network.prefixlen <= MAX_SUBNET_PREFIX:
+        raise ValueError("{}: {} is not between /{} and /{}, the block sizes AWS accepts".format(
+            owner, cidr_block, MIN_VPC_PREFIX, MAX_SUBNET_PREFIX))
+
+    return network
+
+
+class CidrIndex:
+
+    # Blocks sorted by first address. Blocks of the index never overlap each other, so a new block can only overlap
+    # the block starting at or before its first address or the ones starting inside it: a binary search finds them
+    # instead of a comparison with every block, which keeps fleets of hundreds of VPCs cheap to check
+    def __init__(self):
+        self.starts = []
+        self.blocks = []
+        # First address worth trying per pool and block size. Blocks are never removed, so the blocks before it
+        # stay taken and each allocation resumes where the previous one of the same size stopped
+        self.cursors = {}
+
+    def overlapping(self, network):
+
+        index = bisect.bisect_right(self.starts, int(network.network_address))
+        if index > 0 and self.blocks[index - 1][0].broadcast_address >= network.network_address:
+            return self.blocks[index - 1]
+        if index < len(self.blocks) and self.blocks[index][0].network_address <= network.broadcast_address:
+            return self.blocks[index]
+
+        return None
+
+    def add(self, network, owner):
+
+        overlap = self.overlapping(network)
+        if overlap is not None:
+            raise ValueError("{} {} overlaps {} {}".format(owner, network, overlap[1], overlap[0]))
+
+        index = bisect.bisect_right(self.starts, int(network.network_address))
+        self.starts.insert(index, int(network.network_address))
+        self.blocks.insert(index, (network, owner))
+
+    def allocate(self, pool, prefix_length, owner):
+
+        # First free block of the pool, skipping over the blocks it would overlap
+        block_size = 2 ** (pool.max_prefixlen - prefix_length)
+        address = self.cursors.get((pool, prefix_length), int(pool.network_address))
+        while address + block_size - 1 <= int(pool.broadcast_address):
+            network = ipaddress.ip_network((address, prefix_length))
+            overlap = self.overlapping(network)
+            if overlap is None:
+                self.add(network, owner)
+                self.cursors[(pool, prefix_length)] = address + block_size
+                return network
+            # Next aligned block after the overlapping one
+            address = -(-(int(overlap[0].broadcast_address) + 1) // block_size) * block_size
+        self.cursors[(pool, prefix_length)] = address
+
+        raise ValueError("{}: no free /{} left in the CIDR pool {}".format(owner, prefix_length, pool))
+
+
+def check_subnets(vpc_name, vpc_cidr_block, subnets):
+
+    # subnets: (name, cidr_block) of the subnets of the VPC
+    vpc_network = parse_block(vpc_cidr_block, vpc_name)
+    index = CidrIndex()
+    for name, cidr_block in subnets:
+        owner = "Subnet {} of the {}".format(name, vpc_name)
+        network = parse_block(cidr_block, owner)
+        if network.version != vpc_network.version or not network.subnet_of(vpc_network):
+            raise ValueError("{} {} is outside of the VPC block {}".format(owner, network, vpc_network))
+        index.add(network, owner)
+
+
+def check_disjoint(blocks):
+
+    # blocks: (owner, cidr_block) of VPCs routed to each other
+    index = CidrIndex()
+    for owner, cidr_block in blocks:
+        index.add(parse_block(cidr_block, owner), owner)
+
+
+def allocate_vpc_blocks(stage_configs):
+
+    # The VPCs of every stage sharing a cidr_pool cannot overlap. Hand written blocks are reserved first, then the
+    # blocks given as a size are allocated in stage order, so appending a stage does not move the blocks of the others
+    # The configs are copied, stages generated with --stages share the VPC dicts of the stage configuration
+    stage_configs = [dict(config) for config in stage_configs]
+    indexes = {}
+    pending = []
+    for config in stage_configs:
+        pool = config.get("cidr_pool")
+        for vpc_key in ("private_vpc", "bastion_vpc"):
+            vpc = config[vpc_key]
+            owner = "VPC {} of stage {}".format(vpc["vpc_name"], config["stage"])
+            if not pool:
+                if str(vpc["vpc_cidr_block"]).startswith("/"):
+                    raise ValueError("{}: {} needs a cidr_pool to be allocated from".format(
+                        owner, vpc["vpc_cidr_block"]))
+                continue
+
+            pool_network = ipaddress.ip_network(pool)
+            index = indexes.setdefault(pool_network, CidrIndex())
+            if str(vpc["vpc_cidr_block"]).startswith("/"):
+                pending.append((index, pool_network, config, vpc_key, owner))
+                continue
+
+            network = parse_block(vpc["vpc_cidr_block"], owner)
+            if not network.subnet_of(pool_network):
+                raise ValueError("{} {} is outside of the CIDR pool {}".format(owner, network, pool_network))
+            index.add(network, owner)
+
+    for index, pool_network, config, vpc_key, owner in pending:
+        prefix_length = int(config[vpc_key]["vpc_cidr_block"][1:])
+        if not MIN_VPC_PREFIX <= prefix_length <= MAX_SUBNET_PREFIX:
+            raise ValueError("{}: /{} is not between /{} and /{}, the block sizes AWS accepts".format(
+                owner, prefix_length, MIN_VPC_PREFIX, MAX_SUBNET_PREFIX))
+        config[vpc_key] = dict(config[vpc_key], vpc_cidr_block=str(index.allocate(pool_network, prefix_length, owner)))
+
+    return stage_configs
@@ -0,0 +1,218 @@
+from dataclasses import dataclass
+from functools import cached_property, lru_cache
+from typing import Union
+
+from Shared import cidr_planner
+
+# Environment model of a stage, built once from its stage configuration and shared by every generator of the stage.
+# The objects are frozen, so the names and export names the stacks derive from them (logical IDs, ImportValue of the
+# subnets, ...) are computed on first use and then reused by every stack instead of being rebuilt from the raw dicts.
+
+
+@lru_cache(maxsize=None)
+def format_name(name):
+
+    # Logical IDs and export names only allow alphanumeric characters: "private_vpc" -> "Privatevpc"
+    return ''.join(e for e in name if e.isalnum()).capitalize()
+
+
+@dataclass(frozen=True)
+class Subnet:
+    name: str
+    type: str
+    cidr_block: str
+    # Name of the zone, or its position in the region of the stack (carved subnets)
+    availability_zone: Union[str, int]
+    map_ip_on_launch: str = "false"
+    nat_gateway: str = "false"
+
+    def __post_init__(self):
+        if self.type not in cidr_planner.SUBNET_TIERS:
+            raise ValueError("Subnet {} has an unknown type {}, expected one of {}".format(
+                self.name, self.type, ", ".join(cidr_planner.SUBNET_TIERS)))
+        if isinstance(self.availability_zone, bool) or not isinstance(self.availability_zone, (str, int)) \
+                or isinstance(self.availability_zone, int) and self.availability_zone < 0:
+            raise ValueError("Subnet {} needs an availability zone name or position, got {}".format(
+                self.name, self.availability_zone))
+
+    @cached_property
+    def formatted_name(self):
+        return format_name(self.name)
+
+
+@dataclass(frozen=True)
+class Vpc:
+    stage: str
+    name: str
+    cidr_block: str
+    region: str
+    subnets: tuple
+    endpoint_s3: bool = False
+
+    def __post_init__(self):
+        # Subnets whose names only differ by punctuation or case would get the same logical ID
+        formatted_names = {}
+        for subnet in self.subnets:
+            if subnet.formatted_name in formatted_names:
+                raise ValueError("Subnets {} and {} of {} both become {}".format(
+                    formatted_names[subnet.formatted_name], subnet.name, self.name, subnet.formatted_name))
+            formatted_names[subnet.formatted_name] = subnet.name
+
+        cidr_planner.check_subnets("VPC {} of stage {}".format(self.name, self.stage), self.cidr_block,
+                                   [(subnet.name, subnet.cidr_block) for subnet in self.subnets])
+
+    @cached_property
+    def formatted_name(self):
+        return format_name(self.name)
+
+    @cached_property
+    def prefix(self):
+        # Prefix of the logical IDs and export names of the VPC stack
+        return "{}{}".format(self.stage, self.formatted_name)
+
+    @cached_property
+    def vpc_id_export(self):
+        return "{}VpcId".format(self.prefix)
+
+    @cached_property
+    def public_route_table_export(self):
+        return "{}PublicRouteTableId".format(self.prefix)
+
+    @cached_property
+    def private_route_table_export(self):
+        return "{}PrivateRouteTableId".format(self.prefix)
+
+    @cached_property
+    def subnet_exports(self):
+        return dict((subnet.name, "{}{}SubnetId".format(self.prefix, subnet.formatted_name))
+                    for subnet in self.subnets)
+
+    @cached_property
+    def subnets_by_type(self):
+        subnets = dict((tier, []) for tier in cidr_planner.SUBNET_TIERS)
+        for subnet in self.subnets:
+            subnets[subnet.type].append(subnet)
+
+        return dict((tier, tuple(tier_subnets)) for tier, tier_subnets in subnets.items())
+
+    @property
+    def public_subnets(self):
+        return self.subnets_by_type["public"]
+
+    @property
+    def private_subnets(self):
+        return self.subnets_by_type["private"]
+
+    @cached_property
+    def public_subnet_exports(self):
+        return tuple(self.subnet_exports[subnet.name] for subnet in self.public_subnets)
+
+    @cached_property
+    def private_subnet_exports(self):
+        return tuple(self.subnet_exports[subnet.name] for subnet in self.private_subnets)
+
+
+@dataclass(frozen=True)
+class Host:
+    key_name: str
+    security_group_name: str
+    instance_name: str
+    instance_type: str
+    instance_ami: str
+
+
+# Database and web nodes of the WordPress stack. Option dicts (aurora, read_scaling, efs, ...) are kept as written
+# in the stage configuration, the WordPress stack merges them over its defaults
+
+
+@dataclass(frozen=True)
+class Database:
+    name: str
+    instance_class: str
+    engine: str
+    engine_version: str
+    username: str
+    password: str
+    port: int
+    multiaz: bool
+    name_tag: str
+    read_replicas: int = 0
+    engine_mode: str = "rds"
+    aurora: dict = None
+    proxy: dict = None
+    storage: dict = None
+    monitoring: dict = None
+    tuning: dict = None
+
+
+@dataclass(frozen=True)
+class Site:
+    write_instance_image_id: str
+    write_instance_type: str
+    write_instance_key_name: str
+    read_instance_image_id: str
+    read_instance_type: str
+    read_instance_key_name: str
+    baked_ami_id: str = None
+    web_tuning: dict = None
+    read_scaling: dict = None
+    read_fleet: dict = None
+    content_sync: str = "cron"
+    content_storage: str = "s3"
+    efs: dict = None
+    site_cdn: dict = None
+    load_balancer: dict = None
+    latency_routing: dict = None
+    object_cache: dict = None
+
+
+@dataclass(frozen=True)
+class Environment:
+    stage: str
+    region: str
+    private_vpc: Vpc
+    bastion_vpc: Vpc
+    bastion_host: Host
+    database: Database
+    site: Site
+
+    def __post_init__(self):
+        # The VPCs are peered, routes to overlapping blocks would be rejected by CloudFormation
+        cidr_planner.check_disjoint([("VPC {} of stage {}".format(vpc.name, self.stage), vpc.cidr_block)
+                                     for vpc in (self.private_vpc, self.bastion_vpc)])
+
+
+def vpc_from_config(stage, region, vpc):
+
+    # The VPC block is checked before subnets are carved out of it
+    cidr_planner.parse_block(vpc["vpc_cidr_block"], "VPC {} of stage {}".format(vpc["vpc_name"], stage))
+
+    return Vpc(stage, vpc["vpc_name"], vpc["vpc_cidr_block"], region,
+               tuple(Subnet(**subnet) for subnet in cidr_planner.vpc_subnets(vpc)),
+               endpoint_s3=vpc["vpc_endpoint_s3"] is True)
+
+
+def database_from_config(wordpress):
+
+    # The database variables of the wordpress stack are aurora and the database_* ones, without their prefix
+    return Database(**dict((key[len("database_"):] if key.startswith("database_") else key, value)
+                           for key, value in wordpress.items() if key.startswith("database_") or key == "aurora"))
+
+
+def site_from_config(wordpress):
+
+    return Site(**dict((key, value) for key, value in wordpress.items()
+                       if not key.startswith("database_") and key != "aurora"))
+
+
+def from_config(config):
+
+    return Environment(
+        stage=config["stage"],
+        region=config["region"],
+        private_vpc=vpc_from_config(config["stage"], config["region"], config["private_vpc"]),
+        bastion_vpc=vpc_from_config(config["stage"], config["region"], config["bastion_vpc"]),
+        bastion_host=Host(**config["bastion_host"]),
+        database=database_from_config(config["wordpress"]),
+        site=site_from_config(config["wordpress"])
+    )
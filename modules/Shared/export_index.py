@@ -0,0 +1,164 @@
+import difflib
+import json
+
+import yaml
+
+# Index of the Exports and Fn::ImportValue of the generated templates. Stacks only reference each other through
+# export names built from strings, so every stage is checked before its stacker config is written: each import
+# needs exactly one exporter in the stage (or to be listed in external_exports), export names must be unique in
+# their region, and stacks cannot import each other's exports in a cycle.
+
+# Templates are read back with libyaml when PyYAML was built with it, which is several times faster than the pure
+# Python loader of cfn_tools
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+class TemplateLoader(SafeLoader):
+    pass
+
+
+def construct_intrinsic_function(loader, tag_suffix, node):
+
+    # Short form tags written by cfn_flip (!Ref, !GetAtt, !Sub, ...) are read back in their long form
+    if isinstance(node, yaml.ScalarNode):
+        value = loader.construct_scalar(node)
+    elif isinstance(node, yaml.SequenceNode):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_mapping(node, deep=True)
+
+    if tag_suffix == "Ref":
+        return {"Ref": value}
+    if tag_suffix == "GetAtt" and isinstance(value, str):
+        value = value.split(".", 1)
+
+    return {"Fn::{}".format(tag_suffix): value}
+
+
+TemplateLoader.add_multi_constructor("!", construct_intrinsic_function)
+
+
+def load_template(path):
+
+    with open(path) as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        return yaml.load(f, Loader=TemplateLoader)
+
+
+def exports_of(template):
+
+    exports = set()
+    for output in template.get("Outputs", {}).values():
+        export_name = output.get("Export", {}).get("Name")
+        if isinstance(export_name, str):
+            exports.add(export_name)
+
+    return exports
+
+
+def imports_of(value):
+
+    found = set()
+    if isinstance(value, dict):
+        for key, item in value.items():
+            # Only literal export names can be resolved before deploy
+            if key == "Fn::ImportValue" and isinstance(item, str):
+                found.add(item)
+            else:
+                found.update(imports_of(item))
+    elif isinstance(value, list):
+        for item in value:
+            found.update(imports_of(item))
+
+    return found
+
+
+def build_index(stacks):
+
+    # Export name -> names of the stacks exporting it, and of the stacks importing it
+    exporters = {}
+    importers = {}
+    for stack in stacks:
+        for export_name in stack["exports"]:
+            exporters.setdefault(export_name, []).append(stack["name"])
+        for export_name in stack["imports"]:
+            importers.setdefault(export_name, []).append(stack["name"])
+
+    return exporters, importers
+
+
+def topological_order(requires):
+
+    order = []
+    state = {}
+
+    def visit(name, path):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError("Stacks import each other's exports: {}".format(
+                " -> ".join(path[path.index(name):] + [name])))
+        state[name] = "visiting"
+        for required in sorted(requires[name]):
+            visit(required, path + [name])
+        state[name] = "done"
+        order.append(name)
+
+    for name in requires:
+        visit(name, [])
+
+    return order
+
+
+def validate_stage(stage, stacks, external_exports=None):
+
+    # Returns the stacks each stack requires, every problem of the stage is reported at once
+    exporters, importers = build_index(stacks)
+    external_exports = set(external_exports or [])
+
+    problems = []
+    for export_name, stack_names in sorted(exporters.items()):
+        if len(stack_names) > 1:
+            problems.append("{} is exported by {}".format(export_name, " and ".join(stack_names)))
+
+    for export_name, stack_names in sorted(importers.items()):
+        if export_name in exporters or export_name in external_exports:
+            continue
+        suggestions = difflib.get_close_matches(export_name, list(exporters), n=1)
+        problems.append("{} imported by {} is not exported by any stack{}".format(
+            export_name, ", ".join(stack_names),
+            " (did you mean {}?)".format(suggestions[0]) if suggestions else ""))
+
+    requires = dict((stack["name"], set(exporters[export_name][0] for export_name in stack["imports"]
+                                        if export_name in exporters) - {stack["name"]})
+                    for stack in stacks)
+    try:
+        topological_order(requires)
+    except ValueError as error:
+        problems.append(str(error))
+
+    if problems:
+        raise ValueError("Stage {} cannot be deployed:\n  {}".format(stage, "\n  ".join(problems)))
+
+    return requires
+
+
+def validate_regions(stage_exports):
+
+    # Export names are unique per account and region, so stages deployed in the same region cannot share one.
+    # stage_exports: (stage, region, export names) of every stage
+    owners = {}
+    problems = []
+    for stage, region, exports in stage_exports:
+        for export_name in sorted(exports):
+            owner = owners.setdefault((region, export_name), stage)
+            if owner != stage:
+                problems.append("{} is exported by both stage {} and stage {} in {}".format(
+                    export_name, owner, stage, region))
+
+    if problems:
+        raise ValueError("Stages cannot be deployed together:\n  {}".format("\n  ".join(problems)))
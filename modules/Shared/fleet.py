@@ -0,0 +1,144 @@
+import copy
+import json
+import os.path
+
+import yaml
+
+from TransitGateway import transit_gateway
+
+# A fleet file lists the stages to generate in one run:
+#
+#   output_dir: build
+#   defaults:
+#     wordpress:
+#       read_instance_type: t3.small
+#   stages:
+#     - stage: dev
+#     - stage: prod
+#       wordpress:
+#         database_multiaz: true
+#
+# Every stage starts from the stage configuration of generate_wordpress_stacks.py, then the fleet
+# defaults and the stage entry are merged on top of it. Each stage is written to <output_dir>/<stage>.
+
+
+def merge_config(base, overrides):
+
+    merged = copy.deepcopy(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+
+    return merged
+
+
+def load_fleet(fleet_path, base_config):
+
+    with open(fleet_path) as f:
+        if fleet_path.endswith(".json"):
+            fleet = json.load(f)
+        else:
+            fleet = yaml.safe_load(f)
+
+    if not fleet or not fleet.get("stages"):
+        raise ValueError("{} does not define any stage".format(fleet_path))
+
+    output_dir = fleet.get("output_dir", base_config["output_dir"])
+    defaults = merge_config(base_config, fleet.get("defaults", {}))
+
+    stage_configs = []
+    stage_names = set()
+    for stage in fleet["stages"]:
+        if "stage" not in stage:
+            raise ValueError("{}: every stage needs a 'stage' name".format(fleet_path))
+        if stage["stage"] in stage_names:
+            raise ValueError("{}: stage {} is defined more than once".format(fleet_path, stage["stage"]))
+        stage_names.add(stage["stage"])
+
+        stage_config = merge_config(defaults, stage)
+        if "output_dir" not in stage:
+            stage_config["output_dir"] = os.path.join(output_dir, stage["stage"])
+
+        stage_configs.append(stage_config)
+
+    return stage_configs
+
+
+def expand_regions(stage_configs):
+
+    # A stage with additional_regions is generated once more per region. The copies get the region appended to
+    # their stage name, because bucket and IAM role names are global, and their own output folder
+    expanded = []
+    for config in stage_configs:
+        expanded.append(config)
+
+        for entry in config.get("additional_regions") or []:
+            overrides = dict(entry) if isinstance(entry, dict) else {"region": entry}
+            region = overrides.pop("region")
+
+            regional = copy.deepcopy(config)
+            regional.update(stage="{}{}".format(config["stage"], region.replace("-", "")), region=region,
+                            output_dir=os.path.join(config["output_dir"], region), additional_regions=[])
+
+            if regional.get("wordpress_image"):
+                regional["wordpress_image"].pop("region", None)
+            regional = merge_config(regional, overrides)
+
+            # Zone letters differ between regions and accounts, so zone names of hand written subnets are not
+            # guessed for the new region: the entry lists its own subnets, or the subnets use zone positions
+            for vpc_key in ("private_vpc", "bastion_vpc"):
+                for subnet in regional[vpc_key].get("subnets") or []:
+                    zone = subnet["availability_zone"]
+                    if isinstance(zone, str) and not zone.startswith(region):
+                        raise ValueError("Subnet {} of stage {} is in {}, region {} needs its own {} subnets".format(
+                            subnet["name"], regional["stage"], zone, region, vpc_key))
+
+            expanded.append(regional)
+
+    return expanded
+
+
+def assign_transit_gateway_hubs(stage_configs):
+
+    # Stages with the transit_gateway connectivity are attached to the hub stage of their region: the hub_stage
+    # itself, or its copy when the hub stage has additional_regions. Their stacks import the exports of the hub
+    stages = dict((config["stage"], config) for config in stage_configs)
+
+    assigned = []
+    for config in stage_configs:
+        if config["connectivity"] not in transit_gateway.CONNECTIVITY_MODES:
+            raise ValueError("Stage {} has an unknown connectivity {}, expected one of {}".format(
+                config["stage"], config["connectivity"], ", ".join(transit_gateway.CONNECTIVITY_MODES)))
+        if config["connectivity"] != "transit_gateway":
+            assigned.append(config)
+            continue
+
+        settings = dict(transit_gateway.DEFAULT_TRANSIT_GATEWAY, **(config.get("transit_gateway") or {}))
+        hub = None
+        regional_hub_stage = "{}{}".format(settings["hub_stage"], config["region"].replace("-", ""))
+        for hub_stage in (settings["hub_stage"], regional_hub_stage):
+            if hub_stage in stages and stages[hub_stage]["region"] == config["region"]:
+                hub = stages[hub_stage]
+        if hub is None:
+            raise ValueError("Stage {} is attached to the transit gateway of stage {}, which is not generated in {}"
+                             .format(config["stage"], settings["hub_stage"], config["region"]))
+        if hub["connectivity"] != "transit_gateway":
+            raise ValueError("Stage {} is the transit gateway hub of stage {} but its connectivity is {}".format(
+                hub["stage"], config["stage"], hub["connectivity"]))
+
+        # Attached VPCs are routed to each other through the pool as a single block, which is only safe when the
+        # pool guarantees that none of them overlap
+        if not config.get("cidr_pool") or config["cidr_pool"] != hub.get("cidr_pool"):
+            raise ValueError("Stage {} needs the cidr_pool of its transit gateway hub {}".format(
+                config["stage"], hub["stage"]))
+
+        external_exports = list(config.get("external_exports") or [])
+        if hub is not config:
+            external_exports += list(transit_gateway.hub_exports(hub["stage"]).values())
+
+        assigned.append(dict(config, transit_gateway=dict(settings, hub_stage=hub["stage"]),
+                             external_exports=external_exports))
+
+    return assigned
@@ -0,0 +1,185 @@
+import os.path
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PrivateVPC import private_vpc
+from PeerVPC import peer_vpc
+from BastionHost import bastion_host
+from Wordpress import wordpress, wordpress_image
+from TransitGateway import transit_gateway
+from Shared import environment, stack_manifest
+
+
+def private_vpc_stack(config, stage_environment):
+    return private_vpc.PrivateVPC(stage_environment.private_vpc, stack_limits=config.get("stack_limits"),
+                                  template_format=config["template_format"], output_dir=config["output_dir"])
+
+
+def bastion_vpc_stack(config, stage_environment):
+    return private_vpc.PrivateVPC(stage_environment.bastion_vpc, stack_limits=config.get("stack_limits"),
+                                  template_format=config["template_format"], output_dir=config["output_dir"])
+
+
+def peer_vpcs_stack(config, stage_environment):
+    if config["connectivity"] != "peering":
+        return None
+    return peer_vpc.PeerVPC(stage_environment.private_vpc, stage_environment.bastion_vpc,
+                            template_format=config["template_format"], output_dir=config["output_dir"])
+
+
+def transit_gateway_stack(config, stage_environment):
+    if config["connectivity"] != "transit_gateway" or config["transit_gateway"]["hub_stage"] != config["stage"]:
+        return None
+    return transit_gateway.TransitGatewayHub(config["stage"], config["transit_gateway"]["amazon_side_asn"],
+                                             template_format=config["template_format"],
+                                             output_dir=config["output_dir"])
+
+
+def transit_gateway_attachments_stack(config, stage_environment):
+    if config["connectivity"] != "transit_gateway":
+        return None
+    return transit_gateway.TransitGatewayAttachments([stage_environment.private_vpc, stage_environment.bastion_vpc],
+                                                     config["transit_gateway"]["hub_stage"], config["cidr_pool"],
+                                                     template_format=config["template_format"],
+                                                     output_dir=config["output_dir"])
+
+
+def bastion_host_stack(config, stage_environment):
+    return bastion_host.BastionHost(stage_environment.bastion_host, stage_environment.bastion_vpc,
+                                    template_format=config["template_format"], output_dir=config["output_dir"])
+
+
+def wordpress_stack(config, stage_environment):
+    # Security groups of the bastion VPC are not referenced across a transit gateway, see WordPress
+    bastion_cidr_block = stage_environment.bastion_vpc.cidr_block \
+        if config["connectivity"] == "transit_gateway" else None
+    return wordpress.WordPress(config["stage"], stage_environment.private_vpc, stage_environment.database,
+                               stage_environment.site, bastion_cidr_block=bastion_cidr_block,
+                               stack_limits=config.get("stack_limits"), template_format=config["template_format"],
+                               output_dir=config["output_dir"])
+
+
+def wordpress_image_build(config, stage_environment):
+    image = config.get("wordpress_image")
+    if not image:
+        return None
+    return wordpress_image.WordPressImage(config["stage"], image["source_ami"], image["instance_type"],
+                                          image.get("region", config["region"]), output_dir=config["output_dir"])
+
+
+# Stacks generated for every stage, in the order they are reported.
+# Each entry maps the stacker stack name to the builder of its generator object and its create method.
+# Builders get the stage config and its environment model, built once per stage and shared by every stack of the
+# stage, and return None for what is not configured in the stage.
+
+STACKS = [
+    ("PrivateVPC", private_vpc_stack, "create_vpc"),
+    ("BastionVPC", bastion_vpc_stack, "create_vpc"),
+    ("PeerVPCs", peer_vpcs_stack, "create_peering"),
+    ("TransitGateway", transit_gateway_stack, "create_transit_gateway"),
+    ("TransitGatewayAttachments", transit_gateway_attachments_stack, "create_attachments"),
+    ("BastionHost", bastion_host_stack, "create_bastion_host"),
+    ("Wordpress", wordpress_stack, "create_wordpress_environment"),
+    ("WordpressImage", wordpress_image_build, "create_image_build"),
+]
+
+
+def create_jobs(stage_configs):
+
+    jobs = []
+    paths = {}
+    for config in stage_configs:
+        stage_environment = environment.from_config(config)
+        for stack_name, stack_builder, create_method in STACKS:
+            stack = stack_builder(config, stage_environment)
+            if stack is None:
+                continue
+
+            # Two stacks writing the same file would silently overwrite each other
+            if stack.template_path in paths:
+                raise ValueError("{} {} and {} {} both write {}".format(
+                    paths[stack.template_path][0], paths[stack.template_path][1],
+                    config["stage"], stack_name, stack.template_path))
+            paths[stack.template_path] = (config["stage"], stack_name)
+
+            jobs.append((config["stage"], stack_name, stack, create_method))
+
+    return jobs
+
+
+def run_job(job):
+
+    stage, stack_name, stack, create_method = job
+
+    start = time.perf_counter()
+    template_path = getattr(stack, create_method)()
+    elapsed = time.perf_counter() - start
+
+    return {"stage": stage, "stack": stack_name, "path": template_path, "seconds": elapsed,
+            "status": "built", "output_hash": stack_manifest.output_hash(template_path)}
+
+
+def generate_stacks(stage_configs, workers=None, force=False):
+
+    jobs = create_jobs(stage_configs)
+
+    # Split the jobs into clean stacks, whose templates are reused, and dirty stacks that are rebuilt
+
+    manifests = {}
+    results = [None] * len(jobs)
+    dirty_jobs = []
+    for index, job in enumerate(jobs):
+        stage, stack_name, stack, create_method = job
+
+        output_dir = os.path.dirname(stack.template_path)
+        if output_dir not in manifests:
+            manifests[output_dir] = stack_manifest.StackManifest(output_dir)
+
+        key = "{}/{}".format(stage, stack_name)
+        stack_input_hash = stack_manifest.input_hash(stack)
+
+        if not force and manifests[output_dir].is_clean(key, stack_input_hash, stack.template_path):
+            results[index] = {"stage": stage, "stack": stack_name, "path": stack.template_path,
+                              "seconds": 0.0, "status": "unchanged"}
+        else:
+            dirty_jobs.append((index, key, stack_input_hash, output_dir, job))
+
+    # A single worker skips the process pool so small runs do not pay for forking
+    if workers == 1 or len(dirty_jobs) <= 1:
+        built = [run_job(job) for _, _, _, _, job in dirty_jobs]
+    else:
+        # map() keeps the results in job order, so the report does not depend on scheduling
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            built = list(executor.map(run_job, [job for _, _, _, _, job in dirty_jobs]))
+
+    for (index, key, stack_input_hash, output_dir, _), result in zip(dirty_jobs, built):
+        manifests[output_dir].update(key, stack_input_hash, result["path"], result.pop("output_hash"))
+        results[index] = result
+
+    if dirty_jobs:
+        for manifest in manifests.values():
+            manifest.save()
+
+    return results
+
+
+def print_timing_report(results, elapsed):
+
+    # Columns are as wide as the longest stage and stack names, e.g. TransitGatewayAttachments
+    stage_width = max([len("STAGE")] + [len(result["stage"]) for result in results])
+    stack_width = max([len("STACK")] + [len(result["stack"]) for result in results])
+
+    print("{:<{}} {:<{}} {:<10} {:>9}  {}".format("STAGE", stage_width, "STACK", stack_width, "STATUS", "SECONDS",
+                                                   "TEMPLATE"))
+    for result in results:
+        print("{:<{}} {:<{}} {:<10} {:>9.3f}  {}".format(
+            result["stage"], stage_width, result["stack"], stack_width, result["status"], result["seconds"],
+            result["path"]))
+
+    dirty_stacks = ["{}/{}".format(result["stage"], result["stack"]) for result in results
+                    if result["status"] == "built"]
+
+    print("{} of {} stacks rebuilt in {:.3f}s (sum of stack times {:.3f}s)".format(
+        len(dirty_stacks), len(results), elapsed, sum(result["seconds"] for result in results)))
+    if dirty_stacks:
+        print("Dirty stacks: {}".format(", ".join(dirty_stacks)))
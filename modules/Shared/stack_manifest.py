@@ -0,0 +1,135 @@
+import ast
+import hashlib
+import inspect
+import json
+import os.path
+import sys
+from functools import lru_cache
+
+import troposphere
+
+from Shared import stack_splitter, template_writer
+
+MANIFEST_FILE_NAME = ".stack_manifest.json"
+
+
+# Generator sources are the .py files of this folder (modules), third party packages are left to their version
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def is_generator_module(module):
+
+    module_file = getattr(module, "__file__", None)
+
+    return module_file is not None and os.path.abspath(module_file).startswith(SOURCE_DIR + os.sep)
+
+
+def imported_modules(module):
+
+    # Generator modules imported by module, read from its import statements: "from Shared import environment"
+    # imports Shared.environment, "from Wordpress.mixed_instances import LaunchTemplate" Wordpress.mixed_instances
+    names = set()
+    for node in ast.walk(ast.parse(inspect.getsource(module))):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module)
+            names.update("{}.{}".format(node.module, alias.name) for alias in node.names)
+
+    return [sys.modules[name] for name in sorted(names)
+            if name in sys.modules and is_generator_module(sys.modules[name])]
+
+
+@lru_cache(maxsize=None)
+def source_files(module_name):
+
+    # Every package the stack module imports from, directly or through other modules, takes part in the template:
+    # Wordpress/user_data.py, Shared/template_writer.py, Shared/stack_splitter.py, ... Packages are hashed whole so
+    # the sources read as data (Wordpress/content_sync_agent.py, shipped in the UserData) count too
+    package_dirs = set()
+    visited = set()
+    pending = [sys.modules[module_name]]
+    while pending:
+        module = pending.pop()
+        if module.__name__ in visited:
+            continue
+        visited.add(module.__name__)
+
+        package_dirs.add(os.path.dirname(os.path.abspath(module.__file__)))
+        pending += imported_modules(module)
+
+    return tuple(sorted(os.path.join(package_dir, file_name) for package_dir in package_dirs
+                        for file_name in os.listdir(package_dir) if file_name.endswith(".py")))
+
+
+@lru_cache(maxsize=None)
+def source_hash(module_name):
+
+    source = hashlib.sha256()
+    for path in source_files(module_name):
+        with open(path, 'rb') as f:
+            source.update(os.path.relpath(path, SOURCE_DIR).encode())
+            source.update(f.read())
+
+    return source.hexdigest()
+
+
+def input_hash(stack):
+
+    # Inputs of a stack are its constructor values plus the code that turns them into a template,
+    # so editing a generator class or a Shared module it uses also marks its stacks as dirty
+    inputs = {
+        "values": vars(stack),
+        "source": source_hash(type(stack).__module__),
+        "troposphere": troposphere.__version__
+    }
+
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def output_hash(template_path):
+
+    if not os.path.isfile(template_path):
+        return None
+
+    # Parts of a split template are written with it, so editing or deleting one of them marks the stack as dirty
+    output = hashlib.sha256()
+    for path in [template_path] + stack_splitter.part_paths(template_path):
+        with open(path, 'rb') as f:
+            output.update(f.read())
+
+    return output.hexdigest()
+
+
+class StackManifest:
+    def __init__(self, output_dir):
+
+        self.path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+        self.stacks = {}
+
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                self.stacks = json.load(f)
+
+    def is_clean(self, key, stack_input_hash, template_path):
+
+        # A stack is clean when its inputs did not change and the template on disk is the one we wrote
+        entry = self.stacks.get(key)
+
+        return entry is not None \
+            and entry["input"] == stack_input_hash \
+            and entry["path"] == template_path \
+            and entry["output"] == output_hash(template_path)
+
+    def update(self, key, stack_input_hash, template_path, template_output_hash):
+
+        self.stacks[key] = {
+            "input": stack_input_hash,
+            "output": template_output_hash,
+            "path": template_path
+        }
+
+    def save(self):
+
+        with template_writer.atomic_open(self.path) as f:
+            json.dump(self.stacks, f, indent=2, sort_keys=True)
@@ -0,0 +1,264 @@
+import glob
+import json
+import os.path
+import re
+
+import troposphere
+
+from Shared import template_writer
+
+# Templates that grow with the configuration (one Subnet, route association and Output per subnet, ...) are split
+# into sibling stacks before they reach the CloudFormation limits. References between the parts are rewired through
+# Exports and Fn::ImportValue, the way the stacks of this repo already reference each other.
+#
+# The parts are written next to the template as <template>_part1.yaml, <template>_part2.yaml, ... (.json for JSON
+# templates) and the original template path keeps the last part. Parts only reference earlier ones, so the stacks
+# requiring the original stack in the stacker config are still deployed after every part.
+
+# Hard limits of CloudFormation. stacker uploads the templates to S3, so the 1 MB limit applies instead of the
+# 51,200 bytes of a template sent in the request body
+
+CLOUDFORMATION_LIMITS = {
+    "max_resources": 500,
+    "max_outputs": 200,
+    "max_template_size": 1024 * 1024
+}
+
+# Size at which a template is split, can be overridden per stage with the stack_limits variable.
+# Kept under the hard limits because the Exports rewiring the parts are only known once the split is done
+
+DEFAULT_STACK_LIMITS = {
+    "max_resources": 400,
+    "max_outputs": 160,
+    "max_template_size": 800 * 1024
+}
+
+SUB_REFERENCE = re.compile(r"\$\{([A-Za-z0-9]+)(?:\.[A-Za-z0-9.]+)?\}")
+
+
+class Template(troposphere.Template):
+
+    # troposphere checks the limits CloudFormation had when it was released (200 resources, 60 outputs) as the
+    # resources are added. Templates that can be split are checked by write_template() once they are complete
+    def add_resource(self, resource):
+        return self._update(self.resources, resource)
+
+    def add_output(self, output):
+        return self._update(self.outputs, output)
+
+
+def part_path(template_path, number):
+
+    base, extension = os.path.splitext(template_path)
+
+    return "{}_part{}{}".format(base, number, extension)
+
+
+def part_paths(template_path):
+
+    # Parts written by the last split of the template, in deploy order
+    base, extension = os.path.splitext(template_path)
+    paths = glob.glob("{}_part*{}".format(glob.escape(base), extension))
+
+    return sorted(paths, key=lambda path: int(re.search(r"_part(\d+)\.\w+$", path).group(1)))
+
+
+def write_template(template, template_path, export_prefix, limits=None):
+
+    limits = dict(DEFAULT_STACK_LIMITS, **(limits or {}))
+
+    # Rendering is the slow part, a template over the resource or output limits is split without rendering it whole
+    if len(template.resources) <= limits["max_resources"] and len(template.outputs) <= limits["max_outputs"] \
+            and template_writer.write_template(template.to_dict(), template_path, limits["max_template_size"]):
+        remove_parts(template_path, 0)
+        return template_path
+
+    parts = split_template(template.to_dict(), export_prefix, limits)
+    part_templates = [(part, template_path if number == len(parts) else part_path(template_path, number))
+                      for number, part in enumerate(parts, 1)]
+    for part, path in part_templates:
+        for name, limit in [("Resources", "max_resources"), ("Outputs", "max_outputs")]:
+            if len(part.get(name, {})) > CLOUDFORMATION_LIMITS[limit]:
+                raise ValueError("{} has {} {} once split, over the CloudFormation limit of {}".format(
+                    path, len(part[name]), name.lower(), CLOUDFORMATION_LIMITS[limit]))
+
+    # The parts of the last split stay in place until every new part is written, then the ones past the new parts
+    # are removed
+    path = template_writer.write_templates(part_templates, CLOUDFORMATION_LIMITS["max_template_size"])
+    if path is not None:
+        raise ValueError("{} is over the CloudFormation limit of {} bytes once split".format(
+            path, CLOUDFORMATION_LIMITS["max_template_size"]))
+    remove_parts(template_path, len(parts) - 1)
+
+    return template_path
+
+
+def remove_parts(template_path, count):
+
+    # Parts of an earlier split numbered past count
+    for path in part_paths(template_path):
+        if int(re.search(r"_part(\d+)\.\w+$", path).group(1)) > count:
+            os.remove(path)
+
+
+def references(value):
+
+    # Logical IDs a value depends on through Ref, Fn::GetAtt, Fn::Sub and DependsOn
+    found = set()
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == "Ref" and isinstance(item, str):
+                found.add(item)
+            elif key == "Fn::GetAtt":
+                found.add(item[0] if isinstance(item, list) else item.split(".")[0])
+            elif key == "Fn::Sub":
+                found.update(SUB_REFERENCE.findall(item if isinstance(item, str) else item[0]))
+                found.update(references(item))
+            elif key == "DependsOn":
+                found.update([item] if isinstance(item, str) else item)
+            else:
+                found.update(references(item))
+    elif isinstance(value, list):
+        for item in value:
+            found.update(references(item))
+
+    return found
+
+
+def deploy_order(resources):
+
+    # Template order with every resource moved after the resources it depends on
+    order = []
+    visited = set()
+
+    def visit(logical_id):
+        if logical_id in visited:
+            return
+        visited.add(logical_id)
+        for dependency in sorted(references(resources[logical_id]) & set(resources)):
+            visit(dependency)
+        order.append(logical_id)
+
+    for logical_id in resources:
+        visit(logical_id)
+
+    return order
+
+
+def split_template(template, export_prefix, limits):
+
+    resources = template["Resources"]
+    outputs = template.get("Outputs", {})
+    order = deploy_order(resources)
+    position = dict((logical_id, index) for index, logical_id in enumerate(order))
+
+    # An output goes with the last resource it references, outputs without references go to the last part
+    attached_outputs = dict((logical_id, []) for logical_id in order)
+    unattached_outputs = []
+    for name, output in outputs.items():
+        output_references = references(output) & set(resources)
+        if output_references:
+            attached_outputs[max(output_references, key=position.get)].append(name)
+        else:
+            unattached_outputs.append(name)
+
+    # Resources are packed in deploy order, so a part only references the parts before it
+    parts = [{"resources": [], "outputs": [], "size": 0}]
+    for logical_id in order:
+        size = len(json.dumps(resources[logical_id])) \
+            + sum(len(json.dumps(outputs[name])) for name in attached_outputs[logical_id])
+        part = parts[-1]
+        if part["resources"] and (len(part["resources"]) + 1 > limits["max_resources"]
+                                  or len(part["outputs"]) + len(attached_outputs[logical_id]) > limits["max_outputs"]
+                                  or part["size"] + size > limits["max_template_size"]):
+            part = {"resources": [], "outputs": [], "size": 0}
+            parts.append(part)
+
+        part["resources"].append(logical_id)
+        part["outputs"] += attached_outputs[logical_id]
+        part["size"] += size
+    parts[-1]["outputs"] += unattached_outputs
+
+    owner = dict((logical_id, number) for number, part in enumerate(parts) for logical_id in part["resources"])
+
+    # References already exported by the template are imported with their own export name
+    exports = {}
+    for name, output in outputs.items():
+        export_name = output.get("Export", {}).get("Name")
+        if isinstance(export_name, str) and isinstance(output["Value"], dict) \
+                and set(output["Value"]) <= {"Ref", "Fn::GetAtt"}:
+            exports[export_key(output["Value"])] = export_name
+    template_exports = set(exports.values())
+
+    part_templates = []
+    part_exports = [{} for _ in parts]
+    for number, part in enumerate(parts):
+
+        def rewire(value):
+            if isinstance(value, dict):
+                if set(value) <= {"Ref", "Fn::GetAtt"} and value:
+                    key = export_key(value)
+                    if key[0] in owner and owner[key[0]] != number:
+                        if key not in exports:
+                            exports[key] = "{}{}".format(
+                                key[0] if key[0].startswith(export_prefix) else export_prefix + key[0],
+                                key[1].replace(".", "") if key[1] else "Ref")
+                        if exports[key] not in template_exports:
+                            part_exports[owner[key[0]]][key] = value
+                        return {"Fn::ImportValue": exports[key]}
+                if "Fn::Sub" in value:
+                    for logical_id in references({"Fn::Sub": value["Fn::Sub"]}):
+                        if logical_id in owner and owner[logical_id] != number:
+                            raise ValueError("Fn::Sub references {} in another part of the split template, use "
+                                             "Join with Ref or GetAtt instead".format(logical_id))
+                return dict((key, rewire(item)) for key, item in value.items())
+            if isinstance(value, list):
+                return [rewire(item) for item in value]
+            return value
+
+        part_resources = {}
+        for logical_id in part["resources"]:
+            resource = rewire(dict((key, item) for key, item in resources[logical_id].items() if key != "DependsOn"))
+
+            # Resources of the earlier parts already exist when this part is deployed
+            depends_on = resources[logical_id].get("DependsOn")
+            if depends_on is not None:
+                depends_on = [item for item in ([depends_on] if isinstance(depends_on, str) else depends_on)
+                              if owner.get(item) == number]
+                if depends_on:
+                    resource["DependsOn"] = depends_on
+            part_resources[logical_id] = resource
+
+        part_templates.append(dict(
+            dict((key, item) for key, item in template.items() if key not in ("Resources", "Outputs")),
+            Resources=part_resources,
+            Outputs=dict((name, rewire(outputs[name])) for name in part["outputs"])
+        ))
+
+    # Exports needed by the later parts are added once every part has been rewired
+    for number, part_template in enumerate(part_templates):
+        for key, value in part_exports[number].items():
+            if exports[key] in part_template["Outputs"]:
+                raise ValueError("Output {} already exists, cannot export {} under that name".format(
+                    exports[key], key[0]))
+            part_template["Outputs"][exports[key]] = {
+                "Description": "{} of {} for the other parts of the split stack".format(key[1] or "ID", key[0]),
+                "Value": value,
+                "Export": {"Name": exports[key]}
+            }
+        if not part_template["Outputs"]:
+            del part_template["Outputs"]
+
+    return part_templates
+
+
+def export_key(value):
+
+    if "Ref" in value:
+        return value["Ref"], None
+
+    attribute = value["Fn::GetAtt"]
+    if isinstance(attribute, str):
+        attribute = attribute.split(".", 1)
+
+    return attribute[0], attribute[1]
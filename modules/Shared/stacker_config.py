@@ -0,0 +1,245 @@
+import os.path
+
+from Shared import export_index, stack_splitter, template_writer
+
+# The stacker config is derived from the generated templates: a stack requires the stacks exporting the values
+# it imports (Fn::ImportValue) plus its ORDERING_REQUIRES, and only the edges that are not implied by other ones
+# are kept, so stacker deploys everything else concurrently. Templates that are not CloudFormation (e.g. the Packer
+# template of the WordPress image) are left out.
+
+# The stacker config is written to the output folder unless another folder is given. STACKER_CONFIG_DIR is the
+# stacker folder of this repo, holding the environment files and the config.yaml deployed by default
+
+STACKER_CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                  "stacker", "config")
+
+STACK_DESCRIPTIONS = {
+    "PrivateVPC": "Private VPC for Wordpress environment",
+    "BastionVPC": "Bastion VPC for Wordpress environment",
+    "PeerVPCs": "VPC Peering for Wordpress environment",
+    "TransitGateway": "Transit Gateway hub of the Wordpress environments",
+    "TransitGatewayAttachments": "Transit Gateway attachments for Wordpress environment",
+    "BastionHost": "Bastion Host for Wordpress environment",
+    "Wordpress": "Wordpress environment"
+}
+
+# Stacks that need another stack of the stage deployed first without importing any of its exports. The port 22
+# rule of the web servers references the security group of the bastion host, in the bastion VPC, which only
+# resolves once the VPCs are peered. With a transit gateway the rule allows the bastion VPC block instead, and the
+# web servers are only reachable from the bastion host once the VPCs are attached
+
+ORDERING_REQUIRES = {
+    "Wordpress": ["PeerVPCs", "TransitGatewayAttachments"]
+}
+
+# Typical provisioning time (seconds) of the slow resource types, used to estimate the critical path.
+# Every other resource type counts DEFAULT_PROVISIONING_SECONDS
+
+PROVISIONING_SECONDS = {
+    "AWS::CloudFront::Distribution": 900,
+    "AWS::RDS::DBInstance": 600,
+    "AWS::RDS::DBCluster": 300,
+    "AWS::RDS::DBProxy": 300,
+    "AWS::ElastiCache::CacheCluster": 420,
+    "AWS::ElastiCache::ReplicationGroup": 600,
+    "AWS::ElasticLoadBalancingV2::LoadBalancer": 180,
+    "AWS::AutoScaling::AutoScalingGroup": 120,
+    "AWS::EC2::NatGateway": 120,
+    "AWS::EC2::Instance": 60,
+    "AWS::EFS::MountTarget": 90,
+    "AWS::EC2::VPCEndpoint": 60,
+    "AWS::EC2::VPCPeeringConnection": 30,
+    "AWS::EC2::TransitGateway": 180,
+    "AWS::EC2::TransitGatewayAttachment": 90
+}
+
+DEFAULT_PROVISIONING_SECONDS = 10
+
+
+def stage_templates(results):
+
+    # (stack name, generator stack name, template path) of each stage. Parts of a split template are named
+    # <stack>Part<n>
+    templates = {}
+    for result in results:
+        if result["stack"] not in STACK_DESCRIPTIONS:
+            continue
+
+        stage_stacks = templates.setdefault(result["stage"], [])
+        for number, path in enumerate(stack_splitter.part_paths(result["path"]), 1):
+            stage_stacks.append(("{}Part{}".format(result["stack"], number), result["stack"], path))
+        stage_stacks.append((result["stack"], result["stack"], result["path"]))
+
+    return templates
+
+
+def estimated_seconds(resources):
+
+    # Resources of a stack are created in parallel, so the stack takes as long as its longest dependency chain
+    finished = {}
+    for logical_id in stack_splitter.deploy_order(resources):
+        dependencies = stack_splitter.references(resources[logical_id]) & set(resources)
+        finished[logical_id] = max([finished[dependency] for dependency in dependencies] or [0]) \
+            + PROVISIONING_SECONDS.get(resources[logical_id]["Type"], DEFAULT_PROVISIONING_SECONDS)
+
+    return max(finished.values() or [0])
+
+
+def read_stack(name, base_name, path):
+
+    template = export_index.load_template(path)
+
+    return {
+        "name": name,
+        "base_name": base_name,
+        "description": STACK_DESCRIPTIONS.get(base_name, name) if name == base_name
+        else "Part of {}, split to stay under the CloudFormation limits".format(base_name),
+        "path": path,
+        "exports": export_index.exports_of(template),
+        "imports": export_index.imports_of(template.get("Resources", {}))
+        | export_index.imports_of(template.get("Outputs", {})),
+        "seconds": estimated_seconds(template.get("Resources", {}))
+    }
+
+
+def add_ordering_requires(requires, stacks):
+
+    # Parts of a split stack get the ordering edges of the stack, the required stacks are only added when the stage
+    # generates them (e.g. PeerVPCs with the peering connectivity)
+    names = set(stack["name"] for stack in stacks)
+    for stack in stacks:
+        requires[stack["name"]] |= set(ORDERING_REQUIRES.get(stack["base_name"], [])) & names
+
+    return requires
+
+
+def minimal_requires(requires, order):
+
+    # Transitive reduction: an edge is dropped when the required stack is already reached through another one
+    reachable = {}
+    for name in order:
+        reachable[name] = set()
+        for required in requires[name]:
+            reachable[name] |= {required} | reachable[required]
+
+    return dict((name, set(required for required in requires[name]
+                           if not any(required in reachable[other] for other in requires[name] if other != required)))
+                for name in order)
+
+
+def critical_path(requires, order, seconds):
+
+    finished = {}
+    previous = {}
+    for name in order:
+        start = 0
+        previous[name] = None
+        for required in requires[name]:
+            if finished[required] > start:
+                start, previous[name] = finished[required], required
+        finished[name] = start + seconds[name]
+
+    path = [max(order, key=lambda name: finished[name])] if order else []
+    while path and previous[path[0]]:
+        path.insert(0, previous[path[0]])
+
+    return path, (finished[path[-1]] if path else 0)
+
+
+def stacker_config_path(config_dir, stage, stage_count):
+
+    # Same rule as the output folders: one stage writes config.yaml, several stages one config per stage
+    if stage_count == 1:
+        return os.path.join(config_dir, "config.yaml")
+
+    return os.path.join(config_dir, "config_{}.yaml".format(stage))
+
+
+def write_stacker_config(path, namespace, region, stacks, requires, order):
+
+    # Paths are relative to the folder of the stacker config, stacker being run from there
+    config_dir = os.path.dirname(os.path.abspath(path))
+    config_name = os.path.basename(path)
+    environment_path = os.path.relpath(os.path.join(STACKER_CONFIG_DIR, "environments", "prod.env"), config_dir)
+    environment_path = ".\\{}".format(environment_path.replace(os.sep, "\\"))
+    lines = [
+        "# stacker build {} .\\{}".format(environment_path, config_name),
+        "# stacker destroy {} .\\{} --force".format(environment_path, config_name),
+        "# Generated by modules/generate_wordpress_stacks.py from the exports and imports of the templates",
+        "",
+        "namespace: \"{}\"".format(namespace),
+        "",
+        "stacks:"
+    ]
+
+    stacks_by_name = dict((stack["name"], stack) for stack in stacks)
+    for name in order:
+        stack = stacks_by_name[name]
+        lines += [
+            "  - name: {}".format(name),
+            "    template_path: {}".format(os.path.relpath(os.path.abspath(stack["path"]), config_dir)),
+            "    description: {}".format(stack["description"]),
+            "    profile: ${env_profile}",
+            "    region: {}".format(region)
+        ]
+        if requires[name]:
+            lines.append("    requires: [{}]".format(", ".join(sorted(requires[name], key=order.index))))
+
+    with template_writer.atomic_open(path) as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def write_stacker_configs(stage_configs, results, config_dir):
+
+    templates = stage_templates(results)
+
+    # Stages sharing a namespace would deploy over each other's stacks, so they get the stage appended
+    namespaces = [config.get("stacker_namespace", "custom-wordpress") for config in stage_configs]
+
+    # Every stage is validated before any stacker config is written, so a broken stage leaves the configs untouched
+    stages = []
+    for config, namespace in zip(stage_configs, namespaces):
+        if config["stage"] not in templates:
+            continue
+        if namespaces.count(namespace) > 1:
+            namespace = "{}-{}".format(namespace, config["stage"])
+
+        stacks = [read_stack(*template) for template in templates[config["stage"]]]
+        requires = add_ordering_requires(
+            export_index.validate_stage(config["stage"], stacks, config.get("external_exports")), stacks)
+        stages.append((config, namespace, stacks, requires))
+
+    export_index.validate_regions([(config["stage"], config["region"],
+                                    set().union(*[stack["exports"] for stack in stacks]))
+                                   for config, _, stacks, _ in stages])
+
+    plans = []
+    for config, namespace, stacks, requires in stages:
+        order = export_index.topological_order(requires)
+        requires = minimal_requires(requires, order)
+        seconds = dict((stack["name"], stack["seconds"]) for stack in stacks)
+        path, path_seconds = critical_path(requires, order, seconds)
+
+        config_path = stacker_config_path(config_dir, config["stage"], len(stage_configs))
+        write_stacker_config(config_path, namespace, config["region"], stacks, requires, order)
+
+        plans.append({"stage": config["stage"], "config_path": config_path, "order": order, "requires": requires,
+                      "seconds": seconds, "critical_path": path, "critical_path_seconds": path_seconds,
+                      "exports": sum(len(stack["exports"]) for stack in stacks),
+                      "imports": sum(len(stack["imports"]) for stack in stacks)})
+
+    return plans
+
+
+def print_deploy_plan(plans):
+
+    for plan in plans:
+        print("{:<12} {:<26} {:>9}  {}".format("STAGE", "STACK", "EST. MIN", "REQUIRES"))
+        for name in plan["order"]:
+            print("{:<12} {:<26} {:>9.1f}  {}".format(plan["stage"], name, plan["seconds"][name] / 60,
+                                                       ", ".join(sorted(plan["requires"][name])) or "-"))
+
+        print("{}: {} imports checked against {} exports".format(plan["stage"], plan["imports"], plan["exports"]))
+        print("Critical path of {}: {} (about {:.0f} minutes). Stacker config: {}".format(
+            plan["stage"], " -> ".join(plan["critical_path"]), plan["critical_path_seconds"] / 60,
+            os.path.relpath(plan["config_path"])))
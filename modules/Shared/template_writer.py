@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+from contextlib import ExitStack, contextmanager
+
+import cfn_flip
+
+# Every generated file is written to a temporary file next to it and renamed over it once complete, so a crash
+# or a template over the size limit never leaves a truncated template that stacker would deploy.
+#
+# Templates are written as YAML (the default, rendered by cfn_flip like troposphere's to_yaml) or as compact JSON,
+# which is streamed to the file without rendering the template into a string first. Compact JSON is about a fifth
+# smaller than YAML against the CloudFormation template size limit.
+
+TEMPLATE_FORMATS = {
+    "yaml": ".yaml",
+    "json": ".json"
+}
+
+# Temporary files are created readable by the owner only, the renamed file gets the permissions open() would give it
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def template_file_name(name, template_format):
+
+    if template_format not in TEMPLATE_FORMATS:
+        raise ValueError("Unknown template format {}, expected one of {}".format(
+            template_format, ", ".join(TEMPLATE_FORMATS)))
+
+    return "{}{}".format(name, TEMPLATE_FORMATS[template_format])
+
+
+@contextmanager
+def atomic_open(path):
+
+    # The file is only renamed over path when the block completes, raising in the block discards it
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary_path = tempfile.mkstemp(prefix=".{}.".format(os.path.basename(path)), suffix=".tmp",
+                                                  dir=directory)
+    try:
+        with os.fdopen(descriptor, 'w') as f:
+            yield f
+        os.chmod(temporary_path, 0o666 & ~UMASK)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+class TemplateTooLarge(Exception):
+    pass
+
+
+def write_templates(templates, max_size=None):
+
+    # templates is a list of (template dict, path), every template being the dict of a troposphere Template
+    # (to_dict()). The format follows the extension of path. Every template is written to its temporary file before
+    # any is renamed, so the files are either all replaced or all left untouched. Returns the path of the first
+    # template over max_size bytes, None once every template is written
+    try:
+        with ExitStack() as stack:
+            for template, path in templates:
+                f = stack.enter_context(atomic_open(path))
+                if path.endswith(TEMPLATE_FORMATS["json"]):
+                    json.dump(template, f, sort_keys=True, separators=(',', ':'))
+                else:
+                    f.write(cfn_flip.to_yaml(json.dumps(template, indent=4, sort_keys=True, separators=(',', ': '))))
+                f.write("\n")
+
+                if max_size is not None and f.tell() > max_size:
+                    raise TemplateTooLarge(path)
+    except TemplateTooLarge as error:
+        return error.args[0]
+
+    return None
+
+
+def write_template(template, path, max_size=None):
+
+    # Returns False, leaving path untouched, when the template is over max_size bytes
+    return write_templates([(template, path)], max_size) is None
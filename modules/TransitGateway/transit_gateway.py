@@ -0,0 +1,163 @@
+import os.path
+
+from troposphere import Template, Tags, Ref, ImportValue, Output, Export
+
+from TransitGateway.transit_gateway_resources import TransitGateway, TransitGatewayRouteTable, \
+    TransitGatewayAttachment, TransitGatewayRouteTableAssociation, TransitGatewayRouteTablePropagation, Route
+from Shared import template_writer
+
+# Connectivity of the VPCs of a stage: "peering" peers the private and bastion VPCs of the stage (PeerVPC),
+# "transit_gateway" attaches them to the transit gateway of the hub stage of their region instead. Every attached VPC
+# gets one attachment, one association, one propagation and one route per route table towards the whole cidr_pool,
+# so connecting N VPCs takes N attachments where peering them with each other takes N*(N-1)/2 connections.
+#
+# The hub stage generates the TransitGateway stack, it has to be deployed before the other stages of the hub.
+
+CONNECTIVITY_MODES = ["peering", "transit_gateway"]
+
+DEFAULT_TRANSIT_GATEWAY = {
+    "hub_stage": None,
+    "amazon_side_asn": 64512
+}
+
+
+def hub_exports(hub_stage):
+
+    return {
+        "transit_gateway_id": "{}TransitGatewayId".format(hub_stage),
+        "route_table_id": "{}TransitGatewayRouteTableId".format(hub_stage)
+    }
+
+
+class TransitGatewayHub:
+    def __init__(self, stage, amazon_side_asn, template_format="yaml", output_dir="modules"):
+
+        self.stage = stage
+        self.amazon_side_asn = amazon_side_asn
+        self.template_path = os.path.join(output_dir, template_writer.template_file_name("template_transit_gateway",
+                                                                                         template_format))
+
+    def create_transit_gateway(self):
+
+        template = Template()
+        template.add_version('2010-09-09')
+
+        # Attachments are associated and propagated to the route table of the hub explicitly, so a VPC attached
+        # from outside of the generated stages is not routed until it is added the same way
+        transit_gateway = template.add_resource(
+            TransitGateway(
+                "{}TransitGateway".format(self.stage),
+                AmazonSideAsn=self.amazon_side_asn,
+                AutoAcceptSharedAttachments="disable",
+                DefaultRouteTableAssociation="disable",
+                DefaultRouteTablePropagation="disable",
+                DnsSupport="enable",
+                Tags=Tags(
+                    Name="{}_transit_gateway".format(self.stage)
+                )
+            )
+        )
+
+        route_table = template.add_resource(
+            TransitGatewayRouteTable(
+                "{}TransitGatewayRouteTable".format(self.stage),
+                TransitGatewayId=Ref(transit_gateway),
+                Tags=Tags(
+                    Name="{}_transit_gateway_route_table".format(self.stage)
+                )
+            )
+        )
+
+        exports = hub_exports(self.stage)
+        template.add_output(
+            [
+                Output(
+                    exports["transit_gateway_id"],
+                    Description="ID of the transit gateway",
+                    Value=Ref(transit_gateway),
+                    Export=Export(exports["transit_gateway_id"])
+                ),
+                Output(
+                    exports["route_table_id"],
+                    Description="ID of the route table of the transit gateway",
+                    Value=Ref(route_table),
+                    Export=Export(exports["route_table_id"])
+                )
+            ]
+        )
+
+        template_writer.write_template(template.to_dict(), self.template_path)
+
+        return self.template_path
+
+
+class TransitGatewayAttachments:
+    def __init__(self, vpcs, hub_stage, destination_cidr_block, template_format="yaml", output_dir="modules"):
+
+        # vpcs are the Shared.environment.Vpc of the stage, destination_cidr_block the cidr_pool of the hub
+        self.stage = vpcs[0].stage
+        self.vpcs = vpcs
+        self.hub_stage = hub_stage
+        self.destination_cidr_block = destination_cidr_block
+        self.template_path = os.path.join(output_dir, template_writer.template_file_name(
+            "template_transit_gateway_attachments", template_format))
+
+    def create_attachments(self):
+
+        template = Template()
+        template.add_version('2010-09-09')
+
+        exports = hub_exports(self.hub_stage)
+
+        for vpc in self.vpcs:
+
+            # An attachment takes one subnet per availability zone, private subnets first
+            zone_subnets = {}
+            for subnet in vpc.private_subnets + vpc.public_subnets:
+                zone_subnets.setdefault(subnet.availability_zone, subnet)
+
+            attachment = template.add_resource(
+                TransitGatewayAttachment(
+                    "{}TransitGatewayAttachment".format(vpc.prefix),
+                    TransitGatewayId=ImportValue(exports["transit_gateway_id"]),
+                    VpcId=ImportValue(vpc.vpc_id_export),
+                    SubnetIds=[ImportValue(vpc.subnet_exports[zone_subnets[zone].name])
+                               for zone in sorted(zone_subnets)],
+                    Tags=Tags(
+                        Name="{}_{}_transit_gateway_attachment".format(self.stage, vpc.formatted_name)
+                    )
+                )
+            )
+
+            template.add_resource(
+                TransitGatewayRouteTableAssociation(
+                    "{}TransitGatewayAssociation".format(vpc.prefix),
+                    TransitGatewayAttachmentId=Ref(attachment),
+                    TransitGatewayRouteTableId=ImportValue(exports["route_table_id"])
+                )
+            )
+
+            template.add_resource(
+                TransitGatewayRouteTablePropagation(
+                    "{}TransitGatewayPropagation".format(vpc.prefix),
+                    TransitGatewayAttachmentId=Ref(attachment),
+                    TransitGatewayRouteTableId=ImportValue(exports["route_table_id"])
+                )
+            )
+
+            # The local route of the VPC is more specific than the pool, everything else of the pool goes to the hub
+            for route_table, route_table_export in [("Public", vpc.public_route_table_export),
+                                                    ("Private", vpc.private_route_table_export)]:
+                template.add_resource(
+                    Route(
+                        "{}{}RouteTransitGatewayRule".format(vpc.prefix, route_table),
+                        DependsOn=attachment.title,
+                        TransitGatewayId=ImportValue(exports["transit_gateway_id"]),
+                        DestinationCidrBlock=self.destination_cidr_block,
+                        RouteTableId=ImportValue(route_table_export)
+                    )
+                )
+
+        template_writer.write_template(template.to_dict(), self.template_path)
+
+        return self.template_path
@@ -0,0 +1,69 @@
+from troposphere import AWSObject, Tags, ec2
+from troposphere.validators import exactly_one, integer
+
+# Transit Gateway resources and the TransitGatewayId target of Route. The troposphere release the stacks are generated
+# with predates them, so they are declared here the same way troposphere declares its own resources.
+
+
+class TransitGateway(AWSObject):
+    resource_type = "AWS::EC2::TransitGateway"
+
+    props = {
+        'AmazonSideAsn': (integer, False),
+        'AutoAcceptSharedAttachments': (str, False),
+        'DefaultRouteTableAssociation': (str, False),
+        'DefaultRouteTablePropagation': (str, False),
+        'Description': (str, False),
+        'DnsSupport': (str, False),
+        'Tags': ((Tags, list), False),
+        'VpnEcmpSupport': (str, False),
+    }
+
+
+class TransitGatewayRouteTable(AWSObject):
+    resource_type = "AWS::EC2::TransitGatewayRouteTable"
+
+    props = {
+        'Tags': ((Tags, list), False),
+        'TransitGatewayId': (str, True),
+    }
+
+
+class TransitGatewayAttachment(AWSObject):
+    resource_type = "AWS::EC2::TransitGatewayAttachment"
+
+    props = {
+        'SubnetIds': ([str], True),
+        'Tags': ((Tags, list), False),
+        'TransitGatewayId': (str, True),
+        'VpcId': (str, True),
+    }
+
+
+class TransitGatewayRouteTableAssociation(AWSObject):
+    resource_type = "AWS::EC2::TransitGatewayRouteTableAssociation"
+
+    props = {
+        'TransitGatewayAttachmentId': (str, True),
+        'TransitGatewayRouteTableId': (str, True),
+    }
+
+
+class TransitGatewayRouteTablePropagation(AWSObject):
+    resource_type = "AWS::EC2::TransitGatewayRouteTablePropagation"
+
+    props = {
+        'TransitGatewayAttachmentId': (str, True),
+        'TransitGatewayRouteTableId': (str, True),
+    }
+
+
+class Route(ec2.Route):
+    props = dict(ec2.Route.props, TransitGatewayId=(str, False))
+
+    def validate(self):
+        exactly_one(self.__class__.__name__, self.properties, ['DestinationCidrBlock', 'DestinationIpv6CidrBlock'])
+        exactly_one(self.__class__.__name__, self.properties, [
+            'EgressOnlyInternetGatewayId', 'GatewayId', 'InstanceId', 'NatGatewayId', 'NetworkInterfaceId',
+            'TransitGatewayId', 'VpcPeeringConnectionId'
+        ])
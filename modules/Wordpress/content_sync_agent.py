@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# WordPress content sync agent, installed on the read instances by the UserData.
+#
+# S3 notifies the content topic of every object created or removed in the wordpress buckets. The agent
+# subscribes a queue of its own to the topic and only copies or deletes the keys it is told about,
+# instead of listing the whole buckets every minute. Runs as the wordpress-content-sync service with the python
+# and aws cli of the AMI.
+#
+# The queue is deleted when the service stops, which does not happen when an instance is reclaimed by Spot or
+# crashes. Every agent also sweeps, at start and then hourly, the queues and subscriptions of instances that no
+# longer exist, and messages expire after the hourly full sync made them useless.
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+try:
+    from urllib.parse import unquote_plus
+except ImportError:
+    from urllib import unquote_plus
+
+CONFIG_FILE = "/etc/wordpress-content-sync.json"
+METADATA_INSTANCE_ID = "http://169.254.169.254/latest/meta-data/instance-id"
+DEVNULL = open(os.devnull, "w")
+SWEEP_SECONDS = 3600
+MESSAGE_RETENTION_SECONDS = 3600
+LIVE_INSTANCE_STATES = "pending,running,stopping,stopped"
+
+
+def aws(config, *args):
+
+    output = subprocess.check_output(("aws", "--region", config["region"], "--output", "json") + args)
+    if not output.strip():
+        return {}
+
+    return json.loads(output.decode("utf-8"))
+
+
+def subscribe(config):
+
+    instance_id = subprocess.check_output(["curl", "-s", METADATA_INSTANCE_ID]).decode("utf-8").strip()
+    queue_name = "{}-{}".format(config["queue_prefix"], instance_id)
+
+    queue_url = aws(config, "sqs", "create-queue", "--queue-name", queue_name)["QueueUrl"]
+    queue_arn = aws(config, "sqs", "get-queue-attributes", "--queue-url", queue_url,
+                    "--attribute-names", "QueueArn")["Attributes"]["QueueArn"]
+
+    queue_policy = {
+        "Version": "2012-10-17",
+        "Statement": [{
+            "Effect": "Allow",
+            "Principal": {"Service": "sns.amazonaws.com"},
+            "Action": "sqs:SendMessage",
+            "Resource": queue_arn,
+            "Condition": {"ArnEquals": {"aws:SourceArn": config["topic_arn"]}}
+        }]
+    }
+    aws(config, "sqs", "set-queue-attributes", "--queue-url", queue_url,
+        "--attributes", json.dumps({"Policy": json.dumps(queue_policy),
+                                    "MessageRetentionPeriod": str(MESSAGE_RETENTION_SECONDS)}))
+
+    subscription_arn = aws(config, "sns", "subscribe", "--topic-arn", config["topic_arn"], "--protocol", "sqs",
+                           "--notification-endpoint", queue_arn, "--attributes", "RawMessageDelivery=true",
+                           "--return-subscription-arn")["SubscriptionArn"]
+
+    return queue_url, subscription_arn
+
+
+def sweep(config):
+
+    # Queues and subscriptions are named after their instance, the ones of instances that are gone are removed.
+    # Agents sweep concurrently, so a queue another agent already deleted is not an error
+    prefix = config["queue_prefix"] + "-"
+    queue_urls = {}
+    for queue_url in aws(config, "sqs", "list-queues", "--queue-name-prefix", prefix).get("QueueUrls", []):
+        queue_urls[queue_url.rsplit("/", 1)[1][len(prefix):]] = queue_url
+
+    subscription_arns = {}
+    for subscription in aws(config, "sns", "list-subscriptions-by-topic",
+                            "--topic-arn", config["topic_arn"]).get("Subscriptions", []):
+        queue_name = subscription["Endpoint"].rsplit(":", 1)[-1]
+        if queue_name.startswith(prefix) and subscription["SubscriptionArn"].startswith("arn:"):
+            subscription_arns.setdefault(queue_name[len(prefix):], []).append(subscription["SubscriptionArn"])
+
+    instance_ids = sorted(set(queue_urls) | set(subscription_arns))
+    live_instance_ids = set()
+    for start in range(0, len(instance_ids), 100):
+        live_instance_ids.update(aws(config, "ec2", "describe-instances", "--filters",
+                                     "Name=instance-id,Values=" + ",".join(instance_ids[start:start + 100]),
+                                     "Name=instance-state-name,Values=" + LIVE_INSTANCE_STATES,
+                                     "--query", "Reservations[].Instances[].InstanceId") or [])
+
+    for instance_id in instance_ids:
+        if instance_id in live_instance_ids:
+            continue
+        try:
+            for subscription_arn in subscription_arns.get(instance_id, []):
+                aws(config, "sns", "unsubscribe", "--subscription-arn", subscription_arn)
+            if instance_id in queue_urls:
+                aws(config, "sqs", "delete-queue", "--queue-url", queue_urls[instance_id])
+        except subprocess.CalledProcessError as error:
+            sys.stderr.write("Could not remove the queue of {}: {}\n".format(instance_id, error))
+
+
+def local_path(bucket, key):
+
+    # Only the keys under the bucket prefix are mirrored, relative to the local folder of the bucket
+    if not key.startswith(bucket["prefix"]):
+        return None
+
+    local_dir = os.path.realpath(bucket["path"])
+    path = os.path.realpath(os.path.join(local_dir, key[len(bucket["prefix"]):]))
+    if not path.startswith(local_dir + os.sep):
+        return None
+
+    return path
+
+
+def apply_change(config, bucket_name, key):
+
+    path = local_path(config["buckets"][bucket_name], key)
+    if path is None or key.endswith("/"):
+        return
+
+    # Events can arrive out of order, so the current state of the key on S3 decides what to do
+    exists = subprocess.call(["aws", "--region", config["region"], "s3api", "head-object",
+                              "--bucket", bucket_name, "--key", key], stdout=DEVNULL, stderr=DEVNULL) == 0
+    if exists:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        subprocess.check_call(["aws", "--region", config["region"], "s3", "cp", "--only-show-errors",
+                               "s3://{}/{}".format(bucket_name, key), path])
+    elif os.path.isfile(path):
+        os.remove(path)
+
+
+def full_sync(config):
+
+    for bucket_name, bucket in sorted(config["buckets"].items()):
+        subprocess.call(["aws", "--region", config["region"], "s3", "sync", "--delete", "--only-show-errors",
+                         "s3://{}/{}".format(bucket_name, bucket["prefix"]), bucket["path"]])
+
+
+def main():
+
+    with open(CONFIG_FILE) as f:
+        config = json.load(f)
+    config["buckets"] = dict((bucket["name"], bucket) for bucket in config["buckets"])
+
+    queue_url, subscription_arn = subscribe(config)
+
+    def stop(signum, frame):
+        aws(config, "sns", "unsubscribe", "--subscription-arn", subscription_arn)
+        aws(config, "sqs", "delete-queue", "--queue-url", queue_url)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+
+    # Catch up with what changed before the subscription existed
+    full_sync(config)
+
+    next_sweep = 0
+    while True:
+        if time.time() >= next_sweep:
+            try:
+                sweep(config)
+            except subprocess.CalledProcessError as error:
+                sys.stderr.write("Could not sweep the queues: {}\n".format(error))
+            next_sweep = time.time() + SWEEP_SECONDS
+
+        response = aws(config, "sqs", "receive-message", "--queue-url", queue_url,
+                       "--max-number-of-messages", "10", "--wait-time-seconds", "20")
+
+        for message in response.get("Messages", []):
+            changes = set()
+            for record in json.loads(message["Body"]).get("Records", []):
+                bucket = record["s3"]["bucket"]["name"]
+                if bucket in config["buckets"]:
+                    changes.add((bucket, unquote_plus(record["s3"]["object"]["key"])))
+
+            try:
+                for bucket, key in sorted(changes):
+                    apply_change(config, bucket, key)
+            except (subprocess.CalledProcessError, OSError) as error:
+                # The message becomes visible again after its visibility timeout and is retried
+                sys.stderr.write("Could not apply {}: {}\n".format(sorted(changes), error))
+                continue
+
+            aws(config, "sqs", "delete-message", "--queue-url", queue_url,
+                "--receipt-handle", message["ReceiptHandle"])
+
+
+if __name__ == "__main__":
+    main()
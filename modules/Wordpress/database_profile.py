@@ -0,0 +1,101 @@
+# Database parameter profile of the WordPress database, derived from the memory of the instance class and the IOPS
+# of its storage instead of the engine defaults.
+
+# Memory (MiB) of the database instance classes
+
+DB_INSTANCE_MEMORY = {
+    "db.t2.micro": 1024,
+    "db.t2.small": 2048,
+    "db.t2.medium": 4096,
+    "db.t2.large": 8192,
+    "db.t3.micro": 1024,
+    "db.t3.small": 2048,
+    "db.t3.medium": 4096,
+    "db.t3.large": 8192,
+    "db.t3.xlarge": 16384,
+    "db.t3.2xlarge": 32768,
+    "db.m5.large": 8192,
+    "db.m5.xlarge": 16384,
+    "db.m5.2xlarge": 32768,
+    "db.m5.4xlarge": 65536,
+    "db.r5.large": 16384,
+    "db.r5.xlarge": 32768,
+    "db.r5.2xlarge": 65536,
+    "db.r5.4xlarge": 131072,
+    "db.r6g.large": 16384,
+    "db.r6g.xlarge": 32768,
+    "db.r6g.2xlarge": 65536,
+    "db.r6g.4xlarge": 131072,
+}
+
+# Assumptions behind the profile, can be overridden per stage with the database_tuning variable.
+#   reserved_memory: MiB left to the OS and the RDS agents
+#   connection_memory: MiB of sort, join and read buffers one connection can hold
+#   small_instance_memory: up to this many MiB the buffer pool only takes half of the memory instead of 3/4
+
+DEFAULT_DATABASE_TUNING = {
+    "reserved_memory": 256,
+    "connection_memory": 8,
+    "min_connections": 50,
+    "max_connections": 4000,
+    "small_instance_memory": 2048,
+    "long_query_time": 1
+}
+
+
+def parameter_group_family(engine, engine_version):
+
+    # e.g: MySQL 5.7.23 -> mysql5.7, aurora-mysql 8.0.mysql_aurora.3.04.0 -> aurora-mysql8.0
+    return "{}{}".format(engine.lower(), ".".join(engine_version.split(".")[:2]))
+
+
+def database_parameters(instance_class, family, storage_iops, performance_insights, tuning=None):
+
+    tuning = dict(DEFAULT_DATABASE_TUNING, **(tuning or {}))
+
+    # Slow queries are what Performance Insights and the slow log are for, performance_schema feeds Performance Insights
+    parameters = {
+        "slow_query_log": "1",
+        "long_query_time": str(tuning["long_query_time"]),
+        "performance_schema": "1" if performance_insights else "0"
+    }
+
+    # The MySQL query cache serializes the queries of every read node on one mutex, and is gone in MySQL 8.0
+    if family == "mysql5.7":
+        parameters["query_cache_type"] = "0"
+        parameters["query_cache_size"] = "0"
+
+    # Serverless v2 resizes the buffer pool and the connection limit with its capacity
+    if instance_class == "db.serverless":
+        return parameters
+
+    if instance_class not in DB_INSTANCE_MEMORY:
+        raise ValueError("No database profile for instance class {}, add it to DB_INSTANCE_MEMORY".format(
+            instance_class))
+
+    memory = DB_INSTANCE_MEMORY[instance_class]
+    if memory <= tuning["small_instance_memory"]:
+        buffer_pool = memory // 2
+    else:
+        buffer_pool = memory * 3 // 4
+
+    # Connections share what the buffer pool and the OS leave
+    max_connections = (memory - buffer_pool - tuning["reserved_memory"]) // tuning["connection_memory"]
+    max_connections = max(tuning["min_connections"], min(tuning["max_connections"], max_connections))
+
+    temporary_tables = 64 if memory >= 8192 else 32
+
+    parameters.update({
+        "innodb_buffer_pool_size": str(buffer_pool * 1024 * 1024),
+        "max_connections": str(max_connections),
+        "tmp_table_size": str(temporary_tables * 1024 * 1024),
+        "max_heap_table_size": str(temporary_tables * 1024 * 1024)
+    })
+
+    # Background flushing gets half of what the storage sustains, bursts up to all of it.
+    # Aurora storage is not sized by the stack
+    if storage_iops:
+        parameters["innodb_io_capacity"] = str(max(100, storage_iops // 2))
+        parameters["innodb_io_capacity_max"] = str(max(200, storage_iops))
+
+    return parameters
@@ -0,0 +1,81 @@
+from troposphere import AWSObject, AWSProperty, rds
+from troposphere.validators import boolean, integer, floatingpoint
+
+# RDS Proxy, Aurora Serverless v2, Secrets Manager and the gp3, storage autoscaling and Performance Insights properties
+# of DBInstance. The troposphere release the stacks are generated with predates them, so they are declared here the
+# same way troposphere declares its own resources.
+
+
+class ServerlessV2ScalingConfiguration(AWSProperty):
+    props = {
+        'MaxCapacity': (floatingpoint, True),
+        'MinCapacity': (floatingpoint, True),
+    }
+
+
+class ServerlessV2DBCluster(rds.DBCluster):
+    props = dict(rds.DBCluster.props, ServerlessV2ScalingConfiguration=(ServerlessV2ScalingConfiguration, False))
+
+
+class DBInstance(rds.DBInstance):
+    props = dict(
+        rds.DBInstance.props,
+        EnablePerformanceInsights=(boolean, False),
+        MaxAllocatedStorage=(integer, False),
+        PerformanceInsightsRetentionPeriod=(integer, False),
+        StorageThroughput=(integer, False),
+        StorageType=(str, False),
+    )
+
+
+class Secret(AWSObject):
+    resource_type = "AWS::SecretsManager::Secret"
+
+    props = {
+        'Description': (str, False),
+        'Name': (str, False),
+        'SecretString': (str, False),
+    }
+
+
+class AuthFormat(AWSProperty):
+    props = {
+        'AuthScheme': (str, False),
+        'IAMAuth': (str, False),
+        'SecretArn': (str, False),
+    }
+
+
+class DBProxy(AWSObject):
+    resource_type = "AWS::RDS::DBProxy"
+
+    props = {
+        'Auth': ([AuthFormat], True),
+        'DBProxyName': (str, True),
+        'EngineFamily': (str, True),
+        'IdleClientTimeout': (integer, False),
+        'RequireTLS': (boolean, False),
+        'RoleArn': (str, True),
+        'VpcSecurityGroupIds': ([str], False),
+        'VpcSubnetIds': ([str], True),
+    }
+
+
+class ConnectionPoolConfigurationInfoFormat(AWSProperty):
+    props = {
+        'ConnectionBorrowTimeout': (integer, False),
+        'MaxConnectionsPercent': (integer, False),
+        'MaxIdleConnectionsPercent': (integer, False),
+    }
+
+
+class DBProxyTargetGroup(AWSObject):
+    resource_type = "AWS::RDS::DBProxyTargetGroup"
+
+    props = {
+        'ConnectionPoolConfigurationInfo': (ConnectionPoolConfigurationInfoFormat, False),
+        'DBClusterIdentifiers': ([str], False),
+        'DBInstanceIdentifiers': ([str], False),
+        'DBProxyName': (str, True),
+        'TargetGroupName': (str, True),
+    }
@@ -0,0 +1,42 @@
+from troposphere import AWSProperty
+from troposphere.autoscaling import AutoScalingGroup, LaunchTemplateSpecification
+from troposphere.validators import integer
+
+# AutoScalingGroup MixedInstancesPolicy properties. The troposphere release the stacks are generated with
+# predates them, so they are declared here the same way troposphere declares its own properties.
+
+
+class LaunchTemplateOverrides(AWSProperty):
+    props = {
+        'InstanceType': (str, False),
+        'WeightedCapacity': (str, False),
+    }
+
+
+class LaunchTemplate(AWSProperty):
+    props = {
+        'LaunchTemplateSpecification': (LaunchTemplateSpecification, True),
+        'Overrides': ([LaunchTemplateOverrides], False),
+    }
+
+
+class InstancesDistribution(AWSProperty):
+    props = {
+        'OnDemandAllocationStrategy': (str, False),
+        'OnDemandBaseCapacity': (integer, False),
+        'OnDemandPercentageAboveBaseCapacity': (integer, False),
+        'SpotAllocationStrategy': (str, False),
+        'SpotInstancePools': (integer, False),
+        'SpotMaxPrice': (str, False),
+    }
+
+
+class MixedInstancesPolicy(AWSProperty):
+    props = {
+        'InstancesDistribution': (InstancesDistribution, False),
+        'LaunchTemplate': (LaunchTemplate, True),
+    }
+
+
+class MixedInstancesAutoScalingGroup(AutoScalingGroup):
+    props = dict(AutoScalingGroup.props, MixedInstancesPolicy=(MixedInstancesPolicy, False))
@@ -0,0 +1,301 @@
+import base64
+import gzip
+import os.path
+
+from troposphere import Base64, Join
+
+# UserData building blocks shared by every stage and node type.
+# Sections are plain strings or lists mixing strings and troposphere references (Ref, GetAtt, ...).
+
+INSTALL_WORDPRESS = """yum install httpd php php-mysql php-fpm php-opcache -y
+cd /var/www/html
+echo "healthy" > healthy.html
+wget https://wordpress.org/latest.tar.gz
+tar -xzf latest.tar.gz
+cp -r wordpress/* /var/www/html/
+rm -rf wordpress
+rm -rf latest.tar.gz
+find wp-content -type d -exec chmod 0755 {} +
+find wp-content -type f -exec chmod 0644 {} +
+chown -R apache:apache wp-content
+"""
+
+# wp-content gets its permissions when it is installed, and can be the shared EFS filesystem, so the recursive
+# pass at every boot leaves it out
+
+CONFIGURE_HTTPD = """chkconfig httpd on
+chkconfig php-fpm on
+cd /var/www
+sudo find html -path html/wp-content -prune -o -exec chown apache {} +
+cd html/
+sudo find . -path ./wp-content -prune -o -type d -exec chmod 0755 {} +
+sudo find . -path ./wp-content -prune -o -type f -exec chmod 0644 {} +
+sed -i 's/AllowOverride None/AllowOverride All/g' /etc/httpd/conf/httpd.conf
+sed -i 's/AllowOverride none/AllowOverride All/g' /etc/httpd/conf/httpd.conf
+"""
+
+START_HTTPD = """service php-fpm start
+service httpd start
+"""
+
+# Plugins behind the optional drop-ins. They are downloaded at boot, or baked into the WordPress image
+
+INSTALL_OBJECT_CACHE = {
+    "redis": """wget -q https://downloads.wordpress.org/plugin/redis-cache.latest-stable.zip
+unzip -q redis-cache.latest-stable.zip -d wp-content/plugins/
+rm -f redis-cache.latest-stable.zip
+""",
+    "memcached": """yum install php-pecl-memcache -y
+wget -q https://downloads.wordpress.org/plugin/memcached.latest-stable.zip
+unzip -q memcached.latest-stable.zip -d wp-content/plugins/
+rm -f memcached.latest-stable.zip
+"""
+}
+
+INSTALL_LUDICROUSDB = """wget -q https://github.com/stuttter/ludicrousdb/archive/master.tar.gz -O ludicrousdb.tar.gz
+mkdir -p wp-content/plugins/ludicrousdb
+tar -xzf ludicrousdb.tar.gz -C wp-content/plugins/ludicrousdb --strip-components=1
+rm -f ludicrousdb.tar.gz
+"""
+
+# Everything that does not depend on the stage is baked into the WordPress image, instances booting from it
+# only run the stage specific sections
+
+BAKED_IMAGE = INSTALL_WORDPRESS + INSTALL_OBJECT_CACHE["redis"] + INSTALL_OBJECT_CACHE["memcached"] \
+    + INSTALL_LUDICROUSDB + CONFIGURE_HTTPD
+
+BOOT_FROM_BAKED_IMAGE = """cd /var/www/html
+"""
+
+# Apache event MPM hands PHP over to a PHP-FPM pool instead of running mod_php in every worker.
+# The values come from the WEB_* variables set by web_server_profile()
+
+WEB_SERVER = """sed -i 's/^LoadModule php/#LoadModule php/' /etc/httpd/conf.modules.d/*.conf
+sed -i 's/^LoadModule mpm_/#LoadModule mpm_/' /etc/httpd/conf.modules.d/00-mpm.conf
+echo 'LoadModule mpm_event_module modules/mod_mpm_event.so' >> /etc/httpd/conf.modules.d/00-mpm.conf
+cat > /etc/httpd/conf.d/wordpress-tuning.conf <<HTTPD
+# ${WEB_INSTANCE_TYPE}: ${WEB_VCPUS} vCPU, ${WEB_MEMORY} MiB
+<IfModule mpm_event_module>
+    ServerLimit ${WEB_SERVER_LIMIT}
+    ThreadsPerChild ${WEB_THREADS_PER_CHILD}
+    MaxRequestWorkers ${WEB_MAX_REQUEST_WORKERS}
+</IfModule>
+KeepAlive On
+KeepAliveTimeout ${WEB_KEEPALIVE_TIMEOUT}
+MaxKeepAliveRequests ${WEB_MAX_KEEPALIVE_REQUESTS}
+<FilesMatch \\.php$>
+    SetHandler "proxy:unix:/run/php-fpm/wordpress.sock|fcgi://localhost"
+</FilesMatch>
+DirectoryIndex index.php index.html
+HTTPD
+rm -f /etc/php-fpm.d/www.conf
+cat > /etc/php-fpm.d/wordpress.conf <<FPM
+[wordpress]
+user = apache
+group = apache
+listen = /run/php-fpm/wordpress.sock
+listen.owner = apache
+listen.group = apache
+pm = dynamic
+pm.max_children = ${WEB_PHP_MAX_CHILDREN}
+pm.start_servers = ${WEB_PHP_START_SERVERS}
+pm.min_spare_servers = ${WEB_PHP_MIN_SPARE_SERVERS}
+pm.max_spare_servers = ${WEB_PHP_MAX_SPARE_SERVERS}
+pm.max_requests = ${WEB_PHP_MAX_REQUESTS}
+php_admin_value[memory_limit] = ${WEB_PHP_MEMORY_LIMIT}M
+FPM
+cat > /etc/php.d/99-wordpress-opcache.ini <<OPCACHE
+opcache.enable=1
+opcache.memory_consumption=${WEB_OPCACHE_MEMORY}
+opcache.interned_strings_buffer=${WEB_OPCACHE_INTERNED_STRINGS_BUFFER}
+opcache.max_accelerated_files=${WEB_OPCACHE_MAX_ACCELERATED_FILES}
+opcache.validate_timestamps=1
+opcache.revalidate_freq=${WEB_OPCACHE_REVALIDATE_FREQ}
+opcache.save_comments=1
+OPCACHE
+"""
+
+EVERY_MINUTE = "*/1 * * * *"
+HOURLY = "0 * * * *"
+
+# The agent is shipped compressed (and base64 encoded) to leave room under the 16 KB UserData limit.
+# mtime=0 keeps the archive, and so the template, identical between runs
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "content_sync_agent.py"), 'rb') as f:
+    CONTENT_SYNC_AGENT = base64.encodebytes(gzip.compress(f.read(), mtime=0)).decode("ascii")
+
+# The agent runs as a service: restarted when it fails, started once per boot, and stopped (deleting its queue)
+# before the network goes down when the instance is terminated
+
+CONTENT_SYNC_SERVICE = """cat > /etc/systemd/system/wordpress-content-sync.service <<'UNIT'
+[Unit]
+Description=WordPress content sync agent
+Wants=network-online.target
+After=network-online.target
+
+[Service]
+ExecStart=/usr/local/bin/wordpress-content-sync
+Restart=always
+RestartSec=10
+TimeoutStopSec=60
+
+[Install]
+WantedBy=multi-user.target
+UNIT
+systemctl daemon-reload
+systemctl enable wordpress-content-sync
+systemctl start wordpress-content-sync
+"""
+
+
+def cloudfront_rewrite(cloudfront_domain_name):
+
+    return [
+        "echo -e 'Options +FollowSymlinks \\nRewriteEngine on \\n"
+        "rewriterule ^wp-content/uploads/(.*)$ http://",
+        cloudfront_domain_name,
+        "/$1 [r=301,nc]' > .htaccess\n"
+    ]
+
+
+def mount_content(file_system_id, region):
+
+    # The first instance to mount the empty filesystem seeds it with the wp-content of the release.
+    # wp-config.php lives on the filesystem too, so the one written by the installer reaches every instance:
+    # apache owns the root of the filesystem to create it through the symlink. Only the root is changed, the
+    # seeded files keep the ownership of the release
+    return [
+        "yum install nfs-utils -y\n"
+        "mv wp-content /tmp/wp-content-release\n"
+        "mkdir wp-content\n"
+        "echo '",
+        file_system_id,
+        ".efs.",
+        region,
+        ".amazonaws.com:/ /var/www/html/wp-content nfs4 "
+        "nfsvers=4.1,rsize=1048576,wsize=1048576,hard,timeo=600,retrans=2,noresvport,_netdev 0 0' >> /etc/fstab\n"
+        "until mount /var/www/html/wp-content; do sleep 10; done\n"
+        "if [ ! -d wp-content/themes ]; then cp -a /tmp/wp-content-release/. wp-content/; fi\n"
+        "chown apache:apache wp-content\n"
+        "rm -rf /tmp/wp-content-release\n"
+        "ln -sf /var/www/html/wp-content/wp-config.php wp-config.php\n"
+    ]
+
+
+def web_server_profile(profile):
+
+    # profile comes from web_profile.web_profile() for the instance type of the node
+    return "".join("WEB_{}={}\n".format(name.upper(), value) for name, value in sorted(profile.items()))
+
+
+def web_server(profile):
+
+    return web_server_profile(profile) + WEB_SERVER
+
+
+def web_server_by_instance_type(profiles, default_profile):
+
+    # Nodes of a mixed instances group share one UserData, so the profile is picked at boot from the instance type.
+    # Only the variables depend on the instance type, the configuration is written once to keep the UserData small
+    if len(profiles) == 1 and profiles[0] == default_profile:
+        return web_server(default_profile)
+
+    section = "case $(curl -s http://169.254.169.254/latest/meta-data/instance-type) in\n"
+    for profile in profiles:
+        section += "{})\n".format(profile["instance_type"]) + web_server_profile(profile) + ";;\n"
+
+    return section + "*)\n" + web_server_profile(default_profile) + ";;\nesac\n" + WEB_SERVER
+
+
+def database_host(host):
+
+    # The WordPress installer creates wp-config.php from wp-config-sample.php, so DB_HOST comes prefilled
+    return ["sed -i \"s/'localhost'/'"] + parts(host) + ["'/\" wp-config-sample.php\n"]
+
+
+def object_cache(engine, address, port):
+
+    # The drop-in object-cache.php is read by every request; the connection settings go into
+    # wp-config-sample.php because the WordPress installer creates wp-config.php from it
+    if engine == "redis":
+        return [
+            "cp wp-content/plugins/redis-cache/includes/object-cache.php wp-content/object-cache.php\n"
+            "sed -i \"/stop editing/i define('WP_REDIS_HOST', '",
+            address,
+            "');\" wp-config-sample.php\n"
+            "sed -i \"/stop editing/i define('WP_REDIS_PORT', {});\" wp-config-sample.php\n".format(port)
+        ]
+
+    return [
+        "cp wp-content/plugins/memcached/object-cache.php wp-content/object-cache.php\n"
+        "sed -i \"/stop editing/i \\$memcached_servers = array('default' => array('",
+        address,
+        ":{}'));\" wp-config-sample.php\n".format(port)
+    ]
+
+
+def read_replicas(replica_addresses):
+
+    # LudicrousDB replaces wpdb: writes go to DB_HOST from wp-config.php, reads are spread over the replicas
+    section = [
+        "cp wp-content/plugins/ludicrousdb/ludicrousdb/drop-ins/db.php wp-content/db.php\n"
+        "cat > db-config.php <<'EOF'\n"
+        "<?php\n"
+        "$wpdb->save_queries = false;\n"
+        "$wpdb->persistent = false;\n"
+        "$wpdb->check_tcp_responsiveness = true;\n"
+        "$wpdb->add_database(array('host' => DB_HOST, 'user' => DB_USER, 'password' => DB_PASSWORD, "
+        "'name' => DB_NAME, 'write' => 1, 'read' => 0));\n"
+    ]
+    for address in replica_addresses:
+        section += [
+            "$wpdb->add_database(array('host' => '",
+            address,
+            "', 'user' => DB_USER, 'password' => DB_PASSWORD, 'name' => DB_NAME, 'write' => 0, 'read' => 1));\n"
+        ]
+
+    return section + ["EOF\n"]
+
+
+def content_sync_agent(region, topic_arn, queue_prefix, buckets):
+
+    # buckets are (bucket name, key prefix, local folder) tuples
+    section = [
+        "base64 -d <<'AGENT' | gunzip > /usr/local/bin/wordpress-content-sync\n",
+        CONTENT_SYNC_AGENT,
+        "AGENT\n"
+        "chmod 755 /usr/local/bin/wordpress-content-sync\n"
+        "cat > /etc/wordpress-content-sync.json <<CONFIG\n"
+        '{"region": "', region, '", "topic_arn": "', topic_arn, '", "queue_prefix": "' + queue_prefix + '", "buckets": ['
+    ]
+    for index, (bucket, prefix, path) in enumerate(buckets):
+        section += [", " if index else "", '{"name": "', bucket, '", "prefix": "' + prefix + '", "path": "' + path + '"}']
+
+    return section + [
+        "]}\n"
+        "CONFIG\n",
+        CONTENT_SYNC_SERVICE
+    ]
+
+
+def s3_sync_cron(source, destination, schedule=EVERY_MINUTE):
+
+    return ['echo -e "' + schedule + ' root aws s3 sync --delete '] + parts(source) + [' '] \
+        + parts(destination) + ['" >> /etc/crontab\n']
+
+
+def parts(section):
+
+    if isinstance(section, list):
+        return section
+
+    return [section]
+
+
+def user_data(*sections):
+
+    body = ["#!/bin/bash\n"]
+    for section in sections:
+        body.extend(parts(section))
+
+    return Base64(Join("", body))
@@ -0,0 +1,105 @@
+# Web server profile of the WordPress instances: Apache event MPM in front of a PHP-FPM pool with OPcache,
+# sized from the vCPUs and memory of the instance type instead of the mod_php defaults.
+
+# vCPUs and memory (MiB) of the instance types the web tier is usually run on
+
+INSTANCE_SIZES = {
+    "t2.nano": (1, 512),
+    "t2.micro": (1, 1024),
+    "t2.small": (1, 2048),
+    "t2.medium": (2, 4096),
+    "t2.large": (2, 8192),
+    "t2.xlarge": (4, 16384),
+    "t2.2xlarge": (8, 32768),
+    "t3.nano": (2, 512),
+    "t3.micro": (2, 1024),
+    "t3.small": (2, 2048),
+    "t3.medium": (2, 4096),
+    "t3.large": (2, 8192),
+    "t3.xlarge": (4, 16384),
+    "t3.2xlarge": (8, 32768),
+    "t3a.nano": (2, 512),
+    "t3a.micro": (2, 1024),
+    "t3a.small": (2, 2048),
+    "t3a.medium": (2, 4096),
+    "t3a.large": (2, 8192),
+    "t3a.xlarge": (4, 16384),
+    "t3a.2xlarge": (8, 32768),
+    "m5.large": (2, 8192),
+    "m5.xlarge": (4, 16384),
+    "m5.2xlarge": (8, 32768),
+    "m5.4xlarge": (16, 65536),
+    "c5.large": (2, 4096),
+    "c5.xlarge": (4, 8192),
+    "c5.2xlarge": (8, 16384),
+    "c5.4xlarge": (16, 32768),
+    "r5.large": (2, 16384),
+    "r5.xlarge": (4, 32768),
+    "r5.2xlarge": (8, 65536),
+}
+
+# Assumptions behind the profile, can be overridden per stage with the web_tuning variable.
+#   reserved_memory: MiB left to the OS, httpd and the sync agents
+#   php_process_memory: average MiB used by one PHP-FPM child serving WordPress
+#   php_children_per_vcpu: PHP children beyond this count only queue on the CPU
+#   keepalive_timeout: above the idle timeout of the load balancer (60 seconds by default, the WordPress stack
+#                      passes its own), so the load balancer always closes idle connections first and never
+#                      sends a request on a closed one
+
+DEFAULT_WEB_TUNING = {
+    "reserved_memory": 384,
+    "php_process_memory": 64,
+    "php_memory_limit": 256,
+    "php_children_per_vcpu": 8,
+    "php_max_requests": 500,
+    "opcache_max_accelerated_files": 10000,
+    "keepalive_timeout": 65,
+    "max_keepalive_requests": 1000,
+    "threads_per_child": 25,
+}
+
+
+def web_profile(instance_type, opcache_revalidate_freq, tuning=None):
+
+    if instance_type not in INSTANCE_SIZES:
+        raise ValueError("No web server profile for instance type {}, add it to INSTANCE_SIZES".format(
+            instance_type))
+
+    tuning = dict(DEFAULT_WEB_TUNING, **(tuning or {}))
+    vcpus, memory = INSTANCE_SIZES[instance_type]
+
+    if memory < 1024:
+        opcache_memory = 64
+    elif memory < 4096:
+        opcache_memory = 128
+    else:
+        opcache_memory = 256
+
+    # PHP children are bounded by the memory left once the OS and OPcache are served, and by the CPUs
+    php_memory = memory - tuning["reserved_memory"] - opcache_memory
+    max_children = max(2, min(php_memory // tuning["php_process_memory"],
+                              vcpus * tuning["php_children_per_vcpu"]))
+
+    # Apache threads only hand requests over to PHP-FPM, the event MPM keeps idle keep-alive connections off them
+    server_limit = max(4, vcpus * 2)
+
+    return {
+        "instance_type": instance_type,
+        "vcpus": vcpus,
+        "memory": memory,
+        "php_max_children": max_children,
+        "php_start_servers": min(max_children, vcpus * 2),
+        "php_min_spare_servers": min(max_children, vcpus),
+        "php_max_spare_servers": min(max_children, vcpus * 4),
+        "php_max_requests": tuning["php_max_requests"],
+        "php_memory_limit": tuning["php_memory_limit"],
+        "opcache_memory": opcache_memory,
+        "opcache_interned_strings_buffer": opcache_memory // 16,
+        "opcache_max_accelerated_files": tuning["opcache_max_accelerated_files"],
+        "opcache_revalidate_freq": opcache_revalidate_freq,
+        "server_limit": server_limit,
+        "threads_per_child": tuning["threads_per_child"],
+        "max_request_workers": server_limit * tuning["threads_per_child"],
+        "keepalive_timeout": tuning["keepalive_timeout"],
+        "max_keepalive_requests": tuning["max_keepalive_requests"],
+    }
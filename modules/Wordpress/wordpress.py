@@ -1,73 +1,273 @@
-from troposphere import Template, ImportValue, Ref, GetAtt, Output, Export, Tags, Join, Base64
+import json
+import os.path
+
+from troposphere import ImportValue, Ref, GetAtt, Output, Export, Tags, Join, AWS_REGION
 from troposphere.ec2 import SecurityGroup, SecurityGroupRule, SpotFleet, SpotFleetRequestConfigData, \
                             LaunchSpecifications, TagSpecifications, \
-                            SecurityGroups, SpotFleetTagSpecification, IamInstanceProfile
-from troposphere.s3 import Bucket, Private, BucketPolicy
+                            SecurityGroups, SpotFleetTagSpecification, IamInstanceProfile, \
+                            LaunchTemplate, LaunchTemplateData
+from troposphere.s3 import Bucket, Private, BucketPolicy, NotificationConfiguration, TopicConfigurations
+from troposphere.sns import Topic, TopicPolicy
 from troposphere.cloudfront import CloudFrontOriginAccessIdentity, CloudFrontOriginAccessIdentityConfig, \
-                                   Distribution, DistributionConfig, Origin, DefaultCacheBehavior, ForwardedValues, S3Origin
-from troposphere.rds import DBInstance, DBSubnetGroup
+                                   Distribution, DistributionConfig, Origin, DefaultCacheBehavior, ForwardedValues, S3Origin, \
+                                   CacheBehavior, CustomOrigin, Cookies
+from troposphere.rds import DBSubnetGroup, DBParameterGroup
+from troposphere.elasticache import CacheCluster, ReplicationGroup, SubnetGroup
+from troposphere.efs import FileSystem, MountTarget
+from troposphere.route53 import RecordSetType, AliasTarget
 from troposphere.iam import Role, Policy, InstanceProfile
-from troposphere.autoscaling import AutoScalingGroup, LaunchConfiguration, Tag
-from troposphere.elasticloadbalancingv2 import LoadBalancer, TargetGroup, Listener, Action
+from troposphere.autoscaling import Tag, ScalingPolicy, ScheduledAction, LaunchTemplateSpecification, \
+                                    TargetTrackingConfiguration, PredefinedMetricSpecification
+from troposphere.cloudwatch import Alarm, MetricDimension
+from troposphere.elasticloadbalancingv2 import LoadBalancer, TargetGroup, Listener, Action, Certificate, Matcher, \
+                                               LoadBalancerAttributes, TargetGroupAttribute
+
+from Wordpress import user_data, web_profile, database_profile
+from Wordpress.mixed_instances import MixedInstancesAutoScalingGroup, MixedInstancesPolicy, InstancesDistribution, \
+                                      LaunchTemplateOverrides
+from Wordpress.mixed_instances import LaunchTemplate as MixedInstancesLaunchTemplate
+from Wordpress.database_resources import ServerlessV2DBCluster, ServerlessV2ScalingConfiguration, Secret, DBProxy, \
+                                         AuthFormat, DBProxyTargetGroup, ConnectionPoolConfigurationInfoFormat, \
+                                         DBInstance
+from Shared import environment, stack_splitter, template_writer
+
+# IAM policy documents do not depend on the stage, so every stage generated by the process shares them
+
+EC2_ASSUME_ROLE_POLICY = {"Statement": [{
+    "Effect": "Allow",
+    "Principal": {
+        "Service": ["ec2.amazonaws.com"]
+    },
+    "Action": ["sts:AssumeRole"]
+}]}
+
+S3_FULL_ACCESS_POLICY = {
+    "Statement": [{
+        "Effect": "Allow",
+        "Action": "s3:*",
+        "Resource": "*"
+    }],
+}
+
+RDS_ASSUME_ROLE_POLICY = {"Statement": [{
+    "Effect": "Allow",
+    "Principal": {
+        "Service": ["rds.amazonaws.com"]
+    },
+    "Action": ["sts:AssumeRole"]
+}]}
+
+# Database engine: "rds" is a RDS instance of database_engine, "aurora" an Aurora MySQL cluster of
+# database_instance_class instances and "aurora-serverless-v2" one scaling between min_capacity and max_capacity ACUs.
+# database_read_replicas are reader instances of the cluster with Aurora
+
+DATABASE_ENGINE_MODES = ["rds", "aurora", "aurora-serverless-v2"]
+
+DEFAULT_AURORA = {
+    "engine_version": "8.0.mysql_aurora.3.04.0",
+    "min_capacity": 0.5,
+    "max_capacity": 4
+}
+
+# RDS Proxy connection pooling, in percent of the max_connections of the database
+
+DEFAULT_DATABASE_PROXY = {
+    "max_connections_percent": 90,
+    "max_idle_connections_percent": 50,
+    "connection_borrow_timeout": 120,
+    "idle_client_timeout": 1800,
+    "require_tls": False
+}
+
+MYSQL_PORT = 3306
+
+RDS_MONITORING_ASSUME_ROLE_POLICY = {"Statement": [{
+    "Effect": "Allow",
+    "Principal": {
+        "Service": ["monitoring.rds.amazonaws.com"]
+    },
+    "Action": ["sts:AssumeRole"]
+}]}
+
+# Database storage of the rds engine mode (Aurora storage grows on its own). gp3 includes 3000 IOPS, more IOPS or
+# throughput can only be provisioned from 400 GiB; max_allocated_storage enables storage autoscaling up to that size
+
+DATABASE_STORAGE_TYPES = ["gp2", "gp3", "io1"]
+GP3_BASELINE_IOPS = 3000
+GP3_PROVISIONED_MIN_STORAGE = 400
+
+DEFAULT_DATABASE_STORAGE = {
+    "allocated_storage": 20,
+    "max_allocated_storage": None,
+    "storage_type": "gp3",
+    "iops": None,
+    "storage_throughput": None
+}
+
+# Performance Insights (not available on the micro and small instance classes) and Enhanced Monitoring, both off by
+# default. An interval of 0 disables Enhanced Monitoring, any other one adds its IAM role and CloudWatch Logs costs
+
+ENHANCED_MONITORING_INTERVALS = [0, 1, 5, 10, 15, 30, 60]
+
+DEFAULT_DATABASE_MONITORING = {
+    "performance_insights": False,
+    "performance_insights_retention": 7,
+    "enhanced_monitoring_interval": 0
+}
+
+# Read instances auto scaling. Target values set to None disable their target tracking policy
+
+DEFAULT_READ_SCALING = {
+    "min_size": 1,
+    "max_size": 3,
+    "target_requests_per_instance": None,
+    "target_cpu_utilization": None,
+    "instance_warmup": 300,
+    "scheduled_actions": [],
+    "cpu_alarm_threshold": 85,
+    "alarm_topic_arn": None
+}
+
+# Read instances fleet: the auto scaling group launches any of instance_types (read_instance_type when empty),
+# on demand for the base capacity and the on demand percentage above it, Spot for the rest.
+# spot_max_price None caps Spot at the on demand price
+
+READ_FLEET_SPOT_ALLOCATION_STRATEGIES = ["capacity-optimized", "lowest-price"]
+
+DEFAULT_READ_FLEET = {
+    "instance_types": [],
+    "on_demand_base_capacity": 0,
+    "on_demand_percentage_above_base_capacity": 0,
+    "spot_allocation_strategy": "capacity-optimized",
+    "spot_max_price": None
+}
+
+# Read instances content sync: "cron" syncs the whole buckets every minute, "events" runs the
+# content sync agent which only pulls the keys S3 notifies about (with an hourly sync as fallback)
+
+CONTENT_SYNC_MODES = ["cron", "events"]
+
+# wp-content storage: "s3" copies it to every instance through the buckets, "efs" mounts a shared EFS filesystem
+
+CONTENT_STORAGE_MODES = ["s3", "efs"]
+
+EFS_THROUGHPUT_MODES = ["bursting", "provisioned"]
+
+DEFAULT_EFS = {
+    "performance_mode": "generalPurpose",
+    "throughput_mode": "bursting",
+    "provisioned_throughput": None
+}
+
+# Full site Cloudfront distribution in front of the load balancer. TTLs are in seconds
+
+DEFAULT_SITE_CDN = {
+    "static_ttl": 604800,
+    "page_ttl": 300
+}
+
+# Load balancer profile. The health check uses the healthy.html page written by the UserData so new read nodes
+# are marked healthy after two quick checks. Slow start and least outstanding requests routing cannot be combined,
+# stickiness is the duration of the load balancer cookie (None disables it) and certificate_arn (ACM) adds an
+# HTTPS listener serving HTTP/2
+
+DEFAULT_LOAD_BALANCER = {
+    "health_check_path": "/healthy.html",
+    "health_check_interval": 10,
+    "health_check_timeout": 5,
+    "healthy_threshold": 2,
+    "unhealthy_threshold": 3,
+    "slow_start": 0,
+    "deregistration_delay": 30,
+    "idle_timeout": 60,
+    "least_outstanding_requests": True,
+    "stickiness": None,
+    "http2": True,
+    "certificate_arn": None,
+    "ssl_policy": "ELBSecurityPolicy-TLS-1-2-2017-01"
+}
+
+# Cookies that change what WordPress renders, they are part of the cache key of the pages
+WORDPRESS_COOKIES = ["comment_author_*", "wordpress_logged_in_*", "wordpress_test_cookie", "wp-postpass_*",
+                     "wp-settings-*"]
+
+ALL_METHODS = ["GET", "HEAD", "OPTIONS", "PUT", "PATCH", "POST", "DELETE"]
+
+# ElastiCache object cache shared by the write and read nodes. Redis gets automatic failover from two nodes
 
+OBJECT_CACHE_PORTS = {"redis": 6379, "memcached": 11211}
+
+DEFAULT_OBJECT_CACHE = {
+    "engine": "redis",
+    "node_type": "cache.t2.micro",
+    "num_nodes": 1
+}
+
+SPOT_FLEET_ASSUME_ROLE_POLICY = {
+    "Statement": [
+        {
+            "Action": "sts:AssumeRole",
+            "Principal": {
+                "Service": "spotfleet.amazonaws.com"
+            },
+            "Effect": "Allow",
+            "Sid": ""
+        }
+    ],
+    "Version": "2012-10-17"
+}
 
 class WordPress:
-    def __init__(self, stage, database_name, database_instance_class, database_engine, database_engine_version, 
-                       database_username, database_password, database_port, database_multiaz, database_name_tag,
-                       write_instance_image_id, write_instance_type, write_instance_key_name,
-                       read_instance_image_id, read_instance_type, read_instance_key_name,
-                       private_vpc_name, private_vpc_subnets):
+    def __init__(self, stage, private_vpc, database, site, bastion_cidr_block=None, stack_limits=None,
+                 template_format="yaml", output_dir="modules"):
+
+        # private_vpc is a Shared.environment.Vpc, database a Shared.environment.Database and site a
+        # Shared.environment.Site. Their option dicts are merged over the defaults once
         self.stage = stage
-        self.database_name = database_name
-        self.database_instance_class = database_instance_class
-        self.database_engine = database_engine
-        self.database_engine_version = database_engine_version 
-        self.database_username = database_username
-        self.database_password = database_password
-        self.database_port = database_port
-        self.database_multiaz = database_multiaz
-        self.database_name_tag = database_name_tag
-        self.write_instance_image_id = write_instance_image_id
-        self.write_instance_type = write_instance_type
-        self.write_instance_key_name = write_instance_key_name
-        self.read_instance_image_id = read_instance_image_id
-        self.read_instance_type = read_instance_type
-        self.read_instance_key_name = read_instance_key_name
-        self.private_vpc_name = private_vpc_name
-        self.private_vpc_subnets = private_vpc_subnets
+        self.private_vpc = private_vpc
+        self.bastion_cidr_block = bastion_cidr_block
+        self.database = database
+        self.site = site
+        self.aurora = dict(DEFAULT_AURORA, **(database.aurora or {}))
+        self.database_proxy = dict(DEFAULT_DATABASE_PROXY, **database.proxy) if database.proxy is not None else None
+        self.database_storage = dict(DEFAULT_DATABASE_STORAGE, **(database.storage or {}))
+        self.database_monitoring = dict(DEFAULT_DATABASE_MONITORING, **(database.monitoring or {}))
+        self.read_scaling = dict(DEFAULT_READ_SCALING, **(site.read_scaling or {}))
+        self.read_fleet = dict(DEFAULT_READ_FLEET, **(site.read_fleet or {}))
+        self.object_cache = dict(DEFAULT_OBJECT_CACHE, **site.object_cache) if site.object_cache is not None else None
+        self.efs = dict(DEFAULT_EFS, **(site.efs or {}))
+        self.site_cdn = dict(DEFAULT_SITE_CDN, **site.site_cdn) if site.site_cdn is not None else None
+        self.load_balancer = dict(DEFAULT_LOAD_BALANCER, **(site.load_balancer or {}))
+        self.stack_limits = stack_limits
+        self.template_path = os.path.join(output_dir, template_writer.template_file_name("template_wordpress",
+                                                                                         template_format))
 
     def create_wordpress_environment(self):
 
-        template = Template()
+        template = stack_splitter.Template()
         template.add_version('2010-09-09')
         
-        # Wordpress preparation: format vpc name and split private and public subnets in two lists
-       
-        vpc_name_formatted = ''.join(
-            e for e in self.private_vpc_name if e.isalnum()).capitalize()
-
-        filter_private_subnets = filter(lambda x : x["type"] == "private", self.private_vpc_subnets)
-        filter_public_subnets = filter(lambda x : x["type"] == "public", self.private_vpc_subnets)
-
-        private_subnets = []
-        for subnet in filter_private_subnets:
-            subnet_name_formatted = ''.join(e for e in subnet["name"] if e.isalnum()).capitalize()
+        # Wordpress preparation: private and public subnets of the private VPC, imported from its stack
 
-            private_subnets.append(ImportValue("{}{}{}SubnetId".format(self.stage, vpc_name_formatted, subnet_name_formatted)))
+        private_subnets = [ImportValue(export_name) for export_name in self.private_vpc.private_subnet_exports]
+        public_subnets = [ImportValue(export_name) for export_name in self.private_vpc.public_subnet_exports]
 
-        public_subnets = []
-        for subnet in filter_public_subnets:
-            subnet_name_formatted = ''.join(e for e in subnet["name"] if e.isalnum()).capitalize()
+        # Instances Security Groups. SSH is allowed from the security group of the bastion host, which resolves across
+        # peered VPCs. A transit gateway does not reference security groups of other VPCs by default, the bastion
+        # VPC block (bastion_cidr_block) is allowed instead, its only instance being the bastion host
 
-            public_subnets.append(ImportValue("{}{}{}SubnetId".format(self.stage, vpc_name_formatted, subnet_name_formatted)))
-
-        # Instances Security Groups
+        if self.bastion_cidr_block:
+            bastion_ssh_source = {"CidrIp": self.bastion_cidr_block}
+        else:
+            bastion_ssh_source = {
+                "SourceSecurityGroupId": ImportValue("{}BastionHostSecurityGroupID".format(self.stage))
+            }
 
         web_dmz_security_group = template.add_resource(
             SecurityGroup(
                 "{}WebDMZSecurityGroup".format(self.stage),
                 GroupName="{}webdmz-sg".format(self.stage),
-                VpcId=ImportValue("{}{}VpcId".format(self.stage,vpc_name_formatted)),
+                VpcId=ImportValue(self.private_vpc.vpc_id_export),
                 GroupDescription="Enables external http access to EC2 instance(s) that host the webpages",
                 SecurityGroupIngress=[
                     SecurityGroupRule(
@@ -76,40 +276,134 @@ class WordPress:
                         ToPort="80",
                         CidrIp="0.0.0.0/0",
                     ),
+                    *([SecurityGroupRule(
+                        IpProtocol="tcp",
+                        FromPort="443",
+                        ToPort="443",
+                        CidrIp="0.0.0.0/0",
+                    )] if self.load_balancer["certificate_arn"] else []),
                     SecurityGroupRule(
                         IpProtocol="tcp",
                         FromPort="22",
                         ToPort="22",
-                        SourceSecurityGroupId=ImportValue("{}BastionHostSecurityGroupID".format(self.stage))
+                        **bastion_ssh_source
                     )
                 ]
             )
         )
 
+        # With RDS Proxy the webservers reach the proxy, and only the proxy reaches the database
+
+        database_client_security_group = web_dmz_security_group
+        if self.database_proxy:
+            rds_proxy_security_group = template.add_resource(
+                SecurityGroup(
+                    "{}RdsProxySecurityGroup".format(self.stage),
+                    GroupName="{}rds-proxy-sg".format(self.stage),
+                    VpcId=ImportValue(self.private_vpc.vpc_id_export),
+                    GroupDescription="Allow access to the RDS Proxy from the webservers",
+                    SecurityGroupIngress=[
+                        SecurityGroupRule(
+                            IpProtocol="tcp",
+                            FromPort=MYSQL_PORT,
+                            ToPort=MYSQL_PORT,
+                            SourceSecurityGroupId=Ref(web_dmz_security_group)
+                        )
+                    ]
+                )
+            )
+            database_client_security_group = rds_proxy_security_group
+
         rds_private_security_group = template.add_resource(
             SecurityGroup(
                 "{}RdsPrivateSecurityGroup".format(self.stage),
                 GroupName="{}rds-private-sg".format(self.stage),
-                VpcId=ImportValue("{}{}VpcId".format(self.stage,vpc_name_formatted)),
+                VpcId=ImportValue(self.private_vpc.vpc_id_export),
                 GroupDescription="Allow access to the mysql port from the webservers",
                 SecurityGroupIngress=[
                     SecurityGroupRule(
                         IpProtocol="tcp",
-                        FromPort=self.database_port,
-                        ToPort=self.database_port,
+                        FromPort=self.database.port,
+                        ToPort=self.database.port,
+                        SourceSecurityGroupId=Ref(database_client_security_group)
+                    )
+                ] + ([
+                    # Read replicas are not behind the proxy
+                    SecurityGroupRule(
+                        IpProtocol="tcp",
+                        FromPort=self.database.port,
+                        ToPort=self.database.port,
                         SourceSecurityGroupId=Ref(web_dmz_security_group)
                     )
-                ]
+                ] if self.database_proxy and self.database.read_replicas else [])
             )
         )
 
         # S3 Buckets for wordpress content
 
+        if self.site.content_sync not in CONTENT_SYNC_MODES:
+            raise ValueError("Content sync must be one of {}, got {}".format(
+                ", ".join(CONTENT_SYNC_MODES), self.site.content_sync))
+        if self.site.content_storage not in CONTENT_STORAGE_MODES:
+            raise ValueError("Content storage must be one of {}, got {}".format(
+                ", ".join(CONTENT_STORAGE_MODES), self.site.content_storage))
+        if self.site.content_storage == "efs" and self.site.content_sync == "events":
+            raise ValueError("Content sync events only apply to the s3 content storage")
+        if self.efs["throughput_mode"] not in EFS_THROUGHPUT_MODES:
+            raise ValueError("EFS throughput mode must be one of {}, got {}".format(
+                ", ".join(EFS_THROUGHPUT_MODES), self.efs["throughput_mode"]))
+        if self.efs["throughput_mode"] == "provisioned" and not self.efs["provisioned_throughput"]:
+            raise ValueError("EFS provisioned throughput mode needs a provisioned_throughput in MiB/s")
+        if self.site.content_storage == "efs" and self.database.read_replicas:
+            # The LudicrousDB db.php drop-in of the read nodes would land in the wp-content shared with the write
+            # node, which has no db-config.php
+            raise ValueError("Database read replicas cannot be combined with the efs content storage")
+
+        bucket_notifications = {}
+        if self.site.content_sync == "events":
+            content_changes_topic = template.add_resource(
+                Topic(
+                    "{}ContentChangesTopic".format(self.stage),
+                    TopicName="{}-wordpress-content-changes".format(self.stage)
+                )
+            )
+
+            content_changes_topic_policy = template.add_resource(
+                TopicPolicy(
+                    "{}ContentChangesTopicPolicy".format(self.stage),
+                    Topics=[Ref(content_changes_topic)],
+                    PolicyDocument={
+                        "Version": "2012-10-17",
+                        "Statement": [{
+                            "Effect": "Allow",
+                            "Principal": {"Service": "s3.amazonaws.com"},
+                            "Action": "sns:Publish",
+                            "Resource": Ref(content_changes_topic),
+                            "Condition": {"ArnLike": {"aws:SourceArn": [
+                                "arn:aws:s3:::{}-wordpress-code".format(self.stage),
+                                "arn:aws:s3:::{}-wordpress-media-assets".format(self.stage)
+                            ]}}
+                        }]
+                    }
+                )
+            )
+
+            bucket_notifications = {
+                "DependsOn": content_changes_topic_policy.title,
+                "NotificationConfiguration": NotificationConfiguration(
+                    TopicConfigurations=[
+                        TopicConfigurations(Event="s3:ObjectCreated:*", Topic=Ref(content_changes_topic)),
+                        TopicConfigurations(Event="s3:ObjectRemoved:*", Topic=Ref(content_changes_topic))
+                    ]
+                )
+            }
+
         bucket_wordpress_code = template.add_resource(
             Bucket(
                 "{}BucketWordpressCode".format(self.stage),
                 BucketName="{}-wordpress-code".format(self.stage),
-                AccessControl=Private
+                AccessControl=Private,
+                **bucket_notifications
             )
         )
 
@@ -117,11 +411,95 @@ class WordPress:
             Bucket(
                 "{}BucketWordpressMediaAssets".format(self.stage),
                 BucketName="{}-wordpress-media-assets".format(self.stage),
-                AccessControl=Private
+                AccessControl=Private,
+                **bucket_notifications
+            )
+        )
+
+        # Database to store wordpress data: a RDS instance with optional read replicas, or an Aurora cluster
+        # (provisioned or Serverless v2) with optional reader instances behind its reader endpoint
+
+        if self.database.engine_mode not in DATABASE_ENGINE_MODES:
+            raise ValueError("Database engine mode must be one of {}, got {}".format(
+                ", ".join(DATABASE_ENGINE_MODES), self.database.engine_mode))
+
+        # Database performance profile: parameters sized from the instance class and the storage IOPS,
+        # storage class and monitoring shared by every instance of the database
+
+        storage = self.database_storage
+        if storage["storage_type"] not in DATABASE_STORAGE_TYPES:
+            raise ValueError("Database storage type must be one of {}, got {}".format(
+                ", ".join(DATABASE_STORAGE_TYPES), storage["storage_type"]))
+        if storage["storage_type"] == "io1" and not storage["iops"]:
+            raise ValueError("Database io1 storage needs provisioned iops")
+        if storage["storage_type"] == "gp3" and (storage["iops"] or storage["storage_throughput"]) \
+                and storage["allocated_storage"] < GP3_PROVISIONED_MIN_STORAGE:
+            raise ValueError("Database gp3 iops and throughput can only be provisioned from {} GiB".format(
+                GP3_PROVISIONED_MIN_STORAGE))
+        if self.database_monitoring["enhanced_monitoring_interval"] not in ENHANCED_MONITORING_INTERVALS:
+            raise ValueError("Database enhanced monitoring interval must be one of {}, got {}".format(
+                ", ".join(str(interval) for interval in ENHANCED_MONITORING_INTERVALS),
+                self.database_monitoring["enhanced_monitoring_interval"]))
+
+        if self.database.engine_mode == "rds":
+            database_parameter_family = database_profile.parameter_group_family(self.database.engine,
+                                                                                self.database.engine_version)
+            database_instance_class = self.database.instance_class
+            if storage["storage_type"] == "gp2":
+                storage_iops = max(100, 3 * storage["allocated_storage"])
+            else:
+                storage_iops = storage["iops"] or GP3_BASELINE_IOPS
+        else:
+            database_parameter_family = database_profile.parameter_group_family("aurora-mysql",
+                                                                                self.aurora["engine_version"])
+            if self.database.engine_mode == "aurora-serverless-v2":
+                database_instance_class = "db.serverless"
+            else:
+                database_instance_class = self.database.instance_class
+            storage_iops = None
+
+        database_parameter_group = template.add_resource(
+            DBParameterGroup(
+                "{}RdsParameterGroup".format(self.stage),
+                Description="WordPress database parameters for {}".format(database_instance_class),
+                Family=database_parameter_family,
+                Parameters=database_profile.database_parameters(
+                    database_instance_class, database_parameter_family, storage_iops,
+                    self.database_monitoring["performance_insights"], self.database.tuning)
             )
         )
 
-        # Database Instance to store wordpress data
+        database_instance_settings = {"DBParameterGroupName": Ref(database_parameter_group)}
+
+        if self.database_monitoring["enhanced_monitoring_interval"]:
+            database_monitoring_role = template.add_resource(
+                Role(
+                    "{}RdsMonitoringRole".format(self.stage),
+                    Path="/",
+                    AssumeRolePolicyDocument=RDS_MONITORING_ASSUME_ROLE_POLICY,
+                    ManagedPolicyArns=[
+                        "arn:aws:iam::aws:policy/service-role/AmazonRDSEnhancedMonitoringRole"
+                    ]
+                )
+            )
+            database_instance_settings.update(
+                MonitoringInterval=self.database_monitoring["enhanced_monitoring_interval"],
+                MonitoringRoleArn=GetAtt(database_monitoring_role, "Arn")
+            )
+
+        if self.database_monitoring["performance_insights"]:
+            database_instance_settings.update(
+                EnablePerformanceInsights=True,
+                PerformanceInsightsRetentionPeriod=self.database_monitoring["performance_insights_retention"]
+            )
+
+        database_storage_settings = {"StorageType": storage["storage_type"]}
+        if storage["iops"]:
+            database_storage_settings["Iops"] = storage["iops"]
+        if storage["storage_throughput"]:
+            database_storage_settings["StorageThroughput"] = storage["storage_throughput"]
+        if storage["max_allocated_storage"]:
+            database_storage_settings["MaxAllocatedStorage"] = storage["max_allocated_storage"]
 
         rds_subnet_group = template.add_resource(
             DBSubnetGroup(
@@ -132,29 +510,420 @@ class WordPress:
             )
         )
 
-        template.add_resource(
-            DBInstance(
-                "{}RdsInstance".format(self.stage),
-                DBInstanceIdentifier="{}RdsInstance".format(self.stage),
-                DBName=self.database_name,
-                AllocatedStorage="20",
-                DBInstanceClass=self.database_instance_class,
-                Engine=self.database_engine,
-                EngineVersion=self.database_engine_version,
-                MasterUsername=self.database_username,
-                MasterUserPassword=self.database_password,
-                Port=self.database_port,
-                BackupRetentionPeriod=0,
-                MultiAZ=self.database_multiaz,
-                DBSubnetGroupName=Ref(rds_subnet_group),
-                VPCSecurityGroups=[Ref(rds_private_security_group)],
-                Tags=Tags(
-                    Name=self.database_name_tag
+        read_replica_addresses = []
+        if self.database.engine_mode == "rds":
+            rds_instance = template.add_resource(
+                DBInstance(
+                    "{}RdsInstance".format(self.stage),
+                    DBInstanceIdentifier="{}RdsInstance".format(self.stage),
+                    DBName=self.database.name,
+                    AllocatedStorage=str(storage["allocated_storage"]),
+                    DBInstanceClass=self.database.instance_class,
+                    Engine=self.database.engine,
+                    EngineVersion=self.database.engine_version,
+                    MasterUsername=self.database.username,
+                    MasterUserPassword=self.database.password,
+                    Port=self.database.port,
+                    # RDS only creates read replicas of instances with automated backups
+                    BackupRetentionPeriod=1 if self.database.read_replicas else 0,
+                    MultiAZ=self.database.multiaz,
+                    DBSubnetGroupName=Ref(rds_subnet_group),
+                    VPCSecurityGroups=[Ref(rds_private_security_group)],
+                    Tags=Tags(
+                        Name=self.database.name_tag
+                    ),
+                    **database_storage_settings,
+                    **database_instance_settings
+                )
+            )
+            database_address = GetAtt(rds_instance, "Endpoint.Address")
+            database_proxy_targets = {"DBInstanceIdentifiers": [Ref(rds_instance)]}
+
+            # Read replicas serve the SELECT queries of the read nodes, writes keep going to the primary
+
+            for replica_number in range(1, self.database.read_replicas + 1):
+                read_replica = template.add_resource(
+                    DBInstance(
+                        "{}RdsReadReplica{}".format(self.stage, replica_number),
+                        DBInstanceIdentifier="{}RdsReadReplica{}".format(self.stage, replica_number),
+                        SourceDBInstanceIdentifier=Ref(rds_instance),
+                        DBInstanceClass=self.database.instance_class,
+                        Engine=self.database.engine,
+                        VPCSecurityGroups=[Ref(rds_private_security_group)],
+                        Tags=Tags(
+                            Name="{}ReadReplica{}".format(self.database.name_tag, replica_number)
+                        ),
+                        **database_instance_settings
+                    )
+                )
+                read_replica_addresses.append(GetAtt(read_replica, "Endpoint.Address"))
+
+                template.add_output(
+                    Output(
+                        "{}RdsReadReplica{}EndpointAddress".format(self.stage, replica_number),
+                        Description="Address of the WordPress database read replica {}".format(replica_number),
+                        Value=GetAtt(read_replica, "Endpoint.Address"),
+                        Export=Export("{}RdsReadReplica{}EndpointAddress".format(self.stage, replica_number))
+                    )
+                )
+        else:
+            serverless = self.database.engine_mode == "aurora-serverless-v2"
+            rds_cluster = template.add_resource(
+                ServerlessV2DBCluster(
+                    "{}RdsCluster".format(self.stage),
+                    DBClusterIdentifier="{}-wordpress-cluster".format(self.stage),
+                    DatabaseName=self.database.name,
+                    Engine="aurora-mysql",
+                    EngineVersion=self.aurora["engine_version"],
+                    MasterUsername=self.database.username,
+                    MasterUserPassword=self.database.password,
+                    Port=self.database.port,
+                    BackupRetentionPeriod=1,
+                    DBSubnetGroupName=Ref(rds_subnet_group),
+                    VpcSecurityGroupIds=[Ref(rds_private_security_group)],
+                    Tags=Tags(
+                        Name=self.database.name_tag
+                    ),
+                    **({"ServerlessV2ScalingConfiguration": ServerlessV2ScalingConfiguration(
+                        MinCapacity=self.aurora["min_capacity"],
+                        MaxCapacity=self.aurora["max_capacity"]
+                    )} if serverless else {})
+                )
+            )
+            database_address = GetAtt(rds_cluster, "Endpoint.Address")
+            database_proxy_targets = {"DBClusterIdentifiers": [Ref(rds_cluster)]}
+
+            # The first instance of the cluster is the writer, readers are created after it.
+            # Serverless v2 instances scale between the ACUs of the cluster instead of having a class
+            writer_instance = None
+            for instance_number in range(self.database.read_replicas + 1):
+                if instance_number:
+                    instance_name = "{}RdsReadReplica{}".format(self.stage, instance_number)
+                    instance_name_tag = "{}ReadReplica{}".format(self.database.name_tag, instance_number)
+                else:
+                    instance_name = "{}RdsInstance".format(self.stage)
+                    instance_name_tag = self.database.name_tag
+
+                cluster_instance = template.add_resource(
+                    DBInstance(
+                        instance_name,
+                        **({"DependsOn": writer_instance.title} if writer_instance else {}),
+                        DBInstanceIdentifier=instance_name,
+                        DBClusterIdentifier=Ref(rds_cluster),
+                        DBInstanceClass=database_instance_class,
+                        Engine="aurora-mysql",
+                        Tags=Tags(
+                            Name=instance_name_tag
+                        ),
+                        **database_instance_settings
+                    )
+                )
+                writer_instance = writer_instance or cluster_instance
+
+            if self.database.read_replicas:
+                read_replica_addresses.append(GetAtt(rds_cluster, "ReadEndpoint.Address"))
+
+                template.add_output(
+                    Output(
+                        "{}RdsReaderEndpointAddress".format(self.stage),
+                        Description="Address of the reader endpoint of the WordPress database cluster",
+                        Value=GetAtt(rds_cluster, "ReadEndpoint.Address"),
+                        Export=Export("{}RdsReaderEndpointAddress".format(self.stage))
+                    )
+                )
+
+        template.add_output(
+            Output(
+                "{}RdsEndpointAddress".format(self.stage),
+                Description="Address of the WordPress database",
+                Value=database_address,
+                Export=Export("{}RdsEndpointAddress".format(self.stage))
+            )
+        )
+
+        # RDS Proxy pools the connections of every PHP worker of every node, so scaling out the read nodes
+        # does not exhaust max_connections. Writes go through the proxy, replica reads keep going to the replicas
+
+        if self.database.port != MYSQL_PORT:
+            database_host = [database_address, ":{}".format(self.database.port)]
+        else:
+            database_host = [database_address]
+
+        if self.database_proxy:
+            database_secret = template.add_resource(
+                Secret(
+                    "{}DatabaseSecret".format(self.stage),
+                    Name="{}-wordpress-database".format(self.stage),
+                    Description="Credentials RDS Proxy uses to connect to the WordPress database",
+                    SecretString=json.dumps({"username": self.database.username,
+                                             "password": self.database.password})
+                )
+            )
+
+            database_proxy_role = template.add_resource(
+                Role(
+                    "{}RdsProxyRole".format(self.stage),
+                    Path="/",
+                    AssumeRolePolicyDocument=RDS_ASSUME_ROLE_POLICY,
+                    Policies=[
+                        Policy(
+                            PolicyName="DatabaseSecret",
+                            PolicyDocument={
+                                "Statement": [{
+                                    "Effect": "Allow",
+                                    "Action": "secretsmanager:GetSecretValue",
+                                    "Resource": Ref(database_secret)
+                                }]
+                            }
+                        )
+                    ]
+                )
+            )
+
+            database_proxy = template.add_resource(
+                DBProxy(
+                    "{}RdsProxy".format(self.stage),
+                    DBProxyName="{}-wordpress-proxy".format(self.stage),
+                    EngineFamily="MYSQL",
+                    Auth=[AuthFormat(AuthScheme="SECRETS", SecretArn=Ref(database_secret), IAMAuth="DISABLED")],
+                    RoleArn=GetAtt(database_proxy_role, "Arn"),
+                    VpcSubnetIds=private_subnets,
+                    VpcSecurityGroupIds=[Ref(rds_proxy_security_group)],
+                    RequireTLS=self.database_proxy["require_tls"],
+                    IdleClientTimeout=self.database_proxy["idle_client_timeout"]
+                )
+            )
+
+            template.add_resource(
+                DBProxyTargetGroup(
+                    "{}RdsProxyTargetGroup".format(self.stage),
+                    DBProxyName=Ref(database_proxy),
+                    TargetGroupName="default",
+                    ConnectionPoolConfigurationInfo=ConnectionPoolConfigurationInfoFormat(
+                        MaxConnectionsPercent=self.database_proxy["max_connections_percent"],
+                        MaxIdleConnectionsPercent=self.database_proxy["max_idle_connections_percent"],
+                        ConnectionBorrowTimeout=self.database_proxy["connection_borrow_timeout"]
+                    ),
+                    **database_proxy_targets
+                )
+            )
+
+            database_host = [GetAtt(database_proxy, "Endpoint")]
+
+            template.add_output(
+                Output(
+                    "{}RdsProxyEndpointAddress".format(self.stage),
+                    Description="Address of the RDS Proxy in front of the WordPress database",
+                    Value=GetAtt(database_proxy, "Endpoint"),
+                    Export=Export("{}RdsProxyEndpointAddress".format(self.stage))
+                )
+            )
+
+        database_host_user_data = user_data.database_host(database_host)
+
+        read_replicas_user_data = []
+        if read_replica_addresses:
+            if not self.site.baked_ami_id:
+                read_replicas_user_data.append(user_data.INSTALL_LUDICROUSDB)
+            read_replicas_user_data += user_data.read_replicas(read_replica_addresses)
+
+        # Object cache (ElastiCache) shared by the write and read nodes to offload the database
+
+        object_cache_user_data = []
+        if self.object_cache:
+            object_cache_engine = self.object_cache["engine"]
+            if object_cache_engine not in OBJECT_CACHE_PORTS:
+                raise ValueError("Object cache engine must be one of {}, got {}".format(
+                    ", ".join(sorted(OBJECT_CACHE_PORTS)), object_cache_engine))
+            if self.object_cache["num_nodes"] < 1:
+                raise ValueError("Object cache needs at least one node, got {}".format(self.object_cache["num_nodes"]))
+            if object_cache_engine == "memcached" and self.object_cache["num_nodes"] > 1:
+                # The memcached drop-in only knows the configuration endpoint and does no auto discovery, the other
+                # nodes would never get a key
+                raise ValueError("Memcached object cache only supports one node, got {}".format(
+                    self.object_cache["num_nodes"]))
+
+            object_cache_port = OBJECT_CACHE_PORTS[object_cache_engine]
+
+            object_cache_security_group = template.add_resource(
+                SecurityGroup(
+                    "{}ObjectCacheSecurityGroup".format(self.stage),
+                    GroupName="{}object-cache-sg".format(self.stage),
+                    VpcId=ImportValue(self.private_vpc.vpc_id_export),
+                    GroupDescription="Allow access to the object cache from the webservers",
+                    SecurityGroupIngress=[
+                        SecurityGroupRule(
+                            IpProtocol="tcp",
+                            FromPort=object_cache_port,
+                            ToPort=object_cache_port,
+                            SourceSecurityGroupId=Ref(web_dmz_security_group)
+                        )
+                    ]
+                )
+            )
+
+            object_cache_subnet_group = template.add_resource(
+                SubnetGroup(
+                    "{}ObjectCacheSubnetGroup".format(self.stage),
+                    CacheSubnetGroupName="{}object-cache-subnet-group".format(self.stage),
+                    Description="Subnets available for the object cache",
+                    SubnetIds=private_subnets
+                )
+            )
+
+            if object_cache_engine == "redis":
+                object_cache_cluster = template.add_resource(
+                    ReplicationGroup(
+                        "{}ObjectCache".format(self.stage),
+                        ReplicationGroupDescription="WordPress object cache",
+                        Engine="redis",
+                        CacheNodeType=self.object_cache["node_type"],
+                        NumCacheClusters=self.object_cache["num_nodes"],
+                        AutomaticFailoverEnabled=self.object_cache["num_nodes"] > 1,
+                        Port=object_cache_port,
+                        CacheSubnetGroupName=Ref(object_cache_subnet_group),
+                        SecurityGroupIds=[Ref(object_cache_security_group)]
+                    )
+                )
+                object_cache_address = GetAtt(object_cache_cluster, "PrimaryEndPoint.Address")
+            else:
+                object_cache_cluster = template.add_resource(
+                    CacheCluster(
+                        "{}ObjectCache".format(self.stage),
+                        ClusterName="{}-wordpress-cache".format(self.stage),
+                        Engine="memcached",
+                        CacheNodeType=self.object_cache["node_type"],
+                        NumCacheNodes=self.object_cache["num_nodes"],
+                        AZMode="single-az",
+                        Port=object_cache_port,
+                        CacheSubnetGroupName=Ref(object_cache_subnet_group),
+                        VpcSecurityGroupIds=[Ref(object_cache_security_group)]
+                    )
+                )
+                object_cache_address = GetAtt(object_cache_cluster, "ConfigurationEndpoint.Address")
+
+            if not self.site.baked_ami_id:
+                object_cache_user_data.append(user_data.INSTALL_OBJECT_CACHE[object_cache_engine])
+            object_cache_user_data += user_data.object_cache(object_cache_engine, object_cache_address,
+                                                             object_cache_port)
+
+            template.add_output(
+                Output(
+                    "{}ObjectCacheAddress".format(self.stage),
+                    Description="Address of the WordPress object cache",
+                    Value=object_cache_address,
+                    Export=Export("{}ObjectCacheAddress".format(self.stage))
+                )
+            )
+
+        # Shared EFS filesystem mounted as wp-content by the write and read instances
+
+        mount_content_user_data = []
+        content_mount_targets = []
+        if self.site.content_storage == "efs":
+            efs_security_group = template.add_resource(
+                SecurityGroup(
+                    "{}EfsSecurityGroup".format(self.stage),
+                    GroupName="{}efs-sg".format(self.stage),
+                    VpcId=ImportValue(self.private_vpc.vpc_id_export),
+                    GroupDescription="Allow access to the wp-content filesystem from the webservers",
+                    SecurityGroupIngress=[
+                        SecurityGroupRule(
+                            IpProtocol="tcp",
+                            FromPort=2049,
+                            ToPort=2049,
+                            SourceSecurityGroupId=Ref(web_dmz_security_group)
+                        )
+                    ]
+                )
+            )
+
+            efs_throughput = {}
+            if self.efs["throughput_mode"] == "provisioned":
+                efs_throughput["ProvisionedThroughputInMibps"] = float(self.efs["provisioned_throughput"])
+
+            content_file_system = template.add_resource(
+                FileSystem(
+                    "{}ContentFileSystem".format(self.stage),
+                    Encrypted=True,
+                    PerformanceMode=self.efs["performance_mode"],
+                    ThroughputMode=self.efs["throughput_mode"],
+                    FileSystemTags=Tags(
+                        Name="{}-wordpress-content".format(self.stage)
+                    ),
+                    **efs_throughput
+                )
+            )
+
+            # EFS allows a single mount target per availability zone
+            mount_target_zones = set()
+            for subnet in self.private_vpc.private_subnets:
+                if subnet.availability_zone in mount_target_zones:
+                    continue
+                mount_target_zones.add(subnet.availability_zone)
+
+                content_mount_targets.append(template.add_resource(
+                    MountTarget(
+                        "{}ContentMountTarget{}".format(self.stage, subnet.formatted_name),
+                        FileSystemId=Ref(content_file_system),
+                        SubnetId=ImportValue(self.private_vpc.subnet_exports[subnet.name]),
+                        SecurityGroups=[Ref(efs_security_group)]
+                    )
+                ).title)
+
+            mount_content_user_data = user_data.mount_content(Ref(content_file_system), Ref(AWS_REGION))
+
+            template.add_output(
+                Output(
+                    "{}ContentFileSystemId".format(self.stage),
+                    Description="ID of the wp-content EFS filesystem",
+                    Value=Ref(content_file_system),
+                    Export=Export("{}ContentFileSystemId".format(self.stage))
                 )
             )
+
+        alb = template.add_resource(
+            LoadBalancer(
+                "{}ApplicationLoadBalancer".format(self.stage),
+                Name="{}-wordpress-alb".format(self.stage),
+                SecurityGroups=[Ref(web_dmz_security_group)],
+                Subnets=public_subnets,
+                Type="application",
+                LoadBalancerAttributes=[
+                    LoadBalancerAttributes(Key="idle_timeout.timeout_seconds",
+                                           Value=str(self.load_balancer["idle_timeout"])),
+                    LoadBalancerAttributes(Key="routing.http2.enabled",
+                                           Value=str(self.load_balancer["http2"]).lower())
+                ]
+            )
         )
 
-        # Cloudfront Distribution to load images
+        # Latency record of the region. Every regional stage adds its own record under the same name, so Route 53
+        # answers with the closest load balancer that is healthy
+
+        latency_routing = self.site.latency_routing
+        if latency_routing:
+            if not latency_routing.get("hosted_zone_name") or not latency_routing.get("record_name"):
+                raise ValueError("Latency routing needs a hosted_zone_name and a record_name")
+
+            template.add_resource(
+                RecordSetType(
+                    "{}LatencyRecord".format(self.stage),
+                    HostedZoneName=latency_routing["hosted_zone_name"],
+                    Name=latency_routing["record_name"],
+                    Type="A",
+                    Region=Ref(AWS_REGION),
+                    SetIdentifier=self.stage,
+                    AliasTarget=AliasTarget(
+                        hostedzoneid=GetAtt(alb, "CanonicalHostedZoneID"),
+                        dnsname=GetAtt(alb, "DNSName"),
+                        evaluatetargethealth=True
+                    )
+                )
+            )
+
+        # Cloudfront Distribution to load images. With the full site option it also fronts the load balancer:
+        # static files are cached for long, pages shortly and the admin is never cached
 
         cloudfront_origin_access_identity = template.add_resource(
             CloudFrontOriginAccessIdentity(
@@ -186,35 +955,129 @@ class WordPress:
             }
         ))
 
+        cloudfront_origins = [
+            Origin(
+                Id="MediaAssetsOrigin",
+                DomainName=GetAtt(bucket_wordpress_media_assets, 'DomainName'),
+                S3OriginConfig=S3Origin(
+                    OriginAccessIdentity=Join("", [
+                        "origin-access-identity/cloudfront/",
+                        Ref(cloudfront_origin_access_identity)
+                    ])
+                )
+            )
+        ]
+        cloudfront_cache_behaviors = {}
+
+        if self.site_cdn:
+            cloudfront_origins.append(
+                Origin(
+                    Id="SiteOrigin",
+                    DomainName=GetAtt(alb, 'DNSName'),
+                    CustomOriginConfig=CustomOrigin(
+                        OriginProtocolPolicy="http-only",
+                        OriginKeepaliveTimeout=60
+                    )
+                )
+            )
+
+            cloudfront_default_cache_behavior = DefaultCacheBehavior(
+                TargetOriginId="SiteOrigin",
+                AllowedMethods=ALL_METHODS,
+                CachedMethods=["GET", "HEAD"],
+                ForwardedValues=ForwardedValues(
+                    QueryString=True,
+                    Cookies=Cookies(Forward="whitelist", WhitelistedNames=WORDPRESS_COOKIES)
+                ),
+                MinTTL=0,
+                DefaultTTL=self.site_cdn["page_ttl"],
+                MaxTTL=self.site_cdn["page_ttl"],
+                Compress=True,
+                ViewerProtocolPolicy="allow-all"
+            )
+
+            uncached_behaviors = [
+                CacheBehavior(
+                    PathPattern=path_pattern,
+                    TargetOriginId="SiteOrigin",
+                    AllowedMethods=ALL_METHODS,
+                    CachedMethods=["GET", "HEAD"],
+                    ForwardedValues=ForwardedValues(
+                        QueryString=True,
+                        Cookies=Cookies(Forward="all"),
+                        Headers=["*"]
+                    ),
+                    MinTTL=0,
+                    DefaultTTL=0,
+                    MaxTTL=0,
+                    ViewerProtocolPolicy="allow-all"
+                )
+                for path_pattern in ["wp-admin/*", "wp-login.php"]
+            ]
+
+            static_behaviors = [
+                CacheBehavior(
+                    PathPattern=path_pattern,
+                    TargetOriginId=target_origin,
+                    ForwardedValues=ForwardedValues(
+                        QueryString=target_origin == "SiteOrigin"
+                    ),
+                    MinTTL=0,
+                    DefaultTTL=self.site_cdn["static_ttl"],
+                    MaxTTL=self.site_cdn["static_ttl"],
+                    Compress=True,
+                    ViewerProtocolPolicy="allow-all"
+                )
+                for path_pattern, target_origin in [
+                    ("wp-content/uploads/*", "MediaAssetsOrigin"),
+                    ("wp-content/*", "SiteOrigin"),
+                    ("wp-includes/*", "SiteOrigin")
+                ]
+            ]
+
+            cloudfront_cache_behaviors["CacheBehaviors"] = uncached_behaviors + static_behaviors
+        else:
+            cloudfront_default_cache_behavior = DefaultCacheBehavior(
+                TargetOriginId="MediaAssetsOrigin",
+                ForwardedValues=ForwardedValues(
+                    QueryString=False
+                ),
+                ViewerProtocolPolicy="allow-all"
+            )
+
         cloudfront_distribution = template.add_resource(
             Distribution(
                 "{}CloudfrontDistribution".format(self.stage),
                 DistributionConfig=DistributionConfig(
-                    Origins=[
-                        Origin(
-                            Id="MediaAssetsOrigin",
-                            DomainName=GetAtt(bucket_wordpress_media_assets, 'DomainName'),
-                            S3OriginConfig=S3Origin(
-                                OriginAccessIdentity=Join("", [
-                                    "origin-access-identity/cloudfront/",
-                                    Ref(cloudfront_origin_access_identity)
-                                ])
-                            )
-                        )
-                    ],
-                    DefaultCacheBehavior=DefaultCacheBehavior(
-                        TargetOriginId="MediaAssetsOrigin",
-                        ForwardedValues=ForwardedValues(
-                            QueryString=False
-                        ),
-                        ViewerProtocolPolicy="allow-all"
-                    ),
+                    Origins=cloudfront_origins,
+                    DefaultCacheBehavior=cloudfront_default_cache_behavior,
                     Enabled=True,
-                    HttpVersion='http2'
+                    HttpVersion='http2',
+                    **cloudfront_cache_behaviors
                 )
             )
         )
 
+        # Uploads are redirected to the media distribution. Behind the full site distribution they keep
+        # their path instead, so the media assets are stored under the same prefix in the bucket
+
+        media_assets_prefix = ""
+        media_assets_s3 = ["s3://", Ref(bucket_wordpress_media_assets)]
+        uploads_user_data = user_data.cloudfront_rewrite(GetAtt(cloudfront_distribution, 'DomainName'))
+        if self.site_cdn:
+            media_assets_prefix = "wp-content/uploads/"
+            media_assets_s3 = ["s3://", Ref(bucket_wordpress_media_assets), "/" + media_assets_prefix]
+            uploads_user_data = []
+
+            template.add_output(
+                Output(
+                    "{}SiteDomainName".format(self.stage),
+                    Description="Domain name of the full site Cloudfront distribution",
+                    Value=GetAtt(cloudfront_distribution, 'DomainName'),
+                    Export=Export("{}SiteDomainName".format(self.stage))
+                )
+            )
+
         # Wordpress EC2 Instances
         
         ''' 
@@ -223,49 +1086,80 @@ class WordPress:
                 Read Nodes = Instances open to the internet for blog reading
         '''
 
+        # Instances booting from the baked WordPress image skip the installation of packages and WordPress
+
+        if self.site.baked_ami_id:
+            write_instance_image_id = self.site.baked_ami_id
+            read_instance_image_id = self.site.baked_ami_id
+            install_user_data = user_data.BOOT_FROM_BAKED_IMAGE
+            configure_httpd_user_data = []
+        else:
+            write_instance_image_id = self.site.write_instance_image_id
+            read_instance_image_id = self.site.read_instance_image_id
+            install_user_data = user_data.INSTALL_WORDPRESS
+            configure_httpd_user_data = user_data.CONFIGURE_HTTPD
+
+        # Web server profile of each node type. Plugin and theme updates made on the write node are
+        # picked up at once, read nodes only check their cached scripts every minute like the content sync
+
+        web_tuning = dict({"keepalive_timeout": self.load_balancer["idle_timeout"] + 5}, **(self.site.web_tuning or {}))
+        write_web_server_user_data = user_data.web_server(
+            web_profile.web_profile(self.site.write_instance_type, 0, web_tuning))
+        read_instance_types = self.read_fleet["instance_types"] or [self.site.read_instance_type]
+        read_web_server_user_data = user_data.web_server_by_instance_type(
+            [web_profile.web_profile(instance_type, 60, web_tuning) for instance_type in read_instance_types],
+            web_profile.web_profile(self.site.read_instance_type, 60, web_tuning))
+
+        wordpress_ec2_policies = [
+            Policy(
+                PolicyName="S3FullAccess",
+                PolicyDocument=S3_FULL_ACCESS_POLICY
+            )
+        ]
+
+        if self.site.content_sync == "events":
+            # Every read instance creates and subscribes its own queue to the content changes topic, and removes
+            # the queues and subscriptions of the instances that are gone
+            wordpress_ec2_policies.append(
+                Policy(
+                    PolicyName="ContentSync",
+                    PolicyDocument={
+                        "Statement": [
+                            {
+                                "Effect": "Allow",
+                                "Action": ["sqs:CreateQueue", "sqs:DeleteQueue", "sqs:GetQueueAttributes",
+                                           "sqs:SetQueueAttributes", "sqs:ReceiveMessage", "sqs:DeleteMessage"],
+                                "Resource": "arn:aws:sqs:*:*:{}-wordpress-content-sync-*".format(self.stage)
+                            },
+                            {
+                                "Effect": "Allow",
+                                "Action": ["sns:Subscribe", "sns:Unsubscribe", "sns:ListSubscriptionsByTopic"],
+                                "Resource": Ref(content_changes_topic)
+                            },
+                            {
+                                "Effect": "Allow",
+                                "Action": ["sqs:ListQueues", "ec2:DescribeInstances"],
+                                "Resource": "*"
+                            }
+                        ]
+                    }
+                )
+            )
+
         wordpress_ec2_role = template.add_resource(
             Role(
                 "{}WordPressEC2InstanceRole".format(self.stage),
                 RoleName="{}WordPressEC2InstanceRole".format(self.stage),
                 Path="/",
-                AssumeRolePolicyDocument={"Statement": [{
-                    "Effect": "Allow",
-                    "Principal": {
-                        "Service": ["ec2.amazonaws.com"]
-                    },
-                    "Action": ["sts:AssumeRole"]
-                }]},
-                Policies=[
-                    Policy(
-                        PolicyName="S3FullAccess",
-                        PolicyDocument={
-                            "Statement": [{
-                                "Effect": "Allow",
-                                "Action": "s3:*",
-                                "Resource": "*"
-                            }],
-                        }
-                    )
-                ]
+                AssumeRolePolicyDocument=EC2_ASSUME_ROLE_POLICY,
+                Policies=wordpress_ec2_policies
             )
         )
 
         spotfleetrole = template.add_resource(
             Role(
                 "{}spotfleetrole".format(self.stage),
-                AssumeRolePolicyDocument={
-                    "Statement": [
-                        {
-                            "Action": "sts:AssumeRole",
-                            "Principal": {
-                                "Service": "spotfleet.amazonaws.com"
-                            },
-                            "Effect": "Allow",
-                            "Sid": ""
-                        }
-                    ],
-                    "Version": "2012-10-17"
-                },
+                AssumeRolePolicyDocument=SPOT_FLEET_ASSUME_ROLE_POLICY,
                 ManagedPolicyArns=[
                     "arn:aws:iam::aws:policy/service-role/AmazonEC2SpotFleetRole"
                 ]
@@ -279,9 +1173,45 @@ class WordPress:
             )
         )
 
+        # Content sync: the write instance uploads its changes to S3, read instances download them.
+        # With EFS only the media assets still go to S3 so that Cloudfront can serve them
+
+        if self.site.content_storage == "efs":
+            write_content_sync_user_data = [
+                user_data.s3_sync_cron("/var/www/html/wp-content/uploads",
+                                       media_assets_s3)
+            ]
+            read_content_sync_user_data = []
+        else:
+            write_content_sync_user_data = [
+                user_data.s3_sync_cron("/var/www/html", ["s3://", Ref(bucket_wordpress_code)]),
+                user_data.s3_sync_cron("/var/www/html/wp-content/uploads",
+                                       media_assets_s3)
+            ]
+
+            if self.site.content_sync == "events":
+                read_content_sync_user_data = [
+                    user_data.content_sync_agent(
+                        Ref(AWS_REGION), Ref(content_changes_topic), "{}-wordpress-content-sync".format(self.stage),
+                        [(Ref(bucket_wordpress_code), "", "/var/www/html"),
+                         (Ref(bucket_wordpress_media_assets), media_assets_prefix, "/var/www/html/wp-content/uploads")]
+                    ),
+                    user_data.s3_sync_cron(["s3://", Ref(bucket_wordpress_code)], "/var/www/html",
+                                           schedule=user_data.HOURLY),
+                    user_data.s3_sync_cron(media_assets_s3,
+                                           "/var/www/html/wp-content/uploads", schedule=user_data.HOURLY)
+                ]
+            else:
+                read_content_sync_user_data = [
+                    user_data.s3_sync_cron(["s3://", Ref(bucket_wordpress_code)], "/var/www/html"),
+                    user_data.s3_sync_cron(media_assets_s3,
+                                           "/var/www/html/wp-content/uploads")
+                ]
+
         template.add_resource(
             SpotFleet(
                 "{}WriteWordpressEc2Instance".format(self.stage),
+                **({"DependsOn": content_mount_targets} if content_mount_targets else {}),
                 SpotFleetRequestConfigData=SpotFleetRequestConfigData(
                     AllocationStrategy="lowestPrice",
                     IamFleetRole=GetAtt(spotfleetrole,"Arn"),
@@ -289,44 +1219,21 @@ class WordPress:
                         IamInstanceProfile=IamInstanceProfile(
                             Arn=GetAtt(ec2_instance_profile, "Arn")
                         ),
-                        ImageId=self.write_instance_image_id,
-                        InstanceType=self.write_instance_type,
-                        KeyName=self.write_instance_key_name,
+                        ImageId=write_instance_image_id,
+                        InstanceType=self.site.write_instance_type,
+                        KeyName=self.site.write_instance_key_name,
                         SecurityGroups=[SecurityGroups(GroupId=Ref(web_dmz_security_group))],
                         SubnetId=next(iter(public_subnets)),
-                        UserData=Base64(
-                            Join("", [
-                                """ #!/bin/bash
-                                yum install httpd php php-mysql -y
-                                cd /var/www/html
-                                echo \"healthy\" > healthy.html
-                                wget https://wordpress.org/latest.tar.gz
-                                tar -xzf latest.tar.gz
-                                cp -r wordpress/* /var/www/html/
-                                rm -rf wordpress
-                                rm -rf latest.tar.gz
-                                chmod -R 755 wp-content
-                                chown -R apache:apache wp-content
-                                echo -e 'Options +FollowSymlinks \nRewriteEngine on \nrewriterule ^wp-content/uploads/(.*)$ http://""",
-                                GetAtt(cloudfront_distribution, 'DomainName'),
-                                """/$1 [r=301,nc]' > .htaccess
-                                chkconfig httpd on
-                                cd /var/www
-                                sudo chown -R apache /var/www/html
-                                cd html/
-                                sudo find . -type d -exec chmod 0755 {} \;
-                                sudo find . -type f -exec chmod 0644 {} \;
-                                sed -i 's/AllowOverride None/AllowOverride All/g' /etc/httpd/conf/httpd.conf
-                                sed -i 's/AllowOverride none/AllowOverride All/g' /etc/httpd/conf/httpd.conf
-                                echo -e "*/1 * * * * root aws s3 sync --delete /var/www/html s3://""",
-                                Ref(bucket_wordpress_code),
-                                """">> /etc/crontab 
-                                echo -e "*/1 * * * * root aws s3 sync --delete /var/www/html/wp-content/uploads s3://""",
-                                Ref(bucket_wordpress_media_assets),
-                                """">> /etc/crontab
-                                service httpd start
-                                """
-                            ])
+                        UserData=user_data.user_data(
+                            install_user_data,
+                            mount_content_user_data,
+                            database_host_user_data,
+                            object_cache_user_data,
+                            uploads_user_data,
+                            configure_httpd_user_data,
+                            write_web_server_user_data,
+                            *write_content_sync_user_data,
+                            user_data.START_HTTPD
                         )
                     )],
                     TargetCapacity=1,
@@ -335,62 +1242,56 @@ class WordPress:
             )
         )
 
-        template.add_resource(
-            LaunchConfiguration(
-                "{}WordPressReadLaunchConfiguration".format(self.stage),
-                InstanceType=self.read_instance_type,
-                ImageId=self.read_instance_image_id,
-                KeyName=self.read_instance_key_name,
-                LaunchConfigurationName="{}-wordpress-launch-config".format(self.stage),
-                SecurityGroups=[Ref(web_dmz_security_group)],
-                IamInstanceProfile=Ref(ec2_instance_profile),
-                SpotPrice="0.5",
-                UserData=Base64(
-                    Join("", [
-                        """ #!/bin/bash
-                        yum install httpd php php-mysql -y
-                        cd /var/www/html
-                        echo \"healthy\" > healthy.html
-                        wget https://wordpress.org/latest.tar.gz
-                        tar -xzf latest.tar.gz
-                        cp -r wordpress/* /var/www/html/
-                        rm -rf wordpress
-                        rm -rf latest.tar.gz
-                        chmod -R 755 wp-content
-                        chown -R apache:apache wp-content
-                        echo -e 'Options +FollowSymlinks \nRewriteEngine on \nrewriterule ^wp-content/uploads/(.*)$ http://""",
-                        GetAtt(cloudfront_distribution, 'DomainName'),
-                        """/$1 [r=301,nc]' > .htaccess
-                        chkconfig httpd on
-                        cd /var/www
-                        sudo chown -R apache /var/www/html
-                        cd html/
-                        sudo find . -type d -exec chmod 0755 {} \;
-                        sudo find . -type f -exec chmod 0644 {} \;
-                        sed -i 's/AllowOverride None/AllowOverride All/g' /etc/httpd/conf/httpd.conf
-                        sed -i 's/AllowOverride none/AllowOverride All/g' /etc/httpd/conf/httpd.conf
-                        echo -e "*/1 * * * * root aws s3 sync --delete s3://""",
-                        Ref(bucket_wordpress_code),
-                        """ /var/www/html">> /etc/crontab 
-                        echo -e "*/1 * * * * root aws s3 sync --delete s3://""",
-                        Ref(bucket_wordpress_media_assets),
-                        """/var/www/html/wp-content/uploads">> /etc/crontab
-                        service httpd start
-                        """
-                    ])
+        read_launch_template = template.add_resource(
+            LaunchTemplate(
+                "{}WordPressReadLaunchTemplate".format(self.stage),
+                LaunchTemplateName="{}-wordpress-launch-template".format(self.stage),
+                LaunchTemplateData=LaunchTemplateData(
+                    InstanceType=self.site.read_instance_type,
+                    ImageId=read_instance_image_id,
+                    KeyName=self.site.read_instance_key_name,
+                    SecurityGroupIds=[Ref(web_dmz_security_group)],
+                    IamInstanceProfile=IamInstanceProfile(
+                        Arn=GetAtt(ec2_instance_profile, "Arn")
+                    ),
+                    UserData=user_data.user_data(
+                        install_user_data,
+                        mount_content_user_data,
+                        database_host_user_data,
+                        object_cache_user_data,
+                        read_replicas_user_data,
+                        uploads_user_data,
+                        configure_httpd_user_data,
+                        read_web_server_user_data,
+                        *read_content_sync_user_data,
+                        user_data.START_HTTPD
+                    )
                 )
             )
         )
 
-        alb = template.add_resource(
-            LoadBalancer(
-                "{}ApplicationLoadBalancer".format(self.stage),
-                Name="{}-wordpress-alb".format(self.stage),
-                SecurityGroups=[Ref(web_dmz_security_group)],
-                Subnets=public_subnets,
-                Type="application"
-            )
-        )
+        # Load balancer target group: draining, slow start, routing algorithm and stickiness
+
+        if self.load_balancer["slow_start"] and self.load_balancer["least_outstanding_requests"]:
+            raise ValueError("Load balancer slow start cannot be combined with least outstanding requests routing")
+
+        target_group_attributes = [
+            TargetGroupAttribute(Key="deregistration_delay.timeout_seconds",
+                                 Value=str(self.load_balancer["deregistration_delay"])),
+            TargetGroupAttribute(Key="slow_start.duration_seconds",
+                                 Value=str(self.load_balancer["slow_start"])),
+            TargetGroupAttribute(Key="load_balancing.algorithm.type",
+                                 Value="least_outstanding_requests" if self.load_balancer["least_outstanding_requests"]
+                                 else "round_robin"),
+            TargetGroupAttribute(Key="stickiness.enabled",
+                                 Value=str(self.load_balancer["stickiness"] is not None).lower())
+        ]
+        if self.load_balancer["stickiness"] is not None:
+            target_group_attributes += [
+                TargetGroupAttribute(Key="stickiness.type", Value="lb_cookie"),
+                TargetGroupAttribute(Key="stickiness.lb_cookie.duration_seconds",
+                                     Value=str(self.load_balancer["stickiness"]))
+            ]
 
         target_group = template.add_resource(
             TargetGroup(
@@ -398,20 +1299,52 @@ class WordPress:
                 Name="{}-wordpress-target-group".format(self.stage),
                 Port=80,
                 Protocol="HTTP",
-                VpcId=ImportValue("{}{}VpcId".format(self.stage,vpc_name_formatted)),
-                HealthCheckPort=8080
+                VpcId=ImportValue(self.private_vpc.vpc_id_export),
+                HealthCheckPort="traffic-port",
+                HealthCheckProtocol="HTTP",
+                HealthCheckPath=self.load_balancer["health_check_path"],
+                HealthCheckIntervalSeconds=self.load_balancer["health_check_interval"],
+                HealthCheckTimeoutSeconds=self.load_balancer["health_check_timeout"],
+                HealthyThresholdCount=self.load_balancer["healthy_threshold"],
+                UnhealthyThresholdCount=self.load_balancer["unhealthy_threshold"],
+                Matcher=Matcher(HttpCode="200"),
+                TargetGroupAttributes=target_group_attributes
             )
         )
 
-        template.add_resource(
-            AutoScalingGroup(
+        if self.read_fleet["spot_allocation_strategy"] not in READ_FLEET_SPOT_ALLOCATION_STRATEGIES:
+            raise ValueError("Read fleet Spot allocation strategy must be one of {}, got {}".format(
+                ", ".join(READ_FLEET_SPOT_ALLOCATION_STRATEGIES), self.read_fleet["spot_allocation_strategy"]))
+
+        instances_distribution = InstancesDistribution(
+            OnDemandAllocationStrategy="prioritized",
+            OnDemandBaseCapacity=self.read_fleet["on_demand_base_capacity"],
+            OnDemandPercentageAboveBaseCapacity=self.read_fleet["on_demand_percentage_above_base_capacity"],
+            SpotAllocationStrategy=self.read_fleet["spot_allocation_strategy"]
+        )
+        if self.read_fleet["spot_max_price"] is not None:
+            instances_distribution.SpotMaxPrice = str(self.read_fleet["spot_max_price"])
+
+        read_auto_scaling_group = template.add_resource(
+            MixedInstancesAutoScalingGroup(
                 "{}AutoScalingGroup".format(self.stage),
-                DependsOn="{}WordPressReadLaunchConfiguration".format(self.stage),
+                **({"DependsOn": content_mount_targets} if content_mount_targets else {}),
                 AutoScalingGroupName="{}-wordpress-auto-scaling".format(self.stage),
-                LaunchConfigurationName="{}-wordpress-launch-config".format(self.stage),
+                MixedInstancesPolicy=MixedInstancesPolicy(
+                    InstancesDistribution=instances_distribution,
+                    LaunchTemplate=MixedInstancesLaunchTemplate(
+                        LaunchTemplateSpecification=LaunchTemplateSpecification(
+                            LaunchTemplateId=Ref(read_launch_template),
+                            Version=GetAtt(read_launch_template, "LatestVersionNumber")
+                        ),
+                        # Overrides are listed in priority order for the on demand capacity
+                        Overrides=[LaunchTemplateOverrides(InstanceType=instance_type)
+                                   for instance_type in read_instance_types]
+                    )
+                ),
                 TargetGroupARNs=[Ref(target_group)],
-                MaxSize="3",
-                MinSize="1",
+                MaxSize=str(self.read_scaling["max_size"]),
+                MinSize=str(self.read_scaling["min_size"]),
                 VPCZoneIdentifier=public_subnets,
                 Tags=[
                     Tag("Name", "{}-wordpress-read-node".format(self.stage), True)
@@ -419,6 +1352,105 @@ class WordPress:
             )
         )
 
+        # Read instances scaling: target tracking on the requests each instance receives and on CPU,
+        # scheduled actions for known peaks and alarms for what target tracking does not cover
+
+        if self.read_scaling["target_requests_per_instance"]:
+            template.add_resource(
+                ScalingPolicy(
+                    "{}ReadRequestCountScalingPolicy".format(self.stage),
+                    # The request count metric only exists once the target group is attached to the load balancer
+                    DependsOn="ALBListener",
+                    AutoScalingGroupName=Ref(read_auto_scaling_group),
+                    PolicyType="TargetTrackingScaling",
+                    EstimatedInstanceWarmup=self.read_scaling["instance_warmup"],
+                    TargetTrackingConfiguration=TargetTrackingConfiguration(
+                        PredefinedMetricSpecification=PredefinedMetricSpecification(
+                            PredefinedMetricType="ALBRequestCountPerTarget",
+                            ResourceLabel=Join("/", [
+                                GetAtt(alb, "LoadBalancerFullName"),
+                                GetAtt(target_group, "TargetGroupFullName")
+                            ])
+                        ),
+                        TargetValue=float(self.read_scaling["target_requests_per_instance"])
+                    )
+                )
+            )
+
+        if self.read_scaling["target_cpu_utilization"]:
+            template.add_resource(
+                ScalingPolicy(
+                    "{}ReadCpuScalingPolicy".format(self.stage),
+                    AutoScalingGroupName=Ref(read_auto_scaling_group),
+                    PolicyType="TargetTrackingScaling",
+                    EstimatedInstanceWarmup=self.read_scaling["instance_warmup"],
+                    TargetTrackingConfiguration=TargetTrackingConfiguration(
+                        PredefinedMetricSpecification=PredefinedMetricSpecification(
+                            PredefinedMetricType="ASGAverageCPUUtilization"
+                        ),
+                        TargetValue=float(self.read_scaling["target_cpu_utilization"])
+                    )
+                )
+            )
+
+        for scheduled_action in self.read_scaling["scheduled_actions"]:
+            scheduled_action_name = environment.format_name(scheduled_action["name"])
+
+            template.add_resource(
+                ScheduledAction(
+                    "{}Read{}ScheduledAction".format(self.stage, scheduled_action_name),
+                    AutoScalingGroupName=Ref(read_auto_scaling_group),
+                    Recurrence=scheduled_action["recurrence"],
+                    MinSize=scheduled_action.get("min_size", self.read_scaling["min_size"]),
+                    MaxSize=scheduled_action.get("max_size", self.read_scaling["max_size"]),
+                    **({"DesiredCapacity": scheduled_action["desired_capacity"]}
+                       if "desired_capacity" in scheduled_action else {})
+                )
+            )
+
+        alarm_actions = {}
+        if self.read_scaling["alarm_topic_arn"]:
+            alarm_actions = {
+                "AlarmActions": [self.read_scaling["alarm_topic_arn"]],
+                "OKActions": [self.read_scaling["alarm_topic_arn"]]
+            }
+
+        template.add_resource(
+            Alarm(
+                "{}ReadHighCpuAlarm".format(self.stage),
+                AlarmDescription="Read instances CPU stays high, the auto scaling group may be at its max size",
+                Namespace="AWS/EC2",
+                MetricName="CPUUtilization",
+                Dimensions=[MetricDimension(Name="AutoScalingGroupName", Value=Ref(read_auto_scaling_group))],
+                Statistic="Average",
+                Period=300,
+                EvaluationPeriods=3,
+                Threshold=str(self.read_scaling["cpu_alarm_threshold"]),
+                ComparisonOperator="GreaterThanThreshold",
+                **alarm_actions
+            )
+        )
+
+        template.add_resource(
+            Alarm(
+                "{}ReadUnhealthyHostsAlarm".format(self.stage),
+                AlarmDescription="Read instances are failing the load balancer health check",
+                Namespace="AWS/ApplicationELB",
+                MetricName="UnHealthyHostCount",
+                Dimensions=[
+                    MetricDimension(Name="LoadBalancer", Value=GetAtt(alb, "LoadBalancerFullName")),
+                    MetricDimension(Name="TargetGroup", Value=GetAtt(target_group, "TargetGroupFullName"))
+                ],
+                Statistic="Maximum",
+                Period=60,
+                EvaluationPeriods=5,
+                Threshold="0",
+                ComparisonOperator="GreaterThanThreshold",
+                TreatMissingData="notBreaching",
+                **alarm_actions
+            )
+        )
+
         template.add_resource(
             Listener(
                 "ALBListener",
@@ -434,5 +1466,23 @@ class WordPress:
             )
         )
 
-        f = open("modules/template_wordpress.yaml", 'w')
-        print(template.to_yaml(), file=f)
+        if self.load_balancer["certificate_arn"]:
+            template.add_resource(
+                Listener(
+                    "ALBHttpsListener",
+                    DefaultActions=[
+                        Action(
+                            TargetGroupArn=Ref(target_group),
+                            Type="forward"
+                        )
+                    ],
+                    LoadBalancerArn=Ref(alb),
+                    Port=443,
+                    Protocol="HTTPS",
+                    Certificates=[Certificate(CertificateArn=self.load_balancer["certificate_arn"])],
+                    SslPolicy=self.load_balancer["ssl_policy"]
+                )
+            )
+
+        return stack_splitter.write_template(template, self.template_path, self.stage, self.stack_limits)
+
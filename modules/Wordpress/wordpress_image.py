@@ -0,0 +1,53 @@
+import json
+import os.path
+
+from Wordpress import user_data
+from Shared import template_writer
+
+
+class WordPressImage:
+    def __init__(self, stage, source_ami, instance_type, region, output_dir="modules"):
+        self.stage = stage
+        self.source_ami = source_ami
+        self.instance_type = instance_type
+        self.region = region
+        self.template_path = os.path.join(output_dir, "packer_wordpress_ami.json")
+
+    def create_image_build(self):
+
+        # Packer template baking the stage independent part of the WordPress UserData into an AMI.
+        # Build it with "packer build packer_wordpress_ami.json" and set the AMI ID as baked_ami_id
+
+        template = {
+            "variables": {
+                "region": self.region,
+                "source_ami": self.source_ami,
+                "instance_type": self.instance_type
+            },
+            "builders": [
+                {
+                    "type": "amazon-ebs",
+                    "region": "{{user `region`}}",
+                    "source_ami": "{{user `source_ami`}}",
+                    "instance_type": "{{user `instance_type`}}",
+                    "ssh_username": "ec2-user",
+                    "ami_name": "{}-wordpress-{{{{timestamp}}}}".format(self.stage),
+                    "tags": {
+                        "Name": "{}-wordpress".format(self.stage),
+                        "Stage": self.stage
+                    }
+                }
+            ],
+            "provisioners": [
+                {
+                    "type": "shell",
+                    "execute_command": "sudo -S bash -e '{{ .Path }}'",
+                    "inline": user_data.BAKED_IMAGE.splitlines()
+                }
+            ]
+        }
+
+        with template_writer.atomic_open(self.template_path) as f:
+            json.dump(template, f, indent=2)
+
+        return self.template_path
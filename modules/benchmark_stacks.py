@@ -0,0 +1,297 @@
+import argparse
+import copy
+import gc
+import ipaddress
+import json
+import os.path
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from Shared import export_index, fleet, stack_generator, stack_splitter
+from generate_wordpress_stacks import stage_config
+
+# Offline benchmark of the stack generators. Every scenario is a synthetic stage configuration stressing one
+# dimension (subnets, stages, UserData, template format); each stack is generated once in this process and measured:
+# build time, peak memory, template size, resources, outputs and UserData size.
+#
+#   python benchmark_stacks.py                      compare against benchmark_baseline.json
+#   python benchmark_stacks.py --update-baseline    store the current measures as the new baseline
+#
+# The run fails when a template exceeds a CloudFormation limit or a measure regresses past its tolerance.
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# CloudFormation and EC2 limits
+
+TEMPLATE_SIZE_LIMIT = stack_splitter.CLOUDFORMATION_LIMITS["max_template_size"]
+RESOURCES_LIMIT = stack_splitter.CLOUDFORMATION_LIMITS["max_resources"]
+OUTPUTS_LIMIT = stack_splitter.CLOUDFORMATION_LIMITS["max_outputs"]
+USER_DATA_LIMIT = 16 * 1024
+
+# References inside the UserData (bucket names, endpoints, ...) are only known at deploy time.
+# They are counted with the length of a long endpoint address
+
+REFERENCE_SIZE = 64
+
+# Allowed growth over the baseline. Build time depends on the machine, so it gets more room, and a stack only
+# fails on time once it is also slower by more than the floor: most stacks build in a few milliseconds, where
+# the timer and the scheduler alone make the time vary by more than the tolerance
+
+TOLERANCES = {
+    "seconds": 0.5,
+    "peak_memory": 0.25,
+    "size": 0.1,
+    "resources": 0.0,
+    "outputs": 0.0,
+    "user_data": 0.1
+}
+
+FLOORS = {
+    "seconds": 0.02
+}
+
+TIMING_RUNS = 3
+
+AVAILABILITY_ZONES = ["us-east-1a", "us-east-1b", "us-east-1c", "us-east-1d", "us-east-1e", "us-east-1f"]
+
+
+def many_subnets(subnet_count=48, stage="subnets"):
+
+    # A /16 private VPC split into /24 subnets over every availability zone, a quarter of them public
+    subnets = []
+    for index, cidr_block in enumerate(ipaddress.ip_network("172.16.0.0/16").subnets(new_prefix=24)):
+        if index == subnet_count:
+            break
+
+        subnet_type = "public" if index < subnet_count // 4 else "private"
+        subnets.append({
+            "name": "{}_subnet_{}".format(subnet_type, index),
+            "type": subnet_type,
+            "cidr_block": str(cidr_block),
+            "availability_zone": AVAILABILITY_ZONES[index % len(AVAILABILITY_ZONES)],
+            "map_ip_on_launch": "true" if subnet_type == "public" else "false",
+            "nat_gateway": "false"
+        })
+
+    return [fleet.merge_config(stage_config, {
+        "stage": stage,
+        "private_vpc": {"vpc_cidr_block": "172.16.0.0/16", "subnets": subnets}
+    })]
+
+
+def many_stages(stage_count=20):
+
+    return [fleet.merge_config(stage_config, {"stage": "stage{:02d}".format(number)})
+            for number in range(1, stage_count + 1)]
+
+
+def large_user_data():
+
+    # Every optional UserData section at once, with one web server profile per read instance type
+    return [fleet.merge_config(stage_config, {
+        "stage": "userdata",
+        "wordpress": {
+            "database_read_replicas": 5,
+            "database_proxy": {},
+            "content_sync": "events",
+            "object_cache": {"engine": "redis", "node_type": "cache.t2.micro", "num_nodes": 1},
+            "site_cdn": {},
+            "read_fleet": {"instance_types": ["t3.small", "t3a.small", "t2.small", "t3.medium", "t3a.medium",
+                                              "t2.medium", "m5.large", "c5.large"]}
+        }
+    })]
+
+
+SCENARIOS = [
+    ("default", lambda: [dict(stage_config)]),
+    ("many_subnets", many_subnets),
+    ("split_vpc", lambda: many_subnets(240, "split")),
+    ("many_stages", many_stages),
+    ("large_user_data", large_user_data),
+    ("json_templates", lambda: [fleet.merge_config(stage_config, {"stage": "json", "template_format": "json"})]),
+]
+
+
+def user_data_size(template):
+
+    largest = 0
+    for resource in template.get("Resources", {}).values():
+        for user_data in find_user_data(resource):
+            size = 0
+            for part in user_data.get("Fn::Base64", {}).get("Fn::Join", ["", []])[1]:
+                size += len(part) if isinstance(part, str) else REFERENCE_SIZE
+            largest = max(largest, size)
+
+    return largest
+
+
+def find_user_data(value):
+
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == "UserData":
+                yield item
+            else:
+                yield from find_user_data(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from find_user_data(item)
+
+
+def measure_job(job):
+
+    stage, stack_name, stack, create_method = job
+
+    # Generators build one template each, the timed builds use copies made before the first one
+    timed_stacks = [copy.deepcopy(stack) for _ in range(TIMING_RUNS)]
+
+    # Garbage left by the previous jobs would be collected at a different point of each run and blur the peak
+    gc.collect()
+    tracemalloc.start()
+    template_path = getattr(stack, create_method)()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # Build time is the best of a few builds without tracemalloc, which slows every allocation down
+    seconds = None
+    for timed_stack in timed_stacks:
+        start = time.perf_counter()
+        getattr(timed_stack, create_method)()
+        seconds = min(time.perf_counter() - start, seconds or float("inf"))
+
+    measures = {"seconds": round(seconds, 4), "peak_memory": peak_memory, "size": 0}
+
+    # A split template is measured by its largest part, yaml and json templates alike.
+    # Only the cloudformation templates have resources, e.g. the Packer template of the WordPress image does not
+    for path in [template_path] + stack_splitter.part_paths(template_path):
+        measures["size"] = max(measures["size"], os.path.getsize(path))
+        template = export_index.load_template(path)
+        if "Resources" in template:
+            measures["resources"] = max(measures.get("resources", 0), len(template.get("Resources", {})))
+            measures["outputs"] = max(measures.get("outputs", 0), len(template.get("Outputs", {})))
+            measures["user_data"] = max(measures.get("user_data", 0), user_data_size(template))
+
+    return measures
+
+
+def run_scenario(scenario_name, build_configs, output_dir):
+
+    stage_configs = build_configs()
+    for config in stage_configs:
+        config["output_dir"] = os.path.join(output_dir, scenario_name, config["stage"])
+        os.makedirs(config["output_dir"], exist_ok=True)
+
+    # Stages of a scenario are folded into the worst value of each stack
+    results = {}
+    for job in stack_generator.create_jobs(stage_configs):
+        measures = measure_job(job)
+        key = "{}/{}".format(scenario_name, job[1])
+        if key in results:
+            measures = dict((name, max(value, results[key][name])) for name, value in measures.items())
+        results[key] = measures
+
+    return results
+
+
+def check_limits(key, measures):
+
+    limits = [("size", TEMPLATE_SIZE_LIMIT, "template size"), ("resources", RESOURCES_LIMIT, "resources"),
+              ("outputs", OUTPUTS_LIMIT, "outputs"), ("user_data", USER_DATA_LIMIT, "UserData size")]
+
+    return ["{}: {} {} over the limit of {}".format(key, description, measures[name], limit)
+            for name, limit, description in limits if measures.get(name, 0) > limit]
+
+
+def check_regressions(key, measures, baseline):
+
+    if key not in baseline:
+        return []
+
+    failures = []
+    for name, tolerance in sorted(TOLERANCES.items()):
+        if name not in measures or name not in baseline[key]:
+            continue
+
+        allowed = max(baseline[key][name] * (1 + tolerance), baseline[key][name] + FLOORS.get(name, 0))
+        if measures[name] > allowed:
+            failures.append("{}: {} went from {} to {} (tolerance {:.0%})".format(
+                key, name, format_measure(name, baseline[key][name]), format_measure(name, measures[name]), tolerance))
+
+    return failures
+
+
+def format_measure(name, value):
+
+    if value is None:
+        return "-"
+    if name == "seconds":
+        return "{:.3f}".format(value)
+    if name == "peak_memory":
+        return "{:.1f}MB".format(value / 1024 / 1024)
+
+    return str(value)
+
+
+def print_report(results):
+
+    columns = ["seconds", "peak_memory", "size", "resources", "outputs", "user_data"]
+    print("{:<34} {:>9} {:>11} {:>9} {:>9} {:>8} {:>9}".format("STACK", "SECONDS", "PEAK MEM", "SIZE", "RESOURCES",
+                                                                "OUTPUTS", "USERDATA"))
+    for key, measures in results.items():
+        print("{:<34} {:>9} {:>11} {:>9} {:>9} {:>8} {:>9}".format(
+            key, *[format_measure(name, measures.get(name)) for name in columns]))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark the stack generators against CloudFormation limits "
+                                                 "and a stored baseline")
+    parser.add_argument("--scenarios", nargs="+", choices=[name for name, _ in SCENARIOS],
+                        default=[name for name, _ in SCENARIOS], help="scenarios to run")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file to compare with")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="store the measures of this run as the baseline instead of comparing")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for scenario_name, build_configs in SCENARIOS:
+            if scenario_name in args.scenarios:
+                results.update(run_scenario(scenario_name, build_configs, output_dir))
+
+    print_report(results)
+
+    failures = []
+    for key, measures in results.items():
+        failures += check_limits(key, measures)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.isfile(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Baseline written to {}".format(args.baseline))
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key, measures in results.items():
+            failures += check_regressions(key, measures, baseline)
+    else:
+        print("No baseline at {}, run with --update-baseline to create it".format(args.baseline))
+
+    for failure in failures:
+        print("FAIL {}".format(failure))
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
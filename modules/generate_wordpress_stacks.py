@@ -1,34 +1,37 @@
-from PrivateVPC import private_vpc
-from PeerVPC import peer_vpc
-from BastionHost import bastion_host
-from Wordpress import wordpress
+import argparse
+import os.path
+import time
+
+from Shared import cidr_planner, fleet, stack_generator, stacker_config
 
 # Top Level Variables
 stage = "prod"
+region = "us-east-1"
+# Regions the whole footprint is also generated into, as stages named <stage><region> (e.g: prodeuwest1) with their
+# own output folder and stacker config. Entries are a region name or a dict overriding stage variables. AMIs and
+# key pairs are regional, e.g: [{"region": "eu-west-1", "wordpress": {"write_instance_image_id": "ami-...",
+# "read_instance_image_id": "ami-..."}, "bastion_host": {"instance_ami": "ami-..."}}]
+additional_regions = []
 
 # Production VPC
 private_vpc_name = "PrivateVPC"
 private_cidr_block = "172.16.0.0/22"
 private_vpc_endpoint_s3 = True
-private_vpc_subnets = [
-    {"name":"public_subnet_a", "type":"public", "cidr_block":"172.16.0.0/24", "availability_zone":"us-east-1a", "map_ip_on_launch":"true", "nat_gateway":"false"},
-    {"name":"public_subnet_b", "type":"public", "cidr_block":"172.16.1.0/24", "availability_zone":"us-east-1b", "map_ip_on_launch":"true", "nat_gateway":"false"},
-    {"name":"private_subnet_a", "type":"private", "cidr_block":"172.16.2.0/24", "availability_zone":"us-east-1a", "map_ip_on_launch":"false", "nat_gateway":"false"},
-    {"name":"private_subnet_b", "type":"private", "cidr_block":"172.16.3.0/24", "availability_zone":"us-east-1b", "map_ip_on_launch":"false", "nat_gateway":"false"}
-]
-production_vpc = private_vpc.PrivateVPC(stage, private_vpc_name,private_cidr_block,private_vpc_endpoint_s3,private_vpc_subnets)
-production_vpc.create_vpc()
+private_vpc_availability_zones = 2
+private_vpc_subnet_tiers = ["public", "private"]
+# None carves one subnet per tier and availability zone out of private_cidr_block (public a/b, then private a/b)
+# over the first zones Fn::GetAZs returns in the region, or a hand written list, e.g: [{"name":"public_subnet_a",
+# "type":"public", "cidr_block":"172.16.0.0/24", "availability_zone":"us-east-1a", "map_ip_on_launch":"true",
+# "nat_gateway":"false"}, ...]. availability_zone is a zone name or its position in the region (0 for the first)
+private_vpc_subnets = None
 
 # Bastion VPC
 bastion_vpc_name = "BastionVPC"
 bastion_cidr_block = "10.10.0.0/26"
 bastion_vpc_endpoint_s3 = False
-bastion_vpc_subnets = [
-    {"name":"public_subnet_a", "type":"public", "cidr_block":"10.10.0.0/27", "availability_zone":"us-east-1a", "map_ip_on_launch":"true", "nat_gateway":"false"},
-    {"name":"public_subnet_b", "type":"public", "cidr_block":"10.10.0.32/27", "availability_zone":"us-east-1b", "map_ip_on_launch":"true", "nat_gateway":"false"}
-]   
-bastion_vpc = private_vpc.PrivateVPC(stage,bastion_vpc_name,bastion_cidr_block,bastion_vpc_endpoint_s3,bastion_vpc_subnets)
-bastion_vpc.create_vpc()
+bastion_vpc_availability_zones = 2
+bastion_vpc_subnet_tiers = ["public"]
+bastion_vpc_subnets = None # carved out of bastion_cidr_block like private_vpc_subnets
 
 # Bastion Host
 key_name = "<INSERT KEY NAME HERE>"
@@ -36,13 +39,6 @@ security_group_name = "bastion-host-sg"
 instance_name = "BastionHost"
 instance_type = "t2.micro"
 instance_ami = "<INSERT LINUX AMI HERE>"
-bastion_host = bastion_host.BastionHost(stage, key_name, security_group_name, instance_name, instance_type, 
-                                        instance_ami, bastion_vpc_name, bastion_vpc_subnets)
-bastion_host.create_bastion_host()
-
-# Peer Private and Bastion VPCs
-vpc_peering = peer_vpc.PeerVPC(stage,private_vpc_name, private_cidr_block, bastion_vpc_name, bastion_cidr_block)
-vpc_peering.create_peering()
 
 ## wordpress stack
 # rds parameters
@@ -55,21 +51,248 @@ database_password = "password"
 database_port = 3306
 database_multiaz = False
 database_name_tag = "MySQLInstance"
+database_read_replicas = 0 # read instances send their SELECT queries to the replicas
+database_engine_mode = "rds" # rds, aurora or aurora-serverless-v2 (Aurora MySQL, database_engine is not used)
+aurora = {
+    "engine_version": "8.0.mysql_aurora.3.04.0",
+    "min_capacity": 0.5, # Serverless v2 ACUs
+    "max_capacity": 4
+}
+database_storage = {
+    "allocated_storage": 20, # GiB
+    "max_allocated_storage": None, # storage autoscaling limit in GiB, None disables it
+    "storage_type": "gp3", # gp2, gp3 or io1
+    "iops": None, # required by io1, gp3 includes 3000 (more from 400 GiB)
+    "storage_throughput": None # gp3 MiB/s, from 400 GiB
+}
+database_monitoring = {
+    "performance_insights": False, # not available on the micro and small instance classes
+    "performance_insights_retention": 7, # days
+    "enhanced_monitoring_interval": 0 # seconds (1, 5, 10, 15, 30 or 60), 0 disables Enhanced Monitoring
+}
+# database parameters overrides, e.g: {"connection_memory": 16}. The parameter group is sized from the memory of
+# database_instance_class and the storage IOPS (see Wordpress/database_profile.py for the defaults)
+database_tuning = None
+database_proxy = None # RDS Proxy in front of the database. e.g: {"max_connections_percent": 90, "idle_client_timeout": 1800}
 
 # write instance
 write_instance_image_id = "<INSERT LINUX AMI HERE>"
 write_instance_type = "t2.micro"
 write_instance_key_name = "<INSERT KEY NAME HERE>"
 
+# baked AMI. Instances boot from it and only run the stage specific steps, None installs everything at boot.
+# Build it from the generated packer_wordpress_ami.json (see wordpress_image below) and paste the AMI ID here
+baked_ami_id = None
+
+# web server profile overrides, e.g: {"php_process_memory": 96}. PHP-FPM, OPcache and Apache are sized from the
+# vCPUs and memory of write_instance_type and read_instance_type (see Wordpress/web_profile.py for the defaults)
+web_tuning = None
+
 # read instances
 read_instance_image_id = "<INSERT LINUX AMI HERE>"
 read_instance_type = "t2.micro"
 read_instance_key_name = "<INSERT KEY NAME HERE>"
+read_scaling = {
+    "min_size": 1,
+    "max_size": 3,
+    "target_requests_per_instance": 500, # load balancer requests per read instance, None disables the policy
+    "target_cpu_utilization": 60, # average CPU of the read instances, None disables the policy
+    "instance_warmup": 300,
+    "scheduled_actions": [], # e.g: [{"name": "morning_peak", "recurrence": "0 7 * * MON-FRI", "min_size": 2, "max_size": 6}]
+    "cpu_alarm_threshold": 85,
+    "alarm_topic_arn": None # SNS topic notified by the read instances alarms
+}
+read_fleet = {
+    "instance_types": [], # Spot pools the read instances are launched from, e.g: ["t3.small", "t3a.small", "t2.small"]
+    "on_demand_base_capacity": 0,
+    "on_demand_percentage_above_base_capacity": 0, # the rest runs on Spot
+    "spot_allocation_strategy": "capacity-optimized", # capacity-optimized or lowest-price
+    "spot_max_price": None # None caps Spot at the on demand price
+}
+content_storage = "s3" # s3: wp-content is copied to every instance through the buckets, efs: shared EFS filesystem
+efs = {
+    "performance_mode": "generalPurpose",
+    "throughput_mode": "bursting", # bursting or provisioned
+    "provisioned_throughput": None # MiB/s, required by the provisioned throughput mode
+}
+load_balancer = {
+    "health_check_path": "/healthy.html", # written by the UserData, served by httpd on the traffic port
+    "health_check_interval": 10,
+    "healthy_threshold": 2,
+    "unhealthy_threshold": 3,
+    "slow_start": 0, # seconds, cannot be combined with least_outstanding_requests
+    "deregistration_delay": 30,
+    "idle_timeout": 60,
+    "least_outstanding_requests": True,
+    "stickiness": None, # load balancer cookie duration in seconds, None disables it
+    "certificate_arn": None # ACM certificate of the HTTPS (HTTP/2) listener, None keeps HTTP only
+}
+# Route 53 latency record of every region under one name, pointing at the load balancer of the region.
+# e.g: {"hosted_zone_name": "example.com.", "record_name": "blog.example.com."}
+latency_routing = None
+site_cdn = None # full site Cloudfront in front of the load balancer. e.g: {"static_ttl": 604800, "page_ttl": 300}
+content_sync = "cron" # cron: read instances sync the buckets every minute, events: they only pull the changed files
+
+# object cache (ElastiCache) used by the write and read instances. None disables it, missing keys default to
+# {"engine": "redis", "node_type": "cache.t2.micro", "num_nodes": 1} - engine can be redis or memcached (one node only)
+object_cache = None
+
+# Packer template of the baked WordPress AMI. None skips it
+wordpress_image = {
+    "source_ami": "<INSERT LINUX AMI HERE>",
+    "instance_type": "t2.micro" # built in the region of the stage
+}
+
+# Size at which a template is split into several stacks, e.g: {"max_resources": 300}. Defaults to
+# {"max_resources": 400, "max_outputs": 160, "max_template_size": 819200}, under the CloudFormation limits
+stack_limits = None
+
+# yaml or json. json templates are written compact, smaller against the CloudFormation size limit
+template_format = "yaml"
+
+# Exports the stacks may import from stacks deployed outside of the generated stacker config. Any other import
+# without an exporter in the stage stops the generation before the stacker config is written
+external_exports = []
+
+# VPC blocks of every stage sharing the pool cannot overlap, so any of them can be routed to each other.
+# A VPC block given as a size only (e.g: private_cidr_block = "/22") is allocated from the pool. e.g: "10.0.0.0/8"
+cidr_pool = None
+
+# peering: the private and bastion VPCs of the stage are peered. transit_gateway: they are attached to the transit
+# gateway of hub_stage in the region of the stage instead, and reach every VPC of the cidr_pool through it.
+# The hub stage generates the transit gateway and needs the same cidr_pool
+connectivity = "peering"
+transit_gateway = {
+    "hub_stage": stage,
+    "amazon_side_asn": 64512
+}
+
+# Namespace of the generated stacker config. Stages generated together that share it get the stage appended
+stacker_namespace = "custom-wordpress"
+
+# Stage configuration consumed by the stack generator
+
+stage_config = {
+    "stage": stage,
+    "region": region,
+    "additional_regions": additional_regions,
+    "output_dir": "modules",
+    "private_vpc": {
+        "vpc_name": private_vpc_name,
+        "vpc_cidr_block": private_cidr_block,
+        "vpc_endpoint_s3": private_vpc_endpoint_s3,
+        "availability_zones": private_vpc_availability_zones,
+        "subnet_tiers": private_vpc_subnet_tiers,
+        "subnets": private_vpc_subnets
+    },
+    "bastion_vpc": {
+        "vpc_name": bastion_vpc_name,
+        "vpc_cidr_block": bastion_cidr_block,
+        "vpc_endpoint_s3": bastion_vpc_endpoint_s3,
+        "availability_zones": bastion_vpc_availability_zones,
+        "subnet_tiers": bastion_vpc_subnet_tiers,
+        "subnets": bastion_vpc_subnets
+    },
+    "bastion_host": {
+        "key_name": key_name,
+        "security_group_name": security_group_name,
+        "instance_name": instance_name,
+        "instance_type": instance_type,
+        "instance_ami": instance_ami
+    },
+    "wordpress": {
+        "database_name": database_name,
+        "database_instance_class": database_instance_class,
+        "database_engine": database_engine,
+        "database_engine_version": database_engine_version,
+        "database_username": database_username,
+        "database_password": database_password,
+        "database_port": database_port,
+        "database_multiaz": database_multiaz,
+        "database_name_tag": database_name_tag,
+        "database_read_replicas": database_read_replicas,
+        "database_engine_mode": database_engine_mode,
+        "aurora": aurora,
+        "database_proxy": database_proxy,
+        "database_storage": database_storage,
+        "database_monitoring": database_monitoring,
+        "database_tuning": database_tuning,
+        "write_instance_image_id": write_instance_image_id,
+        "write_instance_type": write_instance_type,
+        "write_instance_key_name": write_instance_key_name,
+        "read_instance_image_id": read_instance_image_id,
+        "read_instance_type": read_instance_type,
+        "read_instance_key_name": read_instance_key_name,
+        "baked_ami_id": baked_ami_id,
+        "read_fleet": read_fleet,
+        "web_tuning": web_tuning,
+        "read_scaling": read_scaling,
+        "content_sync": content_sync,
+        "content_storage": content_storage,
+        "efs": efs,
+        "site_cdn": site_cdn,
+        "latency_routing": latency_routing,
+        "load_balancer": load_balancer,
+        "object_cache": object_cache
+    },
+    "wordpress_image": wordpress_image,
+    "stack_limits": stack_limits,
+    "template_format": template_format,
+    "external_exports": external_exports,
+    "cidr_pool": cidr_pool,
+    "connectivity": connectivity,
+    "transit_gateway": transit_gateway,
+    "stacker_namespace": stacker_namespace
+}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Generate the cloudformation stacks of the wordpress environment")
+    parser.add_argument("--stages", nargs="+", default=[stage],
+                        help="stages to generate. With more than one stage each gets its own output folder")
+    parser.add_argument("--fleet",
+                        help="yaml or json file listing the stages to generate, see Shared/fleet.py")
+    parser.add_argument("--output-dir", default=stage_config["output_dir"],
+                        help="folder the cloudformation templates are written to")
+    parser.add_argument("--stacker-config-dir", default=None,
+                        help="folder the stacker config is written to. Defaults to the folder of the templates, use "
+                             "stacker/config to update the config of this repo")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes used to generate the stacks. Defaults to the number of CPUs")
+    parser.add_argument("--force", action="store_true",
+                        help="rebuild every stack even when its inputs did not change")
+    args = parser.parse_args()
+
+    if args.fleet:
+        stage_configs = fleet.load_fleet(args.fleet, dict(stage_config, output_dir=args.output_dir))
+    else:
+        stage_configs = []
+        for stage_name in args.stages:
+            output_dir = args.output_dir
+            if len(args.stages) > 1:
+                output_dir = os.path.join(args.output_dir, stage_name)
+
+            stage_configs.append(dict(stage_config, stage=stage_name, output_dir=output_dir))
+
+    stage_configs = fleet.expand_regions(stage_configs)
+    stage_configs = cidr_planner.allocate_vpc_blocks(stage_configs)
+    stage_configs = fleet.assign_transit_gateway_hubs(stage_configs)
+
+    for config in stage_configs:
+        os.makedirs(config["output_dir"], exist_ok=True)
+
+    start = time.perf_counter()
+    results = stack_generator.generate_stacks(stage_configs, args.workers, args.force)
+    stack_generator.print_timing_report(results, time.perf_counter() - start)
+
+    # The stacker config is derived from the templates on disk, so it also covers the stacks that were not rebuilt
+    # The folder holding every output folder, the output dir itself for a single stage
+    stacker_config_dir = args.stacker_config_dir \
+        or os.path.relpath(os.path.commonpath([os.path.abspath(config["output_dir"]) for config in stage_configs]))
+    os.makedirs(stacker_config_dir, exist_ok=True)
+    stacker_config.print_deploy_plan(stacker_config.write_stacker_configs(stage_configs, results, stacker_config_dir))
+
 
-wordpress = wordpress.WordPress(stage, database_name, database_instance_class, database_engine, 
-                                database_engine_version, database_username, database_password, database_port,
-                                database_multiaz, database_name_tag,
-                                write_instance_image_id, write_instance_type, write_instance_key_name,
-                                read_instance_image_id, read_instance_type, read_instance_key_name,
-                                private_vpc_name, private_vpc_subnets)
-wordpress.create_wordpress_environment()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
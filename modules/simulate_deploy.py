@@ -0,0 +1,206 @@
+import argparse
+import os.path
+
+import yaml
+
+from Shared import export_index, stack_splitter, stacker_config
+
+# Offline simulation of a stacker build. The stacks and their requires are read from the stacker config, the
+# resources from the templates it points to. Resources are created as soon as what they reference (Ref,
+# Fn::GetAtt, Fn::Sub, DependsOn) exists, and take the typical provisioning time of their type
+# (stacker_config.PROVISIONING_SECONDS).
+#
+#   python simulate_deploy.py
+#   python simulate_deploy.py --config ../stacker/config/config_dev.yaml
+#
+# Two schedules are compared:
+#   stacker:  a stack starts once every stack it requires is complete, as stacker deploys them
+#   resource: a resource starts once the resources behind the exports it imports exist, the lower bound a
+#             different split of the stacks could reach
+
+# Time CloudFormation takes to start a stack and to mark it complete once its last resource exists
+
+STACK_OVERHEAD_SECONDS = 15
+
+
+def load_stacks(config_path):
+
+    with open(config_path) as f:
+        config = yaml.safe_load(f)
+
+    stacks = []
+    for entry in config["stacks"]:
+        template_path = os.path.join(os.path.dirname(os.path.abspath(config_path)), entry["template_path"])
+        template = export_index.load_template(template_path)
+
+        stacks.append({
+            "name": entry["name"],
+            "requires": entry.get("requires", []),
+            "resources": template.get("Resources", {}),
+            "outputs": template.get("Outputs", {})
+        })
+
+    return stacks
+
+
+def resource_graph(stacks):
+
+    # Every resource is keyed by (stack, logical ID). Dependencies inside a stack come from the template,
+    # imports are resolved to the resources behind the matching export
+    exported_by = {}
+    for stack in stacks:
+        for output in stack["outputs"].values():
+            export_name = output.get("Export", {}).get("Name")
+            if isinstance(export_name, str):
+                exported_by[export_name] = [(stack["name"], logical_id) for logical_id
+                                            in stack_splitter.references(output["Value"]) & set(stack["resources"])]
+
+    resources = {}
+    for stack in stacks:
+        for logical_id in stack_splitter.deploy_order(stack["resources"]):
+            resource = stack["resources"][logical_id]
+            dependencies = set((stack["name"], dependency) for dependency
+                               in stack_splitter.references(resource) & set(stack["resources"]))
+            imported = set()
+            for export_name in export_index.imports_of(resource):
+                imported.update(exported_by.get(export_name, []))
+
+            resources[(stack["name"], logical_id)] = {
+                "type": resource["Type"],
+                "seconds": stacker_config.PROVISIONING_SECONDS.get(resource["Type"],
+                                                                   stacker_config.DEFAULT_PROVISIONING_SECONDS),
+                "dependencies": dependencies,
+                "imports": imported
+            }
+
+    return resources
+
+
+def schedule(stacks, resources, stack_gating):
+
+    # Unbounded parallelism: every resource starts at the time its last dependency is done. Each start records
+    # what it waited for, so the critical path can be walked back from the last resource
+    start = {}
+    finish = {}
+    waited_for = {}
+    stack_start = {}
+    stack_finish = {}
+
+    for stack in stacks:
+        if stack_gating:
+            ready = max([stack_finish[required] for required in stack["requires"]] or [0])
+            stack_start[stack["name"]] = ready
+            gate = (ready + STACK_OVERHEAD_SECONDS,
+                    ("stack", max(stack["requires"], key=stack_finish.get)) if stack["requires"] else None)
+        else:
+            gate = (STACK_OVERHEAD_SECONDS, None)
+
+        for key, resource in resources.items():
+            if key[0] != stack["name"]:
+                continue
+
+            begin, reason = gate
+            for dependency in resource["dependencies"] | (set() if stack_gating else resource["imports"]):
+                if finish[dependency] > begin:
+                    begin, reason = finish[dependency], ("resource", dependency)
+
+            start[key], finish[key], waited_for[key] = begin, begin + resource["seconds"], reason
+
+        stack_finishes = [finish[key] for key in resources if key[0] == stack["name"]]
+        if not stack_gating:
+            stack_start[stack["name"]] = min([start[key] for key in resources if key[0] == stack["name"]]
+                                             or [0]) - STACK_OVERHEAD_SECONDS
+        stack_finish[stack["name"]] = max(stack_finishes or [stack_start[stack["name"]]]) + STACK_OVERHEAD_SECONDS
+
+    return {"start": start, "finish": finish, "waited_for": waited_for, "stack_start": stack_start,
+            "stack_finish": stack_finish, "total": max(stack_finish.values() or [0])}
+
+
+def critical_path(resources, plan):
+
+    last_stack = max(plan["stack_finish"], key=plan["stack_finish"].get)
+    candidates = [key for key in resources if key[0] == last_stack]
+    if not candidates:
+        return []
+
+    path = [max(candidates, key=plan["finish"].get)]
+    while plan["waited_for"][path[0]] is not None:
+        kind, target = plan["waited_for"][path[0]]
+        if kind == "stack":
+            # Waiting on a required stack means waiting on its last resource
+            stack_resources = [key for key in resources if key[0] == target]
+            if not stack_resources:
+                break
+            target = max(stack_resources, key=plan["finish"].get)
+        path.insert(0, target)
+
+    return path
+
+
+def concurrency(resources, plan):
+
+    # Peak and average number of resources being created, and the time where at most one is
+    events = sorted([(plan["start"][key], 1) for key in resources] + [(plan["finish"][key], -1) for key in resources])
+
+    running = peak = 0
+    serial_seconds = 0
+    previous_time = 0
+    for time, change in events:
+        if running <= 1:
+            serial_seconds += time - previous_time
+        running += change
+        peak = max(peak, running)
+        previous_time = time
+    serial_seconds += plan["total"] - previous_time
+
+    busy_seconds = sum(resource["seconds"] for resource in resources.values())
+
+    return peak, busy_seconds / plan["total"] if plan["total"] else 0, serial_seconds
+
+
+def print_report(stacks, resources, plans):
+
+    stacker_plan, resource_plan = plans["stacker"], plans["resource"]
+
+    print("{:<26} {:>9} {:>9} {:>9} {:>12}".format("STACK", "START", "END", "MINUTES", "GATING MIN"))
+    for stack in stacks:
+        name = stack["name"]
+        # Time the stack waits on its required stacks while its resources could already be created
+        gating = stacker_plan["stack_start"][name] - resource_plan["stack_start"][name]
+        print("{:<26} {:>9.1f} {:>9.1f} {:>9.1f} {:>12.1f}".format(
+            name, stacker_plan["stack_start"][name] / 60, stacker_plan["stack_finish"][name] / 60,
+            (stacker_plan["stack_finish"][name] - stacker_plan["stack_start"][name]) / 60, max(0, gating) / 60))
+
+    print("")
+    print("Critical path ({:.1f} minutes):".format(stacker_plan["total"] / 60))
+    for key in critical_path(resources, stacker_plan):
+        print("  {:>7.1f} {:>7.1f}  {:<26} {:<44} {}".format(
+            stacker_plan["start"][key] / 60, stacker_plan["finish"][key] / 60, key[0], key[1], resources[key]["type"]))
+
+    print("")
+    for name, plan in [("stacker", stacker_plan), ("resource", resource_plan)]:
+        peak, average, serial_seconds = concurrency(resources, plan)
+        print("{:<9} schedule: {:>6.1f} minutes, peak {} resources in flight, average {:.1f}, "
+              "{:.1f} minutes with at most one".format(name, plan["total"] / 60, peak, average, serial_seconds / 60))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Simulate the deploy of the generated stacks and report the "
+                                                 "critical path")
+    parser.add_argument("--config", default=os.path.join(stacker_config.STACKER_CONFIG_DIR, "config.yaml"),
+                        help="stacker config written by generate_wordpress_stacks.py")
+    args = parser.parse_args()
+
+    stacks = load_stacks(args.config)
+    resources = resource_graph(stacks)
+    plans = {
+        "stacker": schedule(stacks, resources, stack_gating=True),
+        "resource": schedule(stacks, resources, stack_gating=False)
+    }
+
+    print_report(stacks, resources, plans)
+
+
+if __name__ == "__main__":
+    main()
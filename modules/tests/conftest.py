@@ -0,0 +1,9 @@
+import os.path
+import sys
+
+# The generator packages (Shared, Wordpress, ...) are imported from the modules folder, like the scripts do
+
+MODULES_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if MODULES_DIR not in sys.path:
+    sys.path.insert(0, MODULES_DIR)
@@ -0,0 +1,21 @@
+import benchmark_stacks
+from generate_wordpress_stacks import stage_config
+from Shared import fleet, stack_generator
+
+
+def test_json_templates_are_checked_against_the_limits(tmp_path):
+
+    config = fleet.merge_config(stage_config, {"template_format": "json", "output_dir": str(tmp_path)})
+    measures = dict((job[1], benchmark_stacks.measure_job(job)) for job in stack_generator.create_jobs([config]))
+
+    assert measures["Wordpress"]["resources"] > 0
+    assert measures["Wordpress"]["user_data"] > 0
+    assert "resources" not in measures["WordpressImage"]
+
+
+def test_build_time_only_fails_past_the_tolerance_and_the_floor():
+
+    baseline = {"default/Wordpress": {"seconds": 0.01}}
+
+    assert benchmark_stacks.check_regressions("default/Wordpress", {"seconds": 0.025}, baseline) == []
+    assert benchmark_stacks.check_regressions("default/Wordpress", {"seconds": 0.04}, baseline) != []
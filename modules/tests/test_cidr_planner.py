@@ -0,0 +1,41 @@
+import pytest
+
+from generate_wordpress_stacks import stage_config
+from Shared import cidr_planner, environment, export_index, fleet, stack_generator
+
+
+def test_carved_subnets_keep_the_position_of_their_zone():
+
+    subnets = cidr_planner.carve_subnets("172.16.0.0/22", 3, ["public"])
+
+    assert [subnet["availability_zone"] for subnet in subnets] == [0, 1, 2]
+    assert [subnet["name"] for subnet in subnets] == ["public_subnet_a", "public_subnet_b", "public_subnet_c"]
+
+
+def test_carved_subnets_select_their_zone_in_the_region_of_the_stack(tmp_path):
+
+    config = fleet.merge_config(stage_config, {"region": "ap-northeast-1", "output_dir": str(tmp_path),
+                                               "private_vpc": {"availability_zones": 3}})
+    stack = stack_generator.private_vpc_stack(config, environment.from_config(config))
+    resources = export_index.load_template(stack.create_vpc())["Resources"]
+
+    zones = [resource["Properties"]["AvailabilityZone"] for resource in resources.values()
+             if resource["Type"] == "AWS::EC2::Subnet"]
+    assert zones[:3] == [{"Fn::Select": [index, {"Fn::GetAZs": ""}]} for index in range(3)]
+    assert "ap-northeast-1b" not in open(stack.template_path).read()
+
+
+def test_additional_regions_need_their_own_named_zones():
+
+    subnets = [{"name": "public_subnet_a", "type": "public", "cidr_block": "172.16.0.0/24",
+                "availability_zone": "us-east-1a"}]
+    config = fleet.merge_config(stage_config, {"additional_regions": ["eu-west-1"],
+                                               "private_vpc": {"subnets": subnets}})
+
+    with pytest.raises(ValueError, match="eu-west-1 needs its own private_vpc subnets"):
+        fleet.expand_regions([config])
+
+    subnets[0]["availability_zone"] = 0
+    config = fleet.merge_config(stage_config, {"additional_regions": ["eu-west-1"],
+                                               "private_vpc": {"subnets": subnets}})
+    assert len(fleet.expand_regions([config])) == 2
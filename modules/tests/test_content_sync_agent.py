@@ -0,0 +1,42 @@
+from Wordpress import content_sync_agent
+
+CONFIG = {"region": "us-east-1", "topic_arn": "arn:aws:sns:us-east-1:123456789012:prod-wordpress-content-changes",
+          "queue_prefix": "prod-wordpress-content-sync"}
+
+QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/123456789012/prod-wordpress-content-sync-{}"
+QUEUE_ARN = "arn:aws:sqs:us-east-1:123456789012:prod-wordpress-content-sync-{}"
+
+
+def fake_aws(live_instance_ids, calls):
+
+    def aws(config, *args):
+        calls.append(args)
+        if args[:2] == ("sqs", "list-queues"):
+            return {"QueueUrls": [QUEUE_URL.format("i-live"), QUEUE_URL.format("i-gone")]}
+        if args[:2] == ("sns", "list-subscriptions-by-topic"):
+            return {"Subscriptions": [
+                {"Endpoint": QUEUE_ARN.format("i-live"), "SubscriptionArn": CONFIG["topic_arn"] + ":live"},
+                {"Endpoint": QUEUE_ARN.format("i-gone"), "SubscriptionArn": CONFIG["topic_arn"] + ":gone"},
+                {"Endpoint": QUEUE_ARN.format("i-crashed"), "SubscriptionArn": CONFIG["topic_arn"] + ":crashed"},
+                {"Endpoint": "arn:aws:sqs:us-east-1:123456789012:other-queue", "SubscriptionArn": "arn:other"}
+            ]}
+        if args[:2] == ("ec2", "describe-instances"):
+            return live_instance_ids
+        return {}
+
+    return aws
+
+
+def test_sweep_removes_the_queues_of_instances_that_are_gone(monkeypatch):
+
+    calls = []
+    monkeypatch.setattr(content_sync_agent, "aws", fake_aws(["i-live"], calls))
+
+    content_sync_agent.sweep(CONFIG)
+
+    removed = set(args for args in calls if args[1] in ("unsubscribe", "delete-queue"))
+    assert removed == {
+        ("sns", "unsubscribe", "--subscription-arn", CONFIG["topic_arn"] + ":gone"),
+        ("sns", "unsubscribe", "--subscription-arn", CONFIG["topic_arn"] + ":crashed"),
+        ("sqs", "delete-queue", "--queue-url", QUEUE_URL.format("i-gone"))
+    }
@@ -0,0 +1,47 @@
+import pytest
+
+from Wordpress import database_profile
+
+
+def test_parameter_group_family_follows_the_engine_version():
+
+    assert database_profile.parameter_group_family("MySQL", "5.7.23") == "mysql5.7"
+    assert database_profile.parameter_group_family("aurora-mysql", "8.0.mysql_aurora.3.04.0") == "aurora-mysql8.0"
+
+
+def test_small_instances_keep_half_of_their_memory_out_of_the_buffer_pool():
+
+    parameters = database_profile.database_parameters("db.t2.micro", "mysql5.7", 3000, False)
+
+    assert parameters["innodb_buffer_pool_size"] == str(512 * 1024 * 1024)
+    assert parameters["max_connections"] == "50"
+    assert parameters["query_cache_type"] == "0"
+    assert parameters["innodb_io_capacity"] == "1500"
+    assert parameters["innodb_io_capacity_max"] == "3000"
+    assert parameters["performance_schema"] == "0"
+
+
+def test_large_instances_give_three_quarters_of_their_memory_to_the_buffer_pool():
+
+    parameters = database_profile.database_parameters("db.r5.large", "mysql8.0", None, True, {"connection_memory": 4})
+
+    assert parameters["innodb_buffer_pool_size"] == str(12288 * 1024 * 1024)
+    assert parameters["max_connections"] == "960"
+    assert parameters["tmp_table_size"] == str(64 * 1024 * 1024)
+    assert "query_cache_type" not in parameters
+    assert "innodb_io_capacity" not in parameters
+    assert parameters["performance_schema"] == "1"
+
+
+def test_serverless_instances_are_not_sized():
+
+    parameters = database_profile.database_parameters("db.serverless", "aurora-mysql8.0", None, False)
+
+    assert "innodb_buffer_pool_size" not in parameters
+    assert "max_connections" not in parameters
+
+
+def test_unknown_instance_class_is_rejected():
+
+    with pytest.raises(ValueError, match="add it to DB_INSTANCE_MEMORY"):
+        database_profile.database_parameters("db.x9.huge", "mysql5.7", None, False)
@@ -0,0 +1,25 @@
+import dataclasses
+
+import pytest
+
+from generate_wordpress_stacks import stage_config
+from Shared import environment
+
+
+def test_wordpress_variables_are_split_into_the_database_and_the_site():
+
+    stage_environment = environment.from_config(stage_config)
+
+    assert stage_environment.database.engine == stage_config["wordpress"]["database_engine"]
+    assert stage_environment.database.port == stage_config["wordpress"]["database_port"]
+    assert stage_environment.site.write_instance_type == stage_config["wordpress"]["write_instance_type"]
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        stage_environment.database.port = 3307
+
+
+def test_unknown_wordpress_variables_are_rejected():
+
+    with pytest.raises(TypeError, match="colour"):
+        environment.database_from_config(dict(stage_config["wordpress"], database_colour="blue"))
+    with pytest.raises(TypeError, match="colour"):
+        environment.site_from_config(dict(stage_config["wordpress"], colour="blue"))
@@ -0,0 +1,69 @@
+import os.path
+import shutil
+import subprocess
+import sys
+
+from conftest import MODULES_DIR
+
+
+def generate(modules_dir, output_dir):
+
+    # Status of every stack in the timing report of generate_wordpress_stacks.py
+    output = subprocess.run([sys.executable, os.path.join(modules_dir, "generate_wordpress_stacks.py"),
+                             "--output-dir", output_dir, "--workers", "1"],
+                            check=True, capture_output=True, text=True).stdout
+
+    statuses = {}
+    for line in output.splitlines():
+        columns = line.split()
+        if len(columns) == 5 and columns[2] in ("built", "unchanged"):
+            statuses[columns[1]] = columns[2]
+
+    return statuses
+
+
+def copy_generator(tmp_path):
+
+    # The sources are edited, so the generator runs from a copy
+    modules_dir = str(tmp_path / "modules")
+    shutil.copytree(MODULES_DIR, modules_dir, ignore=shutil.ignore_patterns(
+        "__pycache__", "tests", "template_*.yaml", "template_*.json", "packer_*.json", ".stack_manifest.json"))
+
+    return modules_dir
+
+
+def test_unchanged_inputs_are_skipped(tmp_path):
+
+    modules_dir = copy_generator(tmp_path)
+    output_dir = str(tmp_path / "output")
+
+    assert set(generate(modules_dir, output_dir).values()) == {"built"}
+    assert set(generate(modules_dir, output_dir).values()) == {"unchanged"}
+
+
+def test_editing_a_shared_module_rebuilds_its_stacks(tmp_path):
+
+    modules_dir = copy_generator(tmp_path)
+    output_dir = str(tmp_path / "output")
+    generate(modules_dir, output_dir)
+
+    with open(os.path.join(modules_dir, "Shared", "template_writer.py"), 'a') as f:
+        f.write("\n# edited\n")
+
+    statuses = generate(modules_dir, output_dir)
+    assert statuses["Wordpress"] == "built"
+    assert statuses["PrivateVPC"] == "built"
+
+
+def test_editing_a_stack_package_only_rebuilds_its_stacks(tmp_path):
+
+    modules_dir = copy_generator(tmp_path)
+    output_dir = str(tmp_path / "output")
+    generate(modules_dir, output_dir)
+
+    with open(os.path.join(modules_dir, "Wordpress", "user_data.py"), 'a') as f:
+        f.write("\n# edited\n")
+
+    statuses = generate(modules_dir, output_dir)
+    assert statuses["Wordpress"] == "built"
+    assert statuses["PrivateVPC"] == "unchanged"
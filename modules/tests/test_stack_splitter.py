@@ -0,0 +1,47 @@
+import pytest
+from troposphere import Output, Ref
+from troposphere.sns import Topic
+
+from Shared import stack_splitter
+
+
+def topics_template(count):
+
+    template = stack_splitter.Template()
+    for number in range(count):
+        topic = template.add_resource(Topic("Topic{}".format(number)))
+        template.add_output(Output("Topic{}Arn".format(number), Value=Ref(topic)))
+
+    return template
+
+
+def test_parts_of_the_last_split_are_removed_once_the_new_parts_are_written(tmp_path):
+
+    template_path = str(tmp_path / "template_topics.yaml")
+    limits = {"max_resources": 2}
+
+    stack_splitter.write_template(topics_template(6), template_path, "test", limits)
+    assert len(stack_splitter.part_paths(template_path)) == 2
+
+    stack_splitter.write_template(topics_template(4), template_path, "test", limits)
+    assert [path.rsplit("/", 1)[1] for path in stack_splitter.part_paths(template_path)] == \
+        ["template_topics_part1.yaml"]
+
+    stack_splitter.write_template(topics_template(2), template_path, "test", limits)
+    assert stack_splitter.part_paths(template_path) == []
+
+
+def test_a_failed_split_leaves_the_last_split_in_place(tmp_path, monkeypatch):
+
+    template_path = str(tmp_path / "template_topics.yaml")
+    limits = {"max_resources": 2}
+
+    stack_splitter.write_template(topics_template(6), template_path, "test", limits)
+    written = dict((path, open(path).read()) for path in [template_path] + stack_splitter.part_paths(template_path))
+
+    monkeypatch.setitem(stack_splitter.CLOUDFORMATION_LIMITS, "max_template_size", 10)
+    with pytest.raises(ValueError, match="over the CloudFormation limit"):
+        stack_splitter.write_template(topics_template(4), template_path, "test", limits)
+
+    assert sorted(tmp_path.iterdir()) == sorted(tmp_path / path.rsplit("/", 1)[1] for path in written)
+    assert all(open(path).read() == content for path, content in written.items())
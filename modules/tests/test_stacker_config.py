@@ -0,0 +1,56 @@
+from generate_wordpress_stacks import stage_config
+from Shared import fleet, stack_generator, stacker_config
+
+
+def deploy_plan(tmp_path, **overrides):
+
+    stage_configs = [fleet.merge_config(stage_config, dict(overrides, output_dir=str(tmp_path)))]
+    results = stack_generator.generate_stacks(stage_configs, workers=1)
+
+    return stacker_config.write_stacker_configs(stage_configs, results, str(tmp_path))
+
+
+def test_wordpress_is_deployed_after_the_vpc_peering(tmp_path):
+
+    plan = deploy_plan(tmp_path)[0]
+
+    assert "PeerVPCs" in plan["requires"]["Wordpress"]
+    assert plan["order"].index("PeerVPCs") < plan["order"].index("Wordpress")
+    with open(str(tmp_path / "config.yaml")) as f:
+        assert "requires: [PeerVPCs, BastionHost]" in f.read()
+
+
+def test_wordpress_is_deployed_after_the_transit_gateway_attachments(tmp_path):
+
+    plan = deploy_plan(tmp_path, connectivity="transit_gateway", cidr_pool="0.0.0.0/0")[0]
+
+    assert "TransitGatewayAttachments" in plan["requires"]["Wordpress"]
+    assert plan["order"].index("TransitGatewayAttachments") < plan["order"].index("Wordpress")
+
+
+def test_split_stacks_get_the_ordering_edges_of_their_stack():
+
+    stacks = [{"name": "PeerVPCs", "base_name": "PeerVPCs"}, {"name": "Wordpress", "base_name": "Wordpress"},
+              {"name": "WordpressPart1", "base_name": "Wordpress"}]
+    requires = dict((stack["name"], set()) for stack in stacks)
+
+    requires = stacker_config.add_ordering_requires(requires, stacks)
+
+    assert requires == {"PeerVPCs": set(), "Wordpress": {"PeerVPCs"}, "WordpressPart1": {"PeerVPCs"}}
+
+
+def test_the_stacker_config_is_written_next_to_the_templates_it_deploys(tmp_path):
+
+    config_dir = tmp_path / "stacker"
+    config_dir.mkdir()
+    (tmp_path / "build").mkdir()
+    stage_configs = [fleet.merge_config(stage_config, {"output_dir": str(tmp_path / "build")})]
+    results = stack_generator.generate_stacks(stage_configs, workers=1)
+
+    plan = stacker_config.write_stacker_configs(stage_configs, results, str(config_dir))[0]
+
+    assert plan["config_path"] == str(config_dir / "config.yaml")
+    with open(plan["config_path"]) as f:
+        config = f.read()
+    assert "template_path: ../build/template_wordpress.yaml" in config
+    assert ".\\..\\" in config.splitlines()[0]
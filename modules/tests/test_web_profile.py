@@ -0,0 +1,37 @@
+import pytest
+
+from Wordpress import web_profile
+
+
+def test_php_children_are_bounded_by_the_memory_of_small_instances():
+
+    profile = web_profile.web_profile("t2.micro", 60)
+
+    assert profile["opcache_memory"] == 128
+    assert profile["php_max_children"] == 8
+    assert profile["server_limit"] == 4
+    assert profile["max_request_workers"] == 100
+
+
+def test_php_children_are_bounded_by_the_cpus_of_large_instances():
+
+    profile = web_profile.web_profile("r5.xlarge", 0)
+
+    assert profile["php_max_children"] == 32
+    assert profile["php_start_servers"] == 8
+    assert profile["opcache_memory"] == 256
+    assert profile["opcache_revalidate_freq"] == 0
+
+
+def test_tuning_overrides_the_assumptions_of_the_profile():
+
+    profile = web_profile.web_profile("r5.xlarge", 0, {"php_children_per_vcpu": 2, "keepalive_timeout": 125})
+
+    assert profile["php_max_children"] == 8
+    assert profile["keepalive_timeout"] == 125
+
+
+def test_unknown_instance_type_is_rejected():
+
+    with pytest.raises(ValueError, match="add it to INSTANCE_SIZES"):
+        web_profile.web_profile("x9.huge", 60)
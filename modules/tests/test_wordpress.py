@@ -0,0 +1,413 @@
+import pytest
+
+from generate_wordpress_stacks import stage_config
+from Shared import environment, export_index, fleet, stack_generator
+
+
+def wordpress_resources(tmp_path, overrides=None, **wordpress):
+
+    config = fleet.merge_config(stage_config, dict(overrides or {}, output_dir=str(tmp_path), wordpress=wordpress))
+    stack = stack_generator.wordpress_stack(config, environment.from_config(config))
+
+    return export_index.load_template(stack.create_wordpress_environment())["Resources"]
+
+
+def test_partial_object_cache_uses_the_defaults(tmp_path):
+
+    resources = wordpress_resources(tmp_path, object_cache={"engine": "memcached"})
+
+    cache = resources["prodObjectCache"]
+    assert cache["Type"] == "AWS::ElastiCache::CacheCluster"
+    assert cache["Properties"]["CacheNodeType"] == "cache.t2.micro"
+    assert cache["Properties"]["NumCacheNodes"] == 1
+
+
+def test_unknown_object_cache_engine_is_rejected(tmp_path):
+
+    with pytest.raises(ValueError, match="Object cache engine"):
+        wordpress_resources(tmp_path, object_cache={"engine": "valkey"})
+
+
+def test_memcached_object_cache_is_limited_to_one_node(tmp_path):
+
+    with pytest.raises(ValueError, match="Memcached object cache only supports one node"):
+        wordpress_resources(tmp_path, object_cache={"engine": "memcached", "num_nodes": 2})
+
+
+def test_enhanced_monitoring_is_off_by_default(tmp_path):
+
+    resources = wordpress_resources(tmp_path)
+
+    assert "prodRdsMonitoringRole" not in resources
+    assert "MonitoringInterval" not in resources["prodRdsInstance"]["Properties"]
+
+
+def test_enhanced_monitoring_is_turned_on_by_the_stage(tmp_path):
+
+    resources = wordpress_resources(tmp_path, database_monitoring={"enhanced_monitoring_interval": 30})
+
+    assert resources["prodRdsInstance"]["Properties"]["MonitoringInterval"] == 30
+    assert resources["prodRdsInstance"]["Properties"]["MonitoringRoleArn"] == \
+        {"Fn::GetAtt": ["prodRdsMonitoringRole", "Arn"]}
+
+
+def ssh_rule(resources):
+
+    ingress = resources["prodWebDMZSecurityGroup"]["Properties"]["SecurityGroupIngress"]
+
+    return next(rule for rule in ingress if rule["FromPort"] == "22")
+
+
+def test_ssh_is_allowed_from_the_bastion_security_group_across_peered_vpcs(tmp_path):
+
+    rule = ssh_rule(wordpress_resources(tmp_path))
+
+    assert rule["SourceSecurityGroupId"] == {"Fn::ImportValue": "prodBastionHostSecurityGroupID"}
+    assert "CidrIp" not in rule
+
+
+def test_ssh_is_allowed_from_the_bastion_vpc_across_a_transit_gateway(tmp_path):
+
+    rule = ssh_rule(wordpress_resources(tmp_path, {"connectivity": "transit_gateway", "cidr_pool": "0.0.0.0/0"}))
+
+    assert rule["CidrIp"] == stage_config["bastion_vpc"]["vpc_cidr_block"]
+    assert "SourceSecurityGroupId" not in rule
+
+
+def joined_user_data(user_data):
+
+    return "".join(part if isinstance(part, str) else "<reference>"
+                   for part in user_data["Fn::Base64"]["Fn::Join"][1])
+
+
+def read_user_data(resources):
+
+    launch_template = resources["prodWordPressReadLaunchTemplate"]
+
+    return joined_user_data(launch_template["Properties"]["LaunchTemplateData"]["UserData"])
+
+
+def write_user_data(resources):
+
+    fleet_config = resources["prodWriteWordpressEc2Instance"]["Properties"]["SpotFleetRequestConfigData"]
+
+    return joined_user_data(fleet_config["LaunchSpecifications"][0]["UserData"])
+
+
+def test_provisioned_efs_needs_a_throughput(tmp_path):
+
+    with pytest.raises(ValueError, match="provisioned_throughput"):
+        wordpress_resources(tmp_path, content_storage="efs", efs={"throughput_mode": "provisioned"})
+
+
+def test_efs_root_is_owned_by_apache_with_a_baked_image(tmp_path):
+
+    user_data = read_user_data(wordpress_resources(tmp_path, content_storage="efs", baked_ami_id="ami-12345678"))
+
+    assert user_data.index("until mount /var/www/html/wp-content") < user_data.index("chown apache:apache wp-content")
+    assert "chown -R" not in user_data
+
+
+def test_boot_permissions_leave_the_efs_content_out(tmp_path):
+
+    user_data = read_user_data(wordpress_resources(tmp_path, content_storage="efs"))
+
+    for line in user_data.splitlines():
+        if line.startswith("sudo find") or line.startswith("sudo chown"):
+            assert "-path" in line and "wp-content -prune" in line
+
+
+def test_read_replicas_are_only_used_by_the_read_nodes(tmp_path):
+
+    resources = wordpress_resources(tmp_path, database_read_replicas=2)
+
+    assert resources["prodRdsReadReplica2"]["Properties"]["SourceDBInstanceIdentifier"] == \
+        {"Ref": "prodRdsInstance"}
+    assert read_user_data(resources).count("'write' => 0, 'read' => 1") == 2
+    assert "db.php" in read_user_data(resources)
+    assert "db.php" not in write_user_data(resources)
+
+
+def test_read_replicas_are_rejected_with_the_efs_content_storage(tmp_path):
+
+    with pytest.raises(ValueError, match="Database read replicas cannot be combined with the efs content storage"):
+        wordpress_resources(tmp_path, content_storage="efs", database_read_replicas=1)
+
+
+def test_read_fleet_instance_types_only_set_their_web_server_variables(tmp_path):
+
+    user_data = read_user_data(wordpress_resources(tmp_path, read_fleet={
+        "instance_types": ["t3.micro", "t3.large", "m5.xlarge"]}))
+
+    assert "t3.large)\n" in user_data and "m5.xlarge)\n" in user_data
+    assert user_data.count("WEB_PHP_MAX_CHILDREN=") == 4
+    assert user_data.count("cat > /etc/php-fpm.d/wordpress.conf") == 1
+    assert user_data.index("esac\n") < user_data.index("cat > /etc/php-fpm.d/wordpress.conf")
+
+
+def resources_of_type(resources, resource_type):
+
+    return dict((logical_id, resource) for logical_id, resource in resources.items()
+                if resource["Type"] == resource_type)
+
+
+def target_group_attributes(resources):
+
+    return dict((attribute["Key"], attribute["Value"])
+                for attribute in resources["prodTargetGroup"]["Properties"]["TargetGroupAttributes"])
+
+
+def test_read_nodes_track_the_requests_and_the_cpu_of_the_stage(tmp_path):
+
+    resources = wordpress_resources(tmp_path, read_scaling={"scheduled_actions": [
+        {"name": "morning_peak", "recurrence": "0 7 * * MON-FRI", "min_size": 2, "max_size": 6}]})
+
+    requests_policy = resources["prodReadRequestCountScalingPolicy"]
+    assert requests_policy["DependsOn"] == "ALBListener"
+    assert requests_policy["Properties"]["TargetTrackingConfiguration"]["TargetValue"] == 500.0
+    assert requests_policy["Properties"]["TargetTrackingConfiguration"]["PredefinedMetricSpecification"][
+        "PredefinedMetricType"] == "ALBRequestCountPerTarget"
+    assert resources["prodReadCpuScalingPolicy"]["Properties"]["TargetTrackingConfiguration"]["TargetValue"] == 60.0
+    assert resources["prodReadMorningpeakScheduledAction"]["Properties"] == {
+        "AutoScalingGroupName": {"Ref": "prodAutoScalingGroup"}, "Recurrence": "0 7 * * MON-FRI",
+        "MinSize": 2, "MaxSize": 6}
+    assert set(resources_of_type(resources, "AWS::CloudWatch::Alarm")) == {"prodReadHighCpuAlarm",
+                                                                         "prodReadUnhealthyHostsAlarm"}
+
+
+def test_read_scaling_targets_set_to_none_disable_their_policy(tmp_path):
+
+    resources = wordpress_resources(tmp_path, read_scaling={"target_requests_per_instance": None,
+                                                            "target_cpu_utilization": None})
+
+    assert resources_of_type(resources, "AWS::AutoScaling::ScalingPolicy") == {}
+
+
+def test_content_sync_events_notify_the_read_nodes_of_both_buckets(tmp_path):
+
+    resources = wordpress_resources(tmp_path, content_sync="events")
+
+    for bucket in ("prodBucketWordpressCode", "prodBucketWordpressMediaAssets"):
+        assert resources[bucket]["DependsOn"] == "prodContentChangesTopicPolicy"
+        assert [configuration["Event"] for configuration in resources[bucket]["Properties"][
+            "NotificationConfiguration"]["TopicConfigurations"]] == ["s3:ObjectCreated:*", "s3:ObjectRemoved:*"]
+    assert "prodContentChangesTopic" in resources
+
+    user_data = read_user_data(resources)
+    assert "systemctl start wordpress-content-sync" in user_data
+    assert user_data.count("0 * * * * root aws s3 sync --delete") == 2
+    assert "*/1 * * * *" not in user_data
+    assert "wordpress-content-sync" not in write_user_data(resources)
+
+
+def test_content_sync_cron_syncs_the_buckets_every_minute(tmp_path):
+
+    resources = wordpress_resources(tmp_path)
+
+    assert "prodContentChangesTopic" not in resources
+    assert "NotificationConfiguration" not in resources["prodBucketWordpressCode"]["Properties"]
+    assert read_user_data(resources).count("*/1 * * * * root aws s3 sync --delete") == 2
+
+
+def test_efs_content_is_mounted_by_every_node_once_its_mount_targets_exist(tmp_path):
+
+    resources = wordpress_resources(tmp_path, content_storage="efs",
+                                    efs={"throughput_mode": "provisioned", "provisioned_throughput": 10})
+
+    file_system = resources["prodContentFileSystem"]["Properties"]
+    assert file_system["ThroughputMode"] == "provisioned"
+    assert file_system["ProvisionedThroughputInMibps"] == 10.0
+    assert file_system["Encrypted"] == "true"
+
+    mount_targets = sorted(resources_of_type(resources, "AWS::EFS::MountTarget"))
+    assert len(mount_targets) == 2
+    assert sorted(resources["prodAutoScalingGroup"]["DependsOn"]) == mount_targets
+    assert sorted(resources["prodWriteWordpressEc2Instance"]["DependsOn"]) == mount_targets
+    for user_data in (read_user_data(resources), write_user_data(resources)):
+        assert "until mount /var/www/html/wp-content" in user_data
+
+
+def test_site_cdn_serves_the_pages_and_only_bypasses_the_admin(tmp_path):
+
+    resources = wordpress_resources(tmp_path, site_cdn={"page_ttl": 60})
+
+    distribution = resources["prodCloudfrontDistribution"]["Properties"]["DistributionConfig"]
+    assert [origin["Id"] for origin in distribution["Origins"]] == ["MediaAssetsOrigin", "SiteOrigin"]
+    assert distribution["DefaultCacheBehavior"]["TargetOriginId"] == "SiteOrigin"
+    assert distribution["DefaultCacheBehavior"]["DefaultTTL"] == 60
+    assert distribution["DefaultCacheBehavior"]["ForwardedValues"]["Cookies"]["Forward"] == "whitelist"
+
+    behaviors = dict((behavior["PathPattern"], behavior) for behavior in distribution["CacheBehaviors"])
+    assert [behavior["PathPattern"] for behavior in distribution["CacheBehaviors"]] == \
+        ["wp-admin/*", "wp-login.php", "wp-content/uploads/*", "wp-content/*", "wp-includes/*"]
+    assert behaviors["wp-admin/*"]["MaxTTL"] == 0
+    assert behaviors["wp-content/uploads/*"]["TargetOriginId"] == "MediaAssetsOrigin"
+    assert behaviors["wp-includes/*"]["DefaultTTL"] == 604800
+
+    # Uploads keep their path behind the distribution instead of being redirected to it
+    assert "rewriterule" not in read_user_data(resources)
+    assert "/wp-content/uploads/ /var/www/html/wp-content/uploads" in read_user_data(resources)
+
+
+def test_media_distribution_redirects_the_uploads_without_site_cdn(tmp_path):
+
+    resources = wordpress_resources(tmp_path)
+
+    distribution = resources["prodCloudfrontDistribution"]["Properties"]["DistributionConfig"]
+    assert distribution["DefaultCacheBehavior"]["TargetOriginId"] == "MediaAssetsOrigin"
+    assert "CacheBehaviors" not in distribution
+    assert "rewriterule ^wp-content/uploads/(.*)$" in read_user_data(resources)
+
+
+def test_baked_image_boots_without_installing_wordpress(tmp_path):
+
+    resources = wordpress_resources(tmp_path, baked_ami_id="ami-12345678", database_read_replicas=1,
+                                    object_cache={})
+
+    launch_template = resources["prodWordPressReadLaunchTemplate"]["Properties"]["LaunchTemplateData"]
+    assert launch_template["ImageId"] == "ami-12345678"
+    assert resources["prodWriteWordpressEc2Instance"]["Properties"]["SpotFleetRequestConfigData"][
+        "LaunchSpecifications"][0]["ImageId"] == "ami-12345678"
+    for user_data in (read_user_data(resources), write_user_data(resources)):
+        assert user_data.startswith("#!/bin/bash\ncd /var/www/html\n")
+        assert "yum install" not in user_data
+        assert "wget" not in user_data
+        assert "cp wp-content/plugins/redis-cache/includes/object-cache.php" in user_data
+    assert "cp wp-content/plugins/ludicrousdb/ludicrousdb/drop-ins/db.php" in read_user_data(resources)
+
+
+def test_web_servers_are_sized_from_their_instance_type(tmp_path):
+
+    resources = wordpress_resources(tmp_path, write_instance_type="m5.xlarge", web_tuning={"php_max_requests": 200})
+
+    write = write_user_data(resources)
+    assert "WEB_INSTANCE_TYPE=m5.xlarge\n" in write and "WEB_PHP_MAX_CHILDREN=32\n" in write
+    assert "WEB_OPCACHE_REVALIDATE_FREQ=0\n" in write
+    assert "WEB_PHP_MAX_REQUESTS=200\n" in write
+
+    read = read_user_data(resources)
+    assert "WEB_INSTANCE_TYPE=t2.micro\n" in read and "WEB_OPCACHE_REVALIDATE_FREQ=60\n" in read
+    # Apache keeps idle connections open longer than the load balancer
+    assert "WEB_KEEPALIVE_TIMEOUT=65\n" in read
+    assert "case $(curl" not in read
+
+
+def test_read_nodes_are_launched_from_a_launch_template_over_spot_pools(tmp_path):
+
+    resources = wordpress_resources(tmp_path, read_fleet={
+        "instance_types": ["t3.small", "t3a.small"], "on_demand_base_capacity": 1, "spot_max_price": 0.01})
+
+    policy = resources["prodAutoScalingGroup"]["Properties"]["MixedInstancesPolicy"]
+    assert policy["LaunchTemplate"]["LaunchTemplateSpecification"] == {
+        "LaunchTemplateId": {"Ref": "prodWordPressReadLaunchTemplate"},
+        "Version": {"Fn::GetAtt": ["prodWordPressReadLaunchTemplate", "LatestVersionNumber"]}}
+    assert policy["LaunchTemplate"]["Overrides"] == [{"InstanceType": "t3.small"}, {"InstanceType": "t3a.small"}]
+    assert policy["InstancesDistribution"] == {
+        "OnDemandAllocationStrategy": "prioritized", "OnDemandBaseCapacity": 1,
+        "OnDemandPercentageAboveBaseCapacity": 0, "SpotAllocationStrategy": "capacity-optimized",
+        "SpotMaxPrice": "0.01"}
+
+
+def test_unknown_spot_allocation_strategy_is_rejected(tmp_path):
+
+    with pytest.raises(ValueError, match="Spot allocation strategy"):
+        wordpress_resources(tmp_path, read_fleet={"spot_allocation_strategy": "diversified"})
+
+
+def test_load_balancer_profile_reaches_the_target_group_and_the_listeners(tmp_path):
+
+    resources = wordpress_resources(tmp_path, load_balancer={
+        "stickiness": 3600, "certificate_arn": "arn:aws:acm:us-east-1:123456789012:certificate/example"})
+
+    assert target_group_attributes(resources) == {
+        "deregistration_delay.timeout_seconds": "30", "slow_start.duration_seconds": "0",
+        "load_balancing.algorithm.type": "least_outstanding_requests", "stickiness.enabled": "true",
+        "stickiness.type": "lb_cookie", "stickiness.lb_cookie.duration_seconds": "3600"}
+    assert resources["prodTargetGroup"]["Properties"]["HealthCheckPath"] == "/healthy.html"
+    assert {"Key": "routing.http2.enabled", "Value": "true"} in \
+        resources["prodApplicationLoadBalancer"]["Properties"]["LoadBalancerAttributes"]
+
+    https_listener = resources["ALBHttpsListener"]["Properties"]
+    assert https_listener["Port"] == 443
+    assert https_listener["SslPolicy"] == "ELBSecurityPolicy-TLS-1-2-2017-01"
+    assert ssh_rule(resources) in resources["prodWebDMZSecurityGroup"]["Properties"]["SecurityGroupIngress"]
+    assert any(rule["FromPort"] == "443" for rule in
+               resources["prodWebDMZSecurityGroup"]["Properties"]["SecurityGroupIngress"])
+
+
+def test_load_balancer_slow_start_cannot_be_combined_with_least_outstanding_requests(tmp_path):
+
+    with pytest.raises(ValueError, match="slow start"):
+        wordpress_resources(tmp_path, load_balancer={"slow_start": 30})
+
+    resources = wordpress_resources(tmp_path, load_balancer={"slow_start": 30, "least_outstanding_requests": False})
+    assert target_group_attributes(resources)["load_balancing.algorithm.type"] == "round_robin"
+    assert "ALBHttpsListener" not in resources
+
+
+def test_aurora_serverless_cluster_behind_an_rds_proxy(tmp_path):
+
+    resources = wordpress_resources(tmp_path, database_engine_mode="aurora-serverless-v2", database_read_replicas=1,
+                                    database_proxy={"max_connections_percent": 75})
+
+    cluster = resources["prodRdsCluster"]["Properties"]
+    assert cluster["Engine"] == "aurora-mysql"
+    assert cluster["ServerlessV2ScalingConfiguration"] == {"MinCapacity": 0.5, "MaxCapacity": 4}
+    assert resources["prodRdsInstance"]["Properties"]["DBInstanceClass"] == "db.serverless"
+    assert resources["prodRdsReadReplica1"]["DependsOn"] == "prodRdsInstance"
+    assert resources["prodRdsReadReplica1"]["Properties"]["DBClusterIdentifier"] == {"Ref": "prodRdsCluster"}
+
+    target_group = resources["prodRdsProxyTargetGroup"]["Properties"]
+    assert target_group["DBClusterIdentifiers"] == [{"Ref": "prodRdsCluster"}]
+    assert target_group["ConnectionPoolConfigurationInfo"]["MaxConnectionsPercent"] == 75
+
+    # Writes go through the proxy, reads to the reader endpoint of the cluster
+    database_host = resources["prodWordPressReadLaunchTemplate"]["Properties"]["LaunchTemplateData"]["UserData"][
+        "Fn::Base64"]["Fn::Join"][1]
+    assert {"Fn::GetAtt": ["prodRdsProxy", "Endpoint"]} in database_host
+    assert {"Fn::GetAtt": ["prodRdsCluster", "ReadEndpoint.Address"]} in database_host
+
+
+def test_provisioned_aurora_keeps_the_instance_class(tmp_path):
+
+    resources = wordpress_resources(tmp_path, database_engine_mode="aurora", database_instance_class="db.r5.large")
+
+    assert "ServerlessV2ScalingConfiguration" not in resources["prodRdsCluster"]["Properties"]
+    assert resources["prodRdsInstance"]["Properties"]["DBInstanceClass"] == "db.r5.large"
+    assert resources["prodRdsParameterGroup"]["Properties"]["Family"] == "aurora-mysql8.0"
+
+
+def test_unknown_database_engine_mode_is_rejected(tmp_path):
+
+    with pytest.raises(ValueError, match="Database engine mode"):
+        wordpress_resources(tmp_path, database_engine_mode="aurora-serverless-v1")
+
+
+def test_database_gets_its_parameter_group_and_storage_profile(tmp_path):
+
+    resources = wordpress_resources(tmp_path, database_storage={"allocated_storage": 400, "iops": 6000},
+                                    database_monitoring={"performance_insights": True})
+
+    parameter_group = resources["prodRdsParameterGroup"]["Properties"]
+    assert parameter_group["Family"] == "mysql5.7"
+    assert parameter_group["Parameters"]["query_cache_type"] == "0"
+    assert parameter_group["Parameters"]["innodb_io_capacity"] == "3000"
+    assert parameter_group["Parameters"]["performance_schema"] == "1"
+
+    instance = resources["prodRdsInstance"]["Properties"]
+    assert instance["DBParameterGroupName"] == {"Ref": "prodRdsParameterGroup"}
+    assert instance["StorageType"] == "gp3"
+    assert instance["Iops"] == 6000
+    assert instance["EnablePerformanceInsights"] == "true"
+    assert instance["PerformanceInsightsRetentionPeriod"] == 7
+
+
+@pytest.mark.parametrize("database_storage, message", [
+    ({"storage_type": "standard"}, "Database storage type"),
+    ({"storage_type": "io1"}, "io1 storage needs provisioned iops"),
+    ({"iops": 6000}, "from 400 GiB"),
+])
+def test_invalid_database_storage_is_rejected(tmp_path, database_storage, message):
+
+    with pytest.raises(ValueError, match=message):
+        wordpress_resources(tmp_path, database_storage=database_storage)
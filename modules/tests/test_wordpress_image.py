@@ -0,0 +1,28 @@
+import json
+
+from generate_wordpress_stacks import stage_config
+from Shared import environment, fleet, stack_generator
+from Wordpress import user_data
+
+
+def test_packer_template_bakes_the_stage_independent_user_data(tmp_path):
+
+    config = fleet.merge_config(stage_config, {"output_dir": str(tmp_path),
+                                               "wordpress_image": {"region": "eu-west-1"}})
+    image = stack_generator.wordpress_image_build(config, environment.from_config(config))
+
+    with open(image.create_image_build()) as f:
+        template = json.load(f)
+
+    assert template["variables"]["region"] == "eu-west-1"
+    assert template["builders"][0]["ami_name"] == "prod-wordpress-{{timestamp}}"
+    assert template["provisioners"][0]["inline"] == user_data.BAKED_IMAGE.splitlines()
+    assert "ludicrousdb" in user_data.BAKED_IMAGE and "redis-cache" in user_data.BAKED_IMAGE
+
+
+def test_stages_without_an_image_build_skip_the_packer_template(tmp_path):
+
+    config = fleet.merge_config(stage_config, {"output_dir": str(tmp_path)})
+    config["wordpress_image"] = None
+
+    assert stack_generator.wordpress_image_build(config, environment.from_config(config)) is None